@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+
+import db_pool
+
+# Daily time records: one row per employee per day, kept current by
+# insert_time_log so payroll reports never scan tbl_extracted_logs
+WORK_START = os.getenv("DTR_WORK_START", "08:00:00")
+WORK_END = os.getenv("DTR_WORK_END", "17:00:00")
+GRACE_MINUTES = int(os.getenv("DTR_GRACE_MINUTES", "0"))
+BREAK_START = os.getenv("DTR_BREAK_START", "12:00:00")
+BREAK_END = os.getenv("DTR_BREAK_END", "13:00:00")
+
+CREATE_DAILY_ATTENDANCE = """
+    CREATE TABLE IF NOT EXISTS daily_attendance (
+        emp_no VARCHAR(50) NOT NULL,
+        log_date DATE NOT NULL,
+        first_in TIME NULL,
+        last_out TIME NULL,
+        log_count INT UNSIGNED NOT NULL DEFAULT 0,
+        worked_minutes INT UNSIGNED NOT NULL DEFAULT 0,
+        late_minutes INT UNSIGNED NULL,
+        undertime_minutes INT UNSIGNED NULL,
+        PRIMARY KEY (emp_no, log_date),
+        KEY idx_daily_attendance_date (log_date)
+    )
+"""
+
+# The month report walks users by division, then daily_attendance by primary key
+USERS_INDEX = ("idx_users_division", "(division_desc, emp_no)")
+
+# Worked time is first IN to last OUT minus the part of the lunch break it
+# covers; late and undertime stay NULL until there is an IN / OUT to measure
+DERIVED = """
+    worked_minutes = IF(first_in IS NULL OR last_out IS NULL OR last_out <= first_in, 0,
+        (TIME_TO_SEC(last_out) - TIME_TO_SEC(first_in)
+         - GREATEST(0, TIME_TO_SEC(LEAST(last_out, TIME(%(break_end)s)))
+                       - TIME_TO_SEC(GREATEST(first_in, TIME(%(break_start)s))))) DIV 60),
+    late_minutes = IF(first_in IS NULL, NULL,
+        IF(TIME_TO_SEC(first_in) <= TIME_TO_SEC(TIME(%(work_start)s)) + %(grace)s * 60, 0,
+           CEIL((TIME_TO_SEC(first_in) - TIME_TO_SEC(TIME(%(work_start)s))) / 60))),
+    undertime_minutes = IF(last_out IS NULL, NULL,
+        GREATEST(0, CEIL((TIME_TO_SEC(TIME(%(work_end)s)) - TIME_TO_SEC(last_out)) / 60)))
+"""
+
+
+def _schedule() -> dict:
+    return {
+        "work_start": WORK_START,
+        "work_end": WORK_END,
+        "grace": GRACE_MINUTES,
+        "break_start": BREAK_START,
+        "break_end": BREAK_END,
+    }
+
+
+async def ensure_schema(cursor):
+    await cursor.execute(CREATE_DAILY_ATTENDANCE)
+    name, columns = USERS_INDEX
+    await cursor.execute(
+        """SELECT COUNT(*) FROM information_schema.STATISTICS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND INDEX_NAME = %s""",
+        (name,)
+    )
+    if (await cursor.fetchone())[0] == 0:
+        await db_pool.ddl(cursor, f"CREATE INDEX {name} ON users {columns}")
+
+
+# Fold clock-ins/outs, given as (emp_no, log_date, log_time, mode), into their
+# days. Runs in the caller's transaction next to the tbl_extracted_logs insert;
+# the row locks serialize concurrent logs of the same employee.
+async def record_many(cursor, logs):
+    rows = []
+    for emp_no, log_date, log_time, mode in logs:
+        rows.append((emp_no, log_date, log_time if mode == "I" else None, log_time if mode == "O" else None))
+    await cursor.executemany(
+        """INSERT INTO daily_attendance (emp_no, log_date, first_in, last_out, log_count)
+           VALUES (%s, %s, %s, %s, 1)
+           ON DUPLICATE KEY UPDATE
+               first_in = IF(VALUES(first_in) IS NULL, first_in,
+                             LEAST(COALESCE(first_in, VALUES(first_in)), VALUES(first_in))),
+               last_out = IF(VALUES(last_out) IS NULL, last_out,
+                             GREATEST(COALESCE(last_out, VALUES(last_out)), VALUES(last_out))),
+               log_count = log_count + 1""",
+        rows
+    )
+    days = sorted({(emp_no, log_date) for emp_no, log_date, _, _ in rows})
+    params = _schedule()
+    keys = []
+    for i, (emp_no, log_date) in enumerate(days):
+        params[f"emp_no_{i}"], params[f"log_date_{i}"] = emp_no, log_date
+        keys.append(f"(%(emp_no_{i})s, %(log_date_{i})s)")
+    await cursor.execute(
+        f"UPDATE daily_attendance SET {DERIVED} WHERE (emp_no, log_date) IN ({', '.join(keys)})",
+        params
+    )
+
+
+async def record(cursor, emp_no: str, log_date, log_time, mode: str):
+    await record_many(cursor, [(emp_no, log_date, log_time, mode)])
+
+
+# Recompute the summary for a date range (everything by default) from the raw logs
+async def rebuild(db, date_from=None, date_to=None) -> int:
+    # Column names are case-insensitive, so one filter fits both tables
+    conditions = []
+    if date_from:
+        conditions.append("LOG_DATE >= %(date_from)s")
+    if date_to:
+        conditions.append("LOG_DATE <= %(date_to)s")
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    params = _schedule()
+    params.update(date_from=date_from, date_to=date_to)
+
+    cursor = await db.cursor()
+    try:
+        await ensure_schema(cursor)
+        await cursor.execute(f"DELETE FROM daily_attendance{where}", params)
+        # LOG_TIME is written as 'HH:MM:SS AM/PM' with a 24-hour clock; the first
+        # eight characters are the time of day
+        await cursor.execute(
+            f"""INSERT INTO daily_attendance (emp_no, log_date, first_in, last_out, log_count)
+                SELECT EMP_NO, LOG_DATE,
+                       MIN(IF(LOG_MODE = 'I', TIME(LEFT(LOG_TIME, 8)), NULL)),
+                       MAX(IF(LOG_MODE = 'O', TIME(LEFT(LOG_TIME, 8)), NULL)),
+                       COUNT(*)
+                FROM tbl_extracted_logs{where}
+                GROUP BY EMP_NO, LOG_DATE""",
+            params
+        )
+        rows = cursor.rowcount
+        await cursor.execute(f"UPDATE daily_attendance SET {DERIVED}{where}", params)
+        await db.commit()
+        logging.info(f"Rebuilt {rows} daily attendance rows")
+        return rows
+    finally:
+        await cursor.close()
+
+
+def _time(value):
+    # The driver returns TIME columns as timedelta
+    if value is None:
+        return None
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# First day of a YYYY-MM month. strptime alone would also take "2024-1", so the
+# shape is checked first; raises ValueError for anything else.
+def parse_month(month: str) -> date:
+    if not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise ValueError(f"month must be YYYY-MM, got {month!r}")
+    return datetime.strptime(month, "%Y-%m").date()
+
+
+# One month of daily records for every employee of a division, grouped per employee
+async def month_report(cursor, division: str, start: date) -> dict:
+    end = (start + timedelta(days=32)).replace(day=1)
+    await cursor.execute(
+        """SELECT u.emp_no,
+                  CONCAT(u.first_name, ' ', u.middle_name, ' ', u.last_name) AS employee_name,
+                  d.log_date, d.first_in, d.last_out, d.worked_minutes,
+                  d.late_minutes, d.undertime_minutes
+           FROM users u
+           JOIN daily_attendance d ON d.emp_no = u.emp_no
+                AND d.log_date >= %s AND d.log_date < %s
+           WHERE u.division_desc = %s
+           ORDER BY u.emp_no, d.log_date""",
+        (start, end, division)
+    )
+    employees = {}
+    for row in await cursor.fetchall():
+        employee = employees.setdefault(row["emp_no"], {
+            "emp_no": row["emp_no"],
+            "employee_name": row["employee_name"],
+            "days": [],
+            "total_hours": 0.0,
+            "total_late_minutes": 0,
+            "total_undertime_minutes": 0,
+        })
+        employee["days"].append({
+            "date": row["log_date"].isoformat(),
+            "first_in": _time(row["first_in"]),
+            "last_out": _time(row["last_out"]),
+            "hours": round(row["worked_minutes"] / 60, 2),
+            "late_minutes": row["late_minutes"],
+            "undertime_minutes": row["undertime_minutes"],
+        })
+        employee["total_hours"] = round(employee["total_hours"] + row["worked_minutes"] / 60, 2)
+        employee["total_late_minutes"] += row["late_minutes"] or 0
+        employee["total_undertime_minutes"] += row["undertime_minutes"] or 0
+    return {"division": division, "month": start.strftime("%Y-%m"), "employees": list(employees.values())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the daily_attendance summary")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="recompute daily_attendance from tbl_extracted_logs")
+    rebuild_parser.add_argument("--from", dest="date_from", help="first LOG_DATE (YYYY-MM-DD)")
+    rebuild_parser.add_argument("--to", dest="date_to", help="last LOG_DATE (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from main import dbconnect
+
+    async def run():
+        db = await dbconnect()
+        try:
+            await rebuild(db, args.date_from, args.date_to)
+        finally:
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
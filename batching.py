@@ -0,0 +1,84 @@
+import asyncio
+import os
+
+import numpy as np
+
+import embeddings
+import inference
+
+# Probe faces that arrive within BATCH_WINDOW_MS of each other (up to
+# BATCH_MAX_SIZE faces) share one Facenet forward pass. During the morning
+# clock-in burst this replaces hundreds of batch-of-one calls with a few
+# stacked ones; outside the burst a lone request waits at most one window.
+ENABLED = os.getenv("BATCH_ENABLED", "1") == "1"
+WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "15"))
+MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+
+
+class MicroBatcher:
+    def __init__(self, forward, window_ms: float = WINDOW_MS, max_size: int = MAX_SIZE):
+        self.forward = forward
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue = None
+        self._collector = None
+        self._running = set()
+
+    # Embed the faces of one request; resolves once its batch has run
+    async def embed(self, faces: list) -> list:
+        loop = asyncio.get_running_loop()
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._collector = loop.create_task(self._collect())
+
+        future = loop.create_future()
+        self._queue.put_nowait((faces, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            size = len(items[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                size += len(item[0])
+
+            # Run the batch in the background so the next window can fill meanwhile
+            task = loop.create_task(self._run(items))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, items):
+        batch = np.concatenate([face for faces, _ in items for face in faces])
+        try:
+            vectors = await inference.run(self.forward, batch)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for faces, future in items:
+            if not future.done():
+                future.set_result(list(vectors[offset:offset + len(faces)]))
+            offset += len(faces)
+
+
+_batcher = MicroBatcher(embeddings.forward)
+
+
+# Embed preprocessed probe faces (from embeddings.extract_faces)
+async def embed(faces: list) -> list:
+    if not ENABLED:
+        return list(await inference.run(embeddings.forward, np.concatenate(faces)))
+    return await _batcher.embed(faces)
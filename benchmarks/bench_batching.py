@@ -0,0 +1,91 @@
+"""Throughput and tail latency of Facenet embedding with and without micro-batching.
+
+Simulates a clock-in burst: --requests probes arrive at random times within
+--spread-ms and each waits for its embedding. Detection is excluded, so the
+numbers isolate the forward pass that batching changes.
+
+    python -m benchmarks.bench_batching --requests 300 --spread-ms 2000
+    python -m benchmarks.bench_batching --window-ms 20 --max-size 32 --json batching.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+import embeddings
+import inference
+from batching import MicroBatcher
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) * 1000 if values else 0.0
+
+
+async def burst(embed, requests: int, spread_ms: float) -> dict:
+    rng = random.Random(42)
+    arrivals = sorted(rng.uniform(0, spread_ms / 1000) for _ in range(requests))
+    face = np.random.default_rng(42).random((1, 160, 160, 3), dtype=np.float32)
+    latencies = []
+    start = time.perf_counter()
+
+    async def client(offset):
+        await asyncio.sleep(offset)
+        sent = time.perf_counter()
+        await embed([face])
+        latencies.append(time.perf_counter() - sent)
+
+    await asyncio.gather(*(client(offset) for offset in arrivals))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+    }
+
+
+async def main(args):
+    # Load the model before timing anything
+    embeddings.forward(np.zeros((1, 160, 160, 3), dtype=np.float32))
+
+    async def unbatched(faces):
+        return list(await inference.run(embeddings.forward, np.concatenate(faces)))
+
+    batcher = MicroBatcher(embeddings.forward, window_ms=args.window_ms, max_size=args.max_size)
+    results = {
+        "config": {
+            "requests": args.requests,
+            "spread_ms": args.spread_ms,
+            "window_ms": args.window_ms,
+            "max_size": args.max_size,
+            "inference_workers": inference.MAX_WORKERS,
+        },
+        "unbatched": await burst(unbatched, args.requests, args.spread_ms),
+        "batched": await burst(batcher.embed, args.requests, args.spread_ms),
+    }
+
+    for mode in ("unbatched", "batched"):
+        r = results[mode]
+        print(f"{mode:>10}: {r['throughput_rps']:>7} req/s  "
+              f"p50 {r['p50_ms']:>7} ms  p95 {r['p95_ms']:>7} ms  p99 {r['p99_ms']:>7} ms")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--spread-ms", type=float, default=2000)
+    parser.add_argument("--window-ms", type=float, default=15)
+    parser.add_argument("--max-size", type=int, default=16)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    # The burst is meant to saturate the pool, not to be turned away by it
+    inference.QUEUE_SIZE = max(inference.QUEUE_SIZE, args.requests)
+    asyncio.run(main(args))
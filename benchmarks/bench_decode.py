@@ -0,0 +1,114 @@
+"""Latency and peak memory of full-size vs bounded-resolution upload decoding.
+
+Decodes phone-sized JPEGs (webcam 1280x720, 12 MP and 48 MP by default, or
+your own photos with --images) with plain cv2.imdecode and with
+preprocess.decode, optionally followed by the OpenCV Haar face detector that
+DeepFace's "opencv" backend uses. Each mode runs in a fresh process so its
+peak RSS is its own.
+
+    python -m benchmarks.bench_decode
+    python -m benchmarks.bench_decode --images ~/phone-photos --detect --max-dimension 960 --json decode.json
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import cv2
+import numpy as np
+
+SIZES = {"webcam_720p": (1280, 720), "phone_12mp": (4032, 3024), "phone_48mp": (8000, 6000)}
+
+
+# Smooth gradients plus sensor-like noise, so it compresses like a photo
+def synthetic_photo(width: int, height: int, rng) -> bytes:
+    small = rng.integers(0, 255, (height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 12, img.shape, dtype=np.uint8))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+# The cascade ships with opencv-python; some builds only have DeepFace's copy
+def cascade_path() -> str:
+    name = "haarcascade_frontalface_default.xml"
+    for directory in (getattr(getattr(cv2, "data", None), "haarcascades", ""),
+                      os.path.join(os.path.expanduser("~"), ".deepface", "weights")):
+        if os.path.exists(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+    raise SystemExit(f"{name} not found; run without --detect")
+
+
+def run_mode(data: bytes, mode: str, max_dimension: int, detect: bool, repeats: int, queue):
+    import preprocess
+
+    cascade = cv2.CascadeClassifier(cascade_path()) if detect else None
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        if mode == "full":
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            img = preprocess.decode(data, max_dimension)
+        if detect:
+            cascade.detectMultiScale(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 1.1, 10)
+        timings.append(time.perf_counter() - started)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = np.array(timings) * 1000
+    queue.put({
+        "decoded": f"{img.shape[1]}x{img.shape[0]}",
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_delta_mb": round((peak - baseline) / 1024, 1),
+    })
+
+
+def measure(data: bytes, mode: str, args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_mode, args=(data, mode, args.max_dimension, args.detect, args.repeats, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise SystemExit(f"{mode} decode run failed")
+    return queue.get()
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    if args.images:
+        inputs = {}
+        for path in sorted(glob.glob(os.path.join(os.path.expanduser(args.images), "*.jp*g")))[:args.limit]:
+            with open(path, "rb") as fh:
+                inputs[os.path.basename(path)] = fh.read()
+    else:
+        inputs = {name: synthetic_photo(*size, rng) for name, size in SIZES.items()}
+
+    results = {"config": {"max_dimension": args.max_dimension, "detect": args.detect, "repeats": args.repeats},
+               "images": []}
+    for name, data in inputs.items():
+        full = measure(data, "full", args)
+        bounded = measure(data, "bounded", args)
+        results["images"].append({"image": name, "bytes": len(data), "full": full, "bounded": bounded})
+        print(f"{name:>16} {len(data) / 1e6:5.1f} MB  full {full['decoded']:>10} p50 {full['p50_ms']:8.2f} ms "
+              f"+{full['peak_rss_delta_mb']:6.1f} MB | bounded {bounded['decoded']:>10} p50 {bounded['p50_ms']:8.2f} ms "
+              f"+{bounded['peak_rss_delta_mb']:6.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="folder of real JPEGs to use instead of synthetic ones")
+    parser.add_argument("--limit", type=int, default=10, help="at most this many --images")
+    parser.add_argument("--max-dimension", type=int, default=1280)
+    parser.add_argument("--detect", action="store_true", help="include Haar face detection in the timing")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+"""Search latency of the kiosk face index at different enrolment sizes.
+
+Fills a FaceIndex with random unit vectors and times single-probe searches,
+for the exact NumPy scan and (when hnswlib is installed) the approximate
+index, including ANN recall@1 against the exact answer.
+
+    python -m benchmarks.bench_index
+    python -m benchmarks.bench_index --sizes 1000 10000 100000 --queries 500 --json index.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from face_index import FaceIndex, hnswlib
+
+
+def build(vectors, ann: bool) -> tuple:
+    index = FaceIndex(dim=vectors.shape[1], ann_min_size=0)
+    started = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.upsert(f"EMP-{i:06d}", vector)
+    if ann:
+        index._build_ann()
+    return index, time.perf_counter() - started
+
+
+def measure(index, queries) -> tuple:
+    latencies, answers = [], []
+    for query in queries:
+        started = time.perf_counter()
+        answers.append(index.search(query, k=1)[0][0])
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000
+    stats = {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+    return stats, answers
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    results = []
+    for size in args.sizes:
+        vectors = rng.standard_normal((size, 128), dtype=np.float32)
+        # Probes are noisy copies of enrolled faces, like a real clock-in
+        picks = rng.integers(0, size, args.queries)
+        queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, 128), dtype=np.float32)
+
+        index, build_s = build(vectors, ann=False)
+        exact, expected = measure(index, queries)
+        row = {"size": size, "exact": dict(exact, build_s=round(build_s, 3))}
+
+        if hnswlib and not args.exact_only:
+            index, build_s = build(vectors, ann=True)
+            ann, answers = measure(index, queries)
+            recall = float(np.mean([a == e for a, e in zip(answers, expected)]))
+            row["ann"] = dict(ann, build_s=round(build_s, 3), recall_at_1=round(recall, 4))
+
+        results.append(row)
+        line = f"{size:>7} faces  exact p50 {exact['p50_ms']:>7} ms  p99 {exact['p99_ms']:>7} ms"
+        if "ann" in row:
+            line += f"  |  ann p50 {row['ann']['p50_ms']:>6} ms  p99 {row['ann']['p99_ms']:>6} ms  recall {row['ann']['recall_at_1']}"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--exact-only", action="store_true", help="skip the hnswlib index")
+    parser.add_argument("--json", help="also write the results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+"""Worker start-up time and memory, before and after the recognition model loads.
+
+`import` mode imports main in a fresh interpreter and reports the import time
+and peak RSS, then runs recognition.warm_up() and reports both again, so the
+cost that lazy loading keeps off a worker's start-up shows up directly.
+
+`serve` mode starts `uvicorn main:app --workers N` (DB settings come from the
+environment, as for the API) and reports the time until it answers and each
+worker's RSS, once right away and once --settle seconds later.
+
+    python -m benchmarks.bench_startup import
+    RECOGNITION_WARM_UP=off python -m benchmarks.bench_startup serve --workers 4 --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter() - started
+rss_imported = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+result = {"import_s": round(imported, 3), "import_peak_rss_mb": round(rss_imported / 1024, 1)}
+import recognition
+started = time.perf_counter()
+try:
+    recognition.warm_up()
+    result["warm_up_s"] = round(time.perf_counter() - started, 3)
+    result["warm_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+except Exception as e:
+    result["warm_up_error"] = str(e)[:200]
+print(json.dumps(result))
+"""
+
+
+def import_mode(args) -> dict:
+    runs = []
+    for _ in range(args.repeats):
+        process = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True)
+        if process.returncode != 0:
+            raise SystemExit(process.stderr)
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    return {key: round(sum(run[key] for run in runs) / len(runs), 3) if isinstance(value, float) else value
+            for key, value in runs[0].items()}
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def worker_pids(parent: int) -> list:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as fh:
+                    if int(fh.read().rsplit(")", 1)[1].split()[1]) == parent:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(pids)
+
+
+def serve_mode(args) -> dict:
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    started = time.perf_counter()
+    server = subprocess.Popen(command)
+    try:
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{args.port}/", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if server.poll() is not None:
+                raise SystemExit("uvicorn exited during startup")
+            time.sleep(0.1)
+        ready = time.perf_counter() - started
+        # Children of the uvicorn supervisor (its multiprocessing helpers included)
+        at_ready = {pid: rss_mb(pid) for pid in worker_pids(server.pid)}
+        time.sleep(args.settle)
+        settled = {pid: rss_mb(pid) for pid in worker_pids(server.pid)}
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "warm_up_mode": os.getenv("RECOGNITION_WARM_UP", "background"),
+        "workers": args.workers,
+        "first_response_s": round(ready, 3),
+        "rss_mb_at_ready": list(at_ready.values()),
+        f"rss_mb_after_{args.settle:g}s": list(settled.values()),
+        "total_rss_mb_after_settle": round(sum(settled.values()), 1),
+    }
+
+
+def main(args):
+    results = import_mode(args) if args.mode == "import" else serve_mode(args)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["import", "serve"])
+    parser.add_argument("--repeats", type=int, default=3, help="import runs to average")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--settle", type=float, default=30, help="seconds to wait before the second RSS reading")
+    parser.add_argument("--json", help="also write the results to this file")
+    main(parser.parse_args())
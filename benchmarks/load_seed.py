@@ -0,0 +1,220 @@
+"""Seed a scratch MySQL database for the load test.
+
+Creates the tables the API reads (when missing) and fills them with synthetic
+employees (emp_no BENCH-000000...), enrolled face images, an IP allowlist
+that admits 127.0.0.1, a few pending face update requests and months of
+weekday clock-ins/outs, then rebuilds daily_attendance. Connection settings
+come from DB_HOST / DB_USER / DB_PASSWORD / DB_NAME, as for the API. Point
+them at a throwaway database: the seeder refuses to touch a users table that
+holds anything but its own rows unless --force is given.
+
+Real face photos (--faces, a folder of JPEGs such as an LFW subset) are
+assigned to employees round-robin and embedded up front, so /recognize_face/
+exercises the full match path. Without them every clock-in takes the
+no-face path, which still measures decode and detection.
+
+    python -m benchmarks.load_seed --employees 500 --months 6 --faces ~/lfw-sample
+"""
+import argparse
+import asyncio
+import ipaddress
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import bcrypt
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import attendance
+import db_pool
+import embeddings
+import image_store
+import ip_allowlist
+import timelogs
+from benchmarks.synthetic import DIVISIONS, PASSWORD, PREFIX, emp_no, photos
+
+# Only what the API reads; a production schema has more columns
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+           emp_no VARCHAR(50) NOT NULL PRIMARY KEY,
+           email VARCHAR(255) NOT NULL,
+           password VARCHAR(255) NOT NULL,
+           first_name VARCHAR(100), middle_name VARCHAR(100), last_name VARCHAR(100),
+           ext_name VARCHAR(20), division_desc VARCHAR(255), position_desc VARCHAR(255),
+           KEY idx_users_email (email)
+       )""",
+    """CREATE TABLE IF NOT EXISTS system_access (
+           emp_no VARCHAR(50) NOT NULL PRIMARY KEY,
+           role_id VARCHAR(10) NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS face_image (
+           emp_no VARCHAR(50) NOT NULL PRIMARY KEY,
+           image LONGBLOB NULL,
+           last_update DATETIME NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS approval_requests (
+           request_id INT AUTO_INCREMENT PRIMARY KEY,
+           emp_no VARCHAR(50) NOT NULL,
+           image LONGBLOB NULL,
+           thumbnail MEDIUMBLOB NULL,
+           date_requested DATETIME NOT NULL,
+           approval_status VARCHAR(20) NOT NULL,
+           approval_date DATETIME NULL,
+           KEY idx_approval_emp (emp_no, date_requested)
+       )""",
+    """CREATE TABLE IF NOT EXISTS tbl_extracted_logs (
+           id INT AUTO_INCREMENT PRIMARY KEY,
+           EMP_NO VARCHAR(50) NOT NULL,
+           LOG_DATE DATE NOT NULL,
+           LOG_TIME VARCHAR(20) NOT NULL,
+           LOG_MODE CHAR(1) NOT NULL,
+           LOG_IMG_PATH VARCHAR(255) NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS valid_ip (
+           id INT AUTO_INCREMENT PRIMARY KEY,
+           ip VARCHAR(64) NOT NULL,
+           emp_no VARCHAR(50) NOT NULL,
+           added_by VARCHAR(50) NOT NULL,
+           date_added DATETIME NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS blacklisted_tokens (
+           token VARCHAR(512) NOT NULL,
+           emp_no VARCHAR(50) NOT NULL,
+           expires_at DATETIME NOT NULL,
+           KEY idx_blacklisted_expires (expires_at)
+       )""",
+]
+
+# Rows of an earlier run, removed before seeding again
+CLEANUP = [
+    "DELETE FROM tbl_extracted_logs WHERE EMP_NO LIKE %s",
+    "DELETE FROM daily_attendance WHERE emp_no LIKE %s",
+    "DELETE FROM approval_requests WHERE emp_no LIKE %s",
+    "DELETE FROM face_embedding WHERE emp_no LIKE %s",
+    "DELETE FROM face_image WHERE emp_no LIKE %s",
+    "DELETE FROM valid_ip WHERE emp_no LIKE %s",
+    "DELETE FROM system_access WHERE emp_no LIKE %s",
+    "DELETE FROM users WHERE emp_no LIKE %s",
+]
+
+
+def log_rows(employees: int, months: int, rng) -> list:
+    rows = []
+    today = date.today()
+    day = today - timedelta(days=30 * months)
+    while day < today:
+        if day.weekday() < 5:
+            for i in range(employees):
+                number = emp_no(i)
+                for mode, start, spread in (("I", 7 * 3600 + 1800, 4500), ("O", 16 * 3600 + 2700, 6300)):
+                    seconds = start + int(rng.integers(0, spread))
+                    moment = datetime.combine(day, datetime.min.time()) + timedelta(seconds=seconds)
+                    rows.append((
+                        number, day.isoformat(), moment.strftime("%H:%M:%S %p"), mode,
+                        os.path.join(number, f"{moment:%Y-%m-%d_%Hh%Mm%Ss}.jpg"),
+                    ))
+        day += timedelta(days=1)
+    return rows
+
+
+async def executemany(db, query: str, rows: list, batch: int = 2000):
+    cursor = await db.cursor()
+    try:
+        for start in range(0, len(rows), batch):
+            await cursor.executemany(query, rows[start:start + batch])
+            await db.commit()
+    finally:
+        await cursor.close()
+
+
+async def seed(db, args):
+    rng = np.random.default_rng(args.seed)
+    cursor = await db.cursor()
+    try:
+        for statement in SCHEMA:
+            await cursor.execute(statement)
+        await image_store.ensure_schema(cursor)
+        await attendance.ensure_schema(cursor)
+        await timelogs.ensure_schema(cursor)
+        await ip_allowlist.ensure_schema(cursor)
+        await db.commit()
+
+        await cursor.execute("SELECT COUNT(*) FROM users WHERE emp_no NOT LIKE %s", (PREFIX + "%",))
+        if (await cursor.fetchone())[0] and not args.force:
+            raise SystemExit("users holds non-benchmark rows; use a scratch database or pass --force")
+        await embeddings.ensure_schema(cursor)
+        for statement in CLEANUP:
+            await cursor.execute(statement, (PREFIX + "%",))
+        await db.commit()
+    finally:
+        await cursor.close()
+
+    password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    now = datetime.now().replace(microsecond=0)
+    users, access, faces, requests = [], [], [], []
+    for i, data in enumerate(photos(args.faces, args.employees, rng)):
+        number = emp_no(i)
+        users.append((number, f"{number.lower()}@bench.local", password, f"First{i}", "M", f"Last{i}", "",
+                      DIVISIONS[i % len(DIVISIONS)], "BENCHMARK EMPLOYEE"))
+        # The first employee is the admin that dashboard and export scenarios log in as
+        access.append((number, "1" if i == 0 else "0"))
+        image_hash = image_store.put(data)
+        faces.append((number, image_hash, len(data), now))
+        if i % 10 == 0:
+            requests.append((number, image_hash, len(data), now - timedelta(minutes=i), "pending"))
+    logging.info(f"Seeding {len(users)} employees")
+    await executemany(db, """INSERT INTO users (emp_no, email, password, first_name, middle_name, last_name,
+                                                ext_name, division_desc, position_desc)
+                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""", users)
+    await executemany(db, "INSERT INTO system_access (emp_no, role_id) VALUES (%s, %s)", access)
+    await executemany(db, """INSERT INTO face_image (emp_no, image_hash, image_size, last_update)
+                             VALUES (%s, %s, %s, %s)""", faces)
+    await executemany(db, """INSERT INTO approval_requests (emp_no, image_hash, image_size, date_requested, approval_status)
+                             VALUES (%s, %s, %s, %s, %s)""", requests)
+
+    # The load generator connects from 127.0.0.1; the rest only make the tries realistic
+    admin = emp_no(0)
+    ips = [("127.0.0.1", admin, admin, now)]
+    for _ in range(args.extra_ips):
+        network = ipaddress.ip_network((int(rng.integers(1 << 24, 223 << 24)), int(rng.choice([24, 28, 32]))),
+                                       strict=False)
+        ips.append((ip_allowlist.normalize(str(network)), admin, admin, now))
+    await executemany(db, "INSERT INTO valid_ip (ip, emp_no, added_by, date_added) VALUES (%s, %s, %s, %s)", ips)
+
+    rows = log_rows(args.employees, args.months, rng)
+    logging.info(f"Seeding {len(rows)} time logs")
+    await executemany(db, timelogs.INSERT, rows)
+    await attendance.rebuild(db)
+
+    if args.faces and not args.skip_embeddings:
+        await embeddings.backfill(db)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        db = await db_pool.pool.acquire()
+        try:
+            await seed(db, args)
+        finally:
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
+    print(f"Seeded {args.employees} employees; log in as {emp_no(0).lower()}@bench.local / {PASSWORD}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--months", type=int, default=3, help="months of clock-in history")
+    parser.add_argument("--faces", help="folder of real face JPEGs to enroll")
+    parser.add_argument("--extra-ips", type=int, default=200, help="additional allowlist entries")
+    parser.add_argument("--skip-embeddings", action="store_true", help="leave embeddings to the first clock-in")
+    parser.add_argument("--force", action="store_true", help="seed even if users holds other rows")
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
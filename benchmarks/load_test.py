@@ -0,0 +1,310 @@
+"""End-to-end load test of the attendance API.
+
+Drives a running server (--url) or starts one (--start, uvicorn main:app with
+--workers processes) against a database filled by benchmarks.load_seed, with
+three concurrent traffic classes for --duration seconds:
+
+  * clock-in bursts: every seeded employee posts /recognize_face/, up to
+    --clock-in-concurrency at a time, alternating IN and OUT per round
+  * dashboard polling: --pollers employees refreshing their dashboard
+    (last log, log history, details, stored photo) every --poll-interval
+    seconds, plus the admin approval queue
+  * admin exports: --exporters loops over the CSV timelog export, keyset JSON
+    pages and the division month report
+
+Logins happen up front and are reported separately. The report gives
+throughput and p50/p95/p99 per endpoint, plus the server's pool and executor
+stats at the end; --json saves it, and `compare` diffs two saved runs.
+Clock-ins send a unique Idempotency-Key so each one runs recognition;
+responses the server still replays from its outcome cache are reported under
+their own "(replayed)" label.
+
+    python -m benchmarks.load_test run --start --workers 4 --duration 60 --json v1.json --label v1
+    python -m benchmarks.load_test run --url http://127.0.0.1:8000 --faces ~/lfw-sample
+    python -m benchmarks.load_test compare v1.json v2.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import cv2
+import httpx
+import numpy as np
+
+from benchmarks.synthetic import DIVISIONS, PASSWORD, emp_no, photos
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        # Answers from the server's outcome cache did not run recognition
+        if response is not None and response.headers.get("idempotent-replayed") == "true":
+            label += " (replayed)"
+        self.samples[label].append(time.perf_counter() - started)
+        self.statuses[label][str(status)] += 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = np.array(samples) * 1000
+            statuses = dict(self.statuses[label])
+            errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+            endpoints[label] = {
+                "requests": len(samples),
+                "errors": errors,
+                "statuses": statuses,
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                "mean_ms": round(float(latencies.mean()), 2),
+                "max_ms": round(float(latencies.max()), 2),
+            }
+        return endpoints
+
+
+# A slightly different frame of the enrolled photo, as a camera would send it
+def probe(photo: bytes, rng) -> bytes:
+    img = cv2.imdecode(np.frombuffer(photo, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return photo
+    img = cv2.convertScaleAbs(img, alpha=float(rng.uniform(0.9, 1.1)), beta=float(rng.uniform(-10, 10)))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+async def login(client, recorder, number: str):
+    response = await recorder.request(client, "POST /login/", "POST", "/login/",
+                                      json={"email": f"{number.lower()}@bench.local", "password": PASSWORD})
+    if response is None or response.status_code != 200:
+        raise SystemExit(f"Login failed for {number}; seed the database with benchmarks.load_seed first")
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+async def clock_ins(client, recorder, tokens, probes, concurrency: int, deadline: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    # Every round posts the same probe per employee; a fresh Idempotency-Key
+    # keeps the server's outcome cache from answering the repeats
+    sequence = itertools.count()
+
+    async def one(number: str, mode: str):
+        async with semaphore:
+            if time.monotonic() < deadline:
+                headers = dict(tokens[number], **{"Idempotency-Key": f"bench-{number}-{next(sequence)}"})
+                await recorder.request(client, "POST /recognize_face/", "POST", "/recognize_face/",
+                                       headers=headers, data={"log": mode},
+                                       files={"file": ("capture.jpg", probes[number], "image/jpeg")})
+
+    mode = "I"
+    while time.monotonic() < deadline:
+        await asyncio.gather(*(one(number, mode) for number in tokens))
+        mode = "O" if mode == "I" else "I"
+
+
+async def dashboard(client, recorder, headers, admin, interval: float, deadline: float, rng):
+    etag = None
+    await asyncio.sleep(float(rng.uniform(0, interval)))
+    while time.monotonic() < deadline:
+        for path in ("/fetch_last_log/", "/get_log_data/", "/fetch_user_details/"):
+            await recorder.request(client, f"GET {path}", "GET", path, headers=headers)
+        conditional = dict(headers, **({"If-None-Match": etag} if etag else {}))
+        response = await recorder.request(client, "GET /get_stored_image/", "GET", "/get_stored_image/",
+                                          headers=conditional)
+        if response is not None:
+            etag = response.headers.get("etag", etag)
+        await recorder.request(client, "GET /get_validation_data/", "GET", "/get_validation_data/", headers=admin)
+        await asyncio.sleep(interval)
+
+
+async def exports(client, recorder, admin, interval: float, deadline: float, rng):
+    today = date.today()
+    date_from = (today - timedelta(days=30)).isoformat()
+    while time.monotonic() < deadline:
+        division = DIVISIONS[int(rng.integers(len(DIVISIONS)))]
+        await recorder.request(client, "GET /get_all_timelogs/?format=csv", "GET", "/get_all_timelogs/",
+                               headers=admin, params={"format": "csv", "date_from": date_from})
+        cursor = None
+        for _ in range(5):
+            params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+            response = await recorder.request(client, "GET /get_all_timelogs/", "GET", "/get_all_timelogs/",
+                                              headers=admin, params=params)
+            if response is None or response.status_code != 200:
+                break
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                break
+        await recorder.request(client, "GET /attendance_report/", "GET", "/attendance_report/", headers=admin,
+                               params={"division": division, "month": today.strftime("%Y-%m")})
+        await asyncio.sleep(interval)
+
+
+def start_server(args):
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+               "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            raise SystemExit("uvicorn exited during startup")
+        time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("Server did not come up in time")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, url: str) -> dict:
+    rng = np.random.default_rng(args.seed)
+    recorder = Recorder()
+    numbers = [emp_no(i) for i in range(args.employees)]
+    limits = httpx.Limits(max_connections=args.clock_in_concurrency + args.pollers + args.exporters + 8)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        semaphore = asyncio.Semaphore(8)
+
+        async def limited_login(number):
+            async with semaphore:
+                return number, await login(client, recorder, number)
+
+        login_started = time.monotonic()
+        tokens = dict(await asyncio.gather(*(limited_login(number) for number in numbers)))
+        admin = tokens[numbers[0]]
+        login_elapsed = time.monotonic() - login_started
+        probes = {number: probe(photo, rng) for number, photo in zip(numbers, photos(args.faces, len(numbers), rng))}
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        login_samples = recorder.samples.pop("POST /login/")
+        login_statuses = recorder.statuses.pop("POST /login/")
+        pollers = random.Random(args.seed).sample(numbers, min(args.pollers, len(numbers)))
+        await asyncio.gather(
+            clock_ins(client, recorder, tokens, probes, args.clock_in_concurrency, deadline),
+            *(dashboard(client, recorder, tokens[number], admin, args.poll_interval, deadline,
+                        np.random.default_rng(args.seed + i)) for i, number in enumerate(pollers)),
+            *(exports(client, recorder, admin, args.export_interval, deadline,
+                      np.random.default_rng(args.seed + 1000 + i)) for i in range(args.exporters)),
+        )
+        elapsed = time.monotonic() - started
+
+        server = {}
+        for path in ("/db_pool_stats/", "/inference_stats/"):
+            try:
+                server[path.strip("/")] = (await client.get(path)).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+
+    endpoints = recorder.report(elapsed)
+    setup = Recorder()
+    setup.samples["POST /login/"], setup.statuses["POST /login/"] = login_samples, login_statuses
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "func")},
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": sum(row["requests"] for row in endpoints.values()),
+        "endpoints": endpoints,
+        "setup": setup.report(login_elapsed),
+        "server": server,
+    }
+
+
+def print_report(results: dict):
+    print(f"{results['label'] or 'run'} @ {results['commit']}: {results['total_requests']} requests "
+          f"in {results['elapsed_s']}s")
+    print(f"{'endpoint':42} {'reqs':>6} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for label, row in list(results["endpoints"].items()) + list(results["setup"].items()):
+        print(f"{label:42} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+
+def run_command(args):
+    server = start_server(args) if args.start else None
+    url = f"http://127.0.0.1:{args.port}" if args.start else args.url
+    try:
+        results = asyncio.run(run(args, url))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+def compare_command(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+    print(f"{baseline['label'] or args.baseline} -> {candidate['label'] or args.candidate}")
+    print(f"{'endpoint':42} {'rps':>16} {'p50 ms':>20} {'p95 ms':>20} {'p99 ms':>20}")
+    for label in sorted(set(baseline["endpoints"]) & set(candidate["endpoints"])):
+        old, new = baseline["endpoints"][label], candidate["endpoints"][label]
+        cells = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append(f"{new[key]:>10} ({change:+.0f}%)")
+        print(f"{label:42} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="drive the API and report per-endpoint latency")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--start", action="store_true", help="start uvicorn main:app for the run")
+    run_parser.add_argument("--port", type=int, default=8765, help="port for --start")
+    run_parser.add_argument("--workers", type=int, default=4, help="uvicorn workers for --start")
+    run_parser.add_argument("--startup-timeout", type=float, default=120)
+    run_parser.add_argument("--duration", type=float, default=60)
+    run_parser.add_argument("--employees", type=int, default=200, help="seeded employees to clock in")
+    run_parser.add_argument("--faces", help="the --faces folder given to load_seed")
+    run_parser.add_argument("--clock-in-concurrency", type=int, default=32)
+    run_parser.add_argument("--pollers", type=int, default=16)
+    run_parser.add_argument("--poll-interval", type=float, default=2)
+    run_parser.add_argument("--exporters", type=int, default=2)
+    run_parser.add_argument("--export-interval", type=float, default=5)
+    run_parser.add_argument("--timeout", type=float, default=30, help="per-request timeout")
+    run_parser.add_argument("--label", default="", help="name of this run in the JSON")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--json", help="also write the results to this file")
+    run_parser.set_defaults(func=run_command)
+
+    compare_parser = subparsers.add_parser("compare", help="diff two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare_command)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,36 @@
+"""Synthetic employees and photos shared by load_seed and load_test."""
+import glob
+import os
+
+import cv2
+import numpy as np
+
+PREFIX = "BENCH-"
+PASSWORD = "benchmark"
+DIVISIONS = ["ICTS", "HRMD", "FMD", "LEGAL", "PLANNING", "ADMIN", "RECORDS", "PROCUREMENT"]
+
+
+def emp_no(i: int) -> str:
+    return f"{PREFIX}{i:06d}"
+
+
+# A face-less stand-in photo when no --faces folder is given
+def synthetic_photo(rng) -> bytes:
+    img = np.zeros((480, 640, 3), np.uint8)
+    img[:] = rng.integers(0, 255, 3)
+    cv2.circle(img, (320, 240), 120, [int(c) for c in rng.integers(0, 255, 3)], -1)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+# Photo of employee i: real faces round-robin from faces_dir, else synthetic
+def photos(faces_dir, count: int, rng) -> list:
+    if faces_dir:
+        paths = sorted(glob.glob(os.path.join(os.path.expanduser(faces_dir), "**", "*.jp*g"), recursive=True))
+        if not paths:
+            raise SystemExit(f"No JPEGs found under {faces_dir}")
+        result = []
+        for i in range(count):
+            with open(paths[i % len(paths)], "rb") as fh:
+                result.append(fh.read())
+        return result
+    return [synthetic_photo(rng) for _ in range(count)]
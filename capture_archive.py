@@ -0,0 +1,163 @@
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+from datetime import date
+
+import thumbnails
+
+# Verified captures, kept per employee as CAPTURE_ARCHIVE_DIR/<emp_no>/<YYYY-MM>/
+# <timestamp>.jpg. LOG_IMG_PATH stays <emp_no>/<timestamp>.jpg; the month shard
+# is derived from the timestamp. Requests only enqueue the upload: resizing,
+# encoding and the disk write happen in a background task after the response.
+ROOT = os.getenv("CAPTURE_ARCHIVE_DIR", "captures")
+MAX_SIZE = int(os.getenv("CAPTURE_MAX_SIZE", "640"))
+QUALITY = int(os.getenv("CAPTURE_QUALITY", "75"))
+QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "256"))
+# Months older than this many days are deleted (0 keeps everything) ...
+RETENTION_DAYS = int(os.getenv("CAPTURE_RETENTION_DAYS", "365"))
+# ... and months older than this are re-encoded smaller (0 disables)
+COMPACT_AFTER_DAYS = int(os.getenv("CAPTURE_COMPACT_AFTER_DAYS", "90"))
+COMPACT_MAX_SIZE = int(os.getenv("CAPTURE_COMPACT_MAX_SIZE", "320"))
+COMPACT_QUALITY = int(os.getenv("CAPTURE_COMPACT_QUALITY", "60"))
+SWEEP_SECONDS = float(os.getenv("CAPTURE_SWEEP_SECONDS", "86400"))
+
+COMPACTED_MARKER = ".compacted"
+
+
+# <emp_no>/2024-05-31_08h01m02s.jpg -> ROOT/<emp_no>/2024-05/2024-05-31_08h01m02s.jpg
+def path(log_img_path: str) -> str:
+    emp_no, name = os.path.split(log_img_path)
+    return os.path.join(ROOT, emp_no, name[:7], name)
+
+
+def _write(target: str, data: bytes):
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save(log_img_path: str, image_data: bytes) -> int:
+    data = thumbnails.resize_jpeg(image_data, MAX_SIZE, QUALITY)
+    _write(path(log_img_path), data)
+    return len(data)
+
+
+def _month_start(days_ago: int, today: date) -> str:
+    return date.fromordinal(today.toordinal() - days_ago).strftime("%Y-%m")
+
+
+def _compact(directory: str) -> int:
+    compacted = 0
+    for name in os.listdir(directory):
+        if not name.endswith(".jpg"):
+            continue
+        target = os.path.join(directory, name)
+        try:
+            with open(target, "rb") as fh:
+                data = thumbnails.resize_jpeg(fh.read(), COMPACT_MAX_SIZE, COMPACT_QUALITY)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping capture {target} during compaction: {str(e)}")
+            continue
+        _write(target, data)
+        compacted += 1
+    open(os.path.join(directory, COMPACTED_MARKER), "w").close()
+    return compacted
+
+
+# Apply the retention and compaction policy one month directory at a time, and
+# drop employee directories left empty. Only one worker sweeps at a time.
+def sweep(today: date = None) -> dict:
+    today = today or date.today()
+    removed = compacted = 0
+    if not os.path.isdir(ROOT):
+        return {"removed_months": removed, "compacted_files": compacted}
+    # Months strictly before the one containing the cutoff day are entirely past it
+    expire_before = _month_start(RETENTION_DAYS, today) if RETENTION_DAYS else None
+    compact_before = _month_start(COMPACT_AFTER_DAYS, today) if COMPACT_AFTER_DAYS else None
+
+    with open(os.path.join(ROOT, ".sweep.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {"removed_months": removed, "compacted_files": compacted}
+        for emp_no in os.listdir(ROOT):
+            employee_dir = os.path.join(ROOT, emp_no)
+            if not os.path.isdir(employee_dir):
+                continue
+            for month in os.listdir(employee_dir):
+                month_dir = os.path.join(employee_dir, month)
+                if not os.path.isdir(month_dir):
+                    continue
+                if expire_before and month < expire_before:
+                    shutil.rmtree(month_dir, ignore_errors=True)
+                    removed += 1
+                elif (compact_before and month < compact_before
+                      and not os.path.exists(os.path.join(month_dir, COMPACTED_MARKER))):
+                    compacted += _compact(month_dir)
+            try:
+                os.rmdir(employee_dir)
+            except OSError:
+                pass
+    logging.info(f"Capture archive sweep: {removed} months removed, {compacted} captures compacted")
+    return {"removed_months": removed, "compacted_files": compacted}
+
+
+class Archiver:
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self._queue = asyncio.Queue(queue_size)
+        self._stats = {"queued": 0, "saved": 0, "dropped": 0, "failures": 0, "bytes": 0}
+
+    # Never blocks the request: a full queue means the disk is behind, and the
+    # capture is dropped rather than holding the clock-in
+    def submit(self, log_img_path: str, image_data: bytes):
+        try:
+            self._queue.put_nowait((log_img_path, image_data))
+            self._stats["queued"] += 1
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            logging.warning(f"Capture archive queue full, dropping {log_img_path}")
+
+    async def run(self):
+        while True:
+            log_img_path, image_data = await self._queue.get()
+            try:
+                self._stats["bytes"] += await asyncio.to_thread(save, log_img_path, image_data)
+                self._stats["saved"] += 1
+            except Exception as e:
+                self._stats["failures"] += 1
+                logging.error(f"Error archiving capture {log_img_path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    # Give queued captures a chance to reach the disk on shutdown
+    async def drain(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Capture archive shut down with {self._queue.qsize()} captures unsaved")
+
+    async def sweep_periodically(self):
+        while True:
+            try:
+                await asyncio.to_thread(sweep)
+            except Exception as e:
+                logging.error(f"Error sweeping capture archive: {str(e)}")
+            await asyncio.sleep(SWEEP_SECONDS)
+
+    def stats(self) -> dict:
+        return dict(self._stats, queue=self._queue.qsize())
+
+
+archiver = Archiver()
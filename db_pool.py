@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import aiomysql
+import pymysql
+from pymysql.constants import ER, SERVER_STATUS
+from fastapi import HTTPException, status
+
+# Shared aiomysql connections instead of a TCP + auth handshake per request.
+# Every query awaits on the event loop, so a slow query only holds its own
+# request. Connections are health-checked on checkout (ping when idle for
+# longer than DB_POOL_PING_AFTER seconds) and replaced once older than
+# DB_POOL_RECYCLE_SECONDS.
+MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", "3600"))
+PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "0"))
+TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+RETRY_AFTER = int(os.getenv("DB_POOL_RETRY_AFTER", "1"))
+
+
+# A checked-out connection. close() hands it back to the pool instead of
+# closing the socket, so the usual `await db.close()` in a finally block still works.
+class PooledConnection:
+    def __init__(self, pool, conn, created: float):
+        self._pool = pool
+        self._conn = conn
+        self._created = created
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._pool._release(self._conn, self._created)
+
+    # Close the underlying socket instead of returning it, for connections left
+    # in an unknown state (e.g. an abandoned unbuffered result set)
+    def discard(self):
+        if not self._closed:
+            self._closed = True
+            self._pool._close_quietly(self._conn)
+            self._pool._discard()
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size: int = MIN_SIZE, max_size: int = MAX_SIZE,
+                 recycle_seconds: float = RECYCLE_SECONDS, ping_after: float = PING_AFTER,
+                 timeout: float = TIMEOUT):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.recycle_seconds = recycle_seconds
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        # Futures of acquire() calls waiting for a connection, oldest first
+        self._waiters = deque()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "opened": 0,
+            "recycled": 0,
+            "failed_pings": 0,
+        }
+
+    async def _open(self):
+        conn = await self._connect()
+        self._stats["opened"] += 1
+        return conn, time.monotonic()
+
+    # Open MIN_SIZE connections up front so the first requests skip the handshake
+    async def prefill(self):
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn, created = await self._open()
+            except Exception:
+                self._size -= 1
+                raise
+            self._idle.append((conn, created, time.monotonic()))
+            self._notify()
+
+    async def acquire(self) -> PooledConnection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        entry = None
+        self._stats["checkouts"] += 1
+        waited = False
+        # The pool lives on one event loop, so plain bookkeeping needs no lock
+        while True:
+            if self._idle:
+                # LIFO keeps a warm core of connections and lets the rest age out
+                entry = self._idle.pop()
+                break
+            if self._size < self.max_size:
+                self._size += 1
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats["timeouts"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Database is busy, please retry",
+                    headers={"Retry-After": str(RETRY_AFTER)}
+                )
+            if not waited:
+                self._stats["waits"] += 1
+                waited = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Cancelled after being woken: pass the wakeup on
+                if waiter.done() and not waiter.cancelled():
+                    self._notify()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        wait = time.monotonic() - started
+        self._stats["wait_total"] += wait
+        self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+
+        try:
+            if entry is None:
+                conn, created = await self._open()
+            else:
+                conn, created = await self._check(*entry)
+        except BaseException:
+            self._discard()
+            raise
+        return PooledConnection(self, conn, created)
+
+    # Replace connections that are too old or fail a ping
+    async def _check(self, conn, created: float, idle_since: float):
+        now = time.monotonic()
+        if now - created > self.recycle_seconds:
+            self._stats["recycled"] += 1
+            self._close_quietly(conn)
+            return await self._open()
+        if now - idle_since >= self.ping_after:
+            try:
+                await conn.ping(reconnect=False)
+            except Exception:
+                logging.warning("Discarding pooled DB connection that failed its ping")
+                self._stats["failed_pings"] += 1
+                self._close_quietly(conn)
+                return await self._open()
+        return conn, created
+
+    async def _release(self, conn, created: float):
+        try:
+            # Never hand the next request an open transaction (or its stale snapshot)
+            if not conn.closed and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                await conn.rollback()
+            healthy = not conn.closed
+        except Exception:
+            healthy = False
+
+        if not healthy:
+            self._close_quietly(conn)
+            self._discard()
+            return
+        self._idle.append((conn, created, time.monotonic()))
+        self._notify()
+
+    def _discard(self):
+        self._size -= 1
+        self._notify()
+
+    # Wake the oldest acquire() still waiting; it re-checks the pool itself
+    def _notify(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while self._idle:
+            conn, _, _ = self._idle.pop()
+            self._close_quietly(conn)
+            self._size -= 1
+
+    def stats(self) -> dict:
+        snapshot = dict(self._stats)
+        size, idle = self._size, len(self._idle)
+        in_use = size - idle
+        checkouts = snapshot["checkouts"]
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": size,
+            "idle": idle,
+            "in_use": in_use,
+            "saturation": round(in_use / self.max_size, 3) if self.max_size else 0.0,
+            "checkouts": checkouts,
+            "waits": snapshot["waits"],
+            "timeouts": snapshot["timeouts"],
+            "avg_wait_ms": round(snapshot["wait_total"] / checkouts * 1000, 3) if checkouts else 0.0,
+            "max_wait_ms": round(snapshot["wait_max"] * 1000, 3),
+            "opened": snapshot["opened"],
+            "recycled": snapshot["recycled"],
+            "failed_pings": snapshot["failed_pings"],
+        }
+
+
+async def connect():
+    return await aiomysql.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        db=os.getenv("DB_NAME"),
+    )
+
+
+# Run a schema change another process may already have applied (it checked
+# information_schema before us and won the race)
+async def ddl(cursor, statement: str):
+    try:
+        await cursor.execute(statement)
+    except pymysql.err.MySQLError as e:
+        if not e.args or e.args[0] not in (ER.DUP_FIELDNAME, ER.DUP_KEYNAME):
+            raise
+        logging.info(f"Schema change already applied: {statement}")
+
+
+pool = ConnectionPool(connect)
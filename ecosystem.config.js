@@ -19,10 +19,19 @@ module.exports = {
         //         NODE_ENV: "production", // Set environment variable (optional)
         //     },
         // },
+        // {
+        //     name: "recognition", // Shared model for the backend workers; start them with RECOGNITION_MODE=server
+        //     script: "python recognition_server.py serve",
+        //     env: {
+        //         NODE_ENV: "production", // Set environment variable (optional)
+        //     },
+        // },
         {
             name: "B for Backend", // Name for your Pulse process
             script: "uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4",
             watch: true, // Watch for file changes and restart (optional)
+            // Data the workers write themselves; restarting on it would reload the model
+            ignore_watch: ["node_modules", "image_store", "captures", "log_journal", "profiles"],
             env: {
                 NODE_ENV: "production", // Set environment variable (optional)
             },
@@ -0,0 +1,258 @@
+import argparse
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import recognition
+
+# The runtime behind the Facenet forward pass. Detection and alignment stay on
+# DeepFace either way; only the embedding step moves.
+#   EMBEDDING_BACKEND=deepface  DeepFace's Facenet on TensorFlow (default)
+#   EMBEDDING_BACKEND=onnx      the exported graph at EMBEDDING_ONNX_PATH on
+#                               onnxruntime's CPU provider, fp32 or int8
+# An ONNX model must pass `python embedding_backend.py parity` before it is
+# deployed: stored embeddings are not recomputed, so its vectors have to stay
+# comparable with DeepFace's at the same THRESHOLD.
+BACKEND = os.getenv("EMBEDDING_BACKEND", "deepface")
+ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "models/facenet.onnx")
+# Threads per forward pass (0 = one per core). Each of the INFERENCE_WORKERS
+# threads can run a pass at the same time, so on a shared host keep
+# INFERENCE_WORKERS * EMBEDDING_THREADS at or below the core count.
+THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# disable | basic | extended | all
+GRAPH_OPTIMIZATION = os.getenv("EMBEDDING_GRAPH_OPTIMIZATION", "all")
+
+MODEL_NAME = "Facenet"
+INPUT_SHAPE = (160, 160)
+
+
+class DeepFaceBackend:
+    name = "deepface"
+
+    def __init__(self):
+        self.model = recognition.deepface().build_model(MODEL_NAME)
+        self.input_shape = tuple(self.model.input_shape)
+
+    # (n, 160, 160, 3) batch -> (n, 128) float32
+    def forward(self, batch):
+        vectors = self.model.forward(batch)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(batch), -1)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path: str = ONNX_PATH, threads: int = THREADS, optimization: str = GRAPH_OPTIMIZATION):
+        # onnxruntime is optional, only needed for EMBEDDING_BACKEND=onnx and the
+        # quantize/parity commands, and costly to import, so not loaded by main
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("The onnx embedding backend needs onnxruntime (pip install onnxruntime)")
+        levels = {
+            "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = levels[optimization]
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Graphs converted from Keras keep NHWC; ones exported from PyTorch are NCHW
+        self.channels_first = model_input.shape[1] == 3
+        height, width = model_input.shape[2:4] if self.channels_first else model_input.shape[1:3]
+        self.input_shape = (height, width) if isinstance(height, int) else INPUT_SHAPE
+
+    def feed(self, batch) -> dict:
+        batch = np.asarray(batch, dtype=np.float32)
+        if self.channels_first:
+            batch = batch.transpose(0, 3, 1, 2)
+        return {self.input_name: batch}
+
+    def forward(self, batch):
+        return self.session.run(None, self.feed(batch))[0].reshape(len(batch), -1).astype(np.float32)
+
+
+_lock = threading.Lock()
+_backend = None
+
+
+# The configured backend, created on first use. A broken ONNX setup falls back
+# to DeepFace (whose vectors it was checked against) rather than failing clock-ins.
+def get():
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                if BACKEND == "onnx":
+                    try:
+                        _backend = OnnxBackend()
+                        logging.info(f"Embedding with {ONNX_PATH} on onnxruntime "
+                                     f"({THREADS or 'all'} threads, {GRAPH_OPTIMIZATION} graph optimizations)")
+                    except Exception as e:
+                        logging.error(f"Could not load the onnx embedding backend, using DeepFace: {str(e)}")
+                if _backend is None:
+                    _backend = DeepFaceBackend()
+    return _backend
+
+
+# Export DeepFace's Keras Facenet to ONNX (needs tensorflow and tf2onnx)
+def export(output: str, opset: int = 13):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = recognition.deepface().build_model(MODEL_NAME).model
+    signature = [tf.TensorSpec((None, *INPUT_SHAPE, 3), tf.float32, name="input")]
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=output)
+    logging.info(f"Exported {MODEL_NAME} to {output}")
+
+
+# Model-ready face tensors from every image file under folder (recursively,
+# so the image store works too); files without exactly one face are skipped
+def load_faces(folder: str, limit: int) -> list:
+    import embeddings
+    import preprocess
+
+    faces = []
+    for path in sorted(glob.glob(os.path.join(os.path.expanduser(folder), "**", "*"), recursive=True)):
+        if len(faces) >= limit:
+            break
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as fh:
+            data = fh.read()
+        try:
+            preprocess.validate(data)
+            found = embeddings.extract_faces(data)
+        except ValueError:
+            continue
+        if len(found) == 1:
+            faces.append((os.path.relpath(path, folder), found[0]))
+    return faces
+
+
+class _CalibrationReader:
+    def __init__(self, backend, faces):
+        self._feeds = iter([backend.feed(face) for _, face in faces])
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+
+# Quantize weights and activations to int8. With calibration faces this is
+# static QDQ quantization, which is what makes Facenet's convolutions faster;
+# without, only the weights are quantized.
+def quantize(source: str, output: str, faces: list):
+    from onnxruntime import quantization
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if faces:
+        reader = _CalibrationReader(OnnxBackend(source, optimization="disable"), faces)
+        quantization.quantize_static(
+            source, output, reader,
+            quant_format=quantization.QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8,
+        )
+    else:
+        logging.warning("No calibration faces given; quantizing weights only")
+        quantization.quantize_dynamic(source, output, weight_type=quantization.QuantType.QInt8)
+    logging.info(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB, was {os.path.getsize(source) / 1e6:.1f} MB)")
+
+
+# Compare an ONNX model with DeepFace's Facenet on the same aligned faces:
+# how far each face's two vectors are apart, and whether any pair of faces
+# lands on the other side of threshold. Returns (report, passed).
+def parity(model: str, faces: list, threshold: float, tolerance: float) -> tuple:
+    from embeddings import cosine_distance as _cosine
+
+    reference_backend = DeepFaceBackend()
+    candidate_backend = OnnxBackend(model)
+    batch = np.concatenate([face for _, face in faces])
+
+    started = time.perf_counter()
+    reference = reference_backend.forward(batch)
+    reference_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    candidate = candidate_backend.forward(batch)
+    candidate_seconds = time.perf_counter() - started
+
+    drift = [_cosine(a, b) for a, b in zip(reference, candidate)]
+    deltas, flips = [], []
+    for i, j in itertools.combinations(range(len(faces)), 2):
+        expected, actual = _cosine(reference[i], reference[j]), _cosine(candidate[i], candidate[j])
+        deltas.append(abs(actual - expected))
+        # Probe embedded by the candidate against a vector stored by DeepFace,
+        # as after a switch with existing face_embedding rows
+        mixed = _cosine(candidate[i], reference[j])
+        if (expected <= threshold) != (actual <= threshold) or (expected <= threshold) != (mixed <= threshold):
+            flips.append({"a": faces[i][0], "b": faces[j][0], "deepface": round(expected, 4),
+                          "candidate": round(actual, 4), "mixed": round(mixed, 4)})
+
+    report = {
+        "model": model,
+        "faces": len(faces),
+        "pairs": len(deltas),
+        "threshold": threshold,
+        "self_distance_mean": round(float(np.mean(drift)), 5),
+        "self_distance_max": round(float(np.max(drift)), 5),
+        "worst_face": faces[int(np.argmax(drift))][0],
+        "pair_delta_mean": round(float(np.mean(deltas)), 5) if deltas else 0.0,
+        "pair_delta_max": round(float(np.max(deltas)), 5) if deltas else 0.0,
+        "decision_flips": flips,
+        "deepface_ms_per_face": round(reference_seconds / len(faces) * 1000, 2),
+        "candidate_ms_per_face": round(candidate_seconds / len(faces) * 1000, 2),
+    }
+    return report, report["self_distance_max"] <= tolerance and not flips
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export, quantize and check the ONNX Facenet embedding backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="convert DeepFace's Facenet to ONNX")
+    export_parser.add_argument("--output", default="models/facenet.onnx")
+    export_parser.add_argument("--opset", type=int, default=13)
+    quantize_parser = subparsers.add_parser("quantize", help="write an int8 copy of an ONNX model")
+    quantize_parser.add_argument("--input", default="models/facenet.onnx")
+    quantize_parser.add_argument("--output", default="models/facenet.int8.onnx")
+    quantize_parser.add_argument("--faces", help="folder of face photos for calibration")
+    quantize_parser.add_argument("--limit", type=int, default=200)
+    parity_parser = subparsers.add_parser("parity", help="compare an ONNX model with DeepFace on a face set")
+    parity_parser.add_argument("--model", default=ONNX_PATH)
+    parity_parser.add_argument("--faces", required=True, help="folder of face photos, one face each")
+    parity_parser.add_argument("--limit", type=int, default=200)
+    parity_parser.add_argument("--tolerance", type=float, default=0.02,
+                               help="largest allowed cosine distance between a face's two vectors")
+    parity_parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        export(args.output, args.opset)
+    elif args.command == "quantize":
+        quantize(args.input, args.output, load_faces(args.faces, args.limit) if args.faces else [])
+    else:
+        import embeddings
+
+        faces = load_faces(args.faces, args.limit)
+        if len(faces) < 2:
+            raise SystemExit(f"Need at least 2 single-face photos in {args.faces}, found {len(faces)}")
+        report, passed = parity(args.model, faces, embeddings.THRESHOLD, args.tolerance)
+        print(json.dumps(report, indent=2))
+        if args.json:
+            with open(args.json, "w") as fh:
+                json.dump(report, fh, indent=2)
+        if not passed:
+            raise SystemExit(f"{args.model} does not match DeepFace within tolerance {args.tolerance}")
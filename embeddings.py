@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import logging
+
+import cv2
+import numpy as np
+
+import db_pool
+import embedding_backend
+import image_store
+import preprocess
+import recognition
+
+# Recognition settings shared by every endpoint that compares faces
+MODEL_NAME = embedding_backend.MODEL_NAME
+DETECTOR_BACKEND = "opencv"
+THRESHOLD = 0.6
+
+# One Facenet vector per employee, versioned against face_image.last_update
+# so a re-approved photo is never compared through a stale embedding
+CREATE_FACE_EMBEDDING = """
+    CREATE TABLE IF NOT EXISTS face_embedding (
+        emp_no VARCHAR(50) NOT NULL PRIMARY KEY,
+        model_name VARCHAR(32) NOT NULL,
+        embedding BLOB NOT NULL,
+        image_updated DATETIME NULL,
+        date_computed DATETIME NOT NULL
+    )
+"""
+
+
+# Computed when a face update is submitted, so approving it needs no model work
+APPROVAL_COLUMNS = {
+    "embedding": "BLOB NULL",
+    "embedding_model": "VARCHAR(32) NULL",
+    "face_box": "VARCHAR(64) NULL",
+    "crop_hash": "CHAR(64) NULL",
+}
+
+
+async def ensure_schema(cursor):
+    await cursor.execute(CREATE_FACE_EMBEDDING)
+    await cursor.execute(
+        """SELECT COLUMN_NAME FROM information_schema.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'approval_requests'"""
+    )
+    existing = {row[0] for row in await cursor.fetchall()}
+    for column, definition in APPROVAL_COLUMNS.items():
+        if column not in existing:
+            await db_pool.ddl(cursor, f"ALTER TABLE approval_requests ADD COLUMN {column} {definition}")
+
+
+# Upright and bounded to DECODE_MAX_DIMENSION, for probes and enrolled faces alike
+def decode_image(image_data: bytes):
+    return preprocess.decode(image_data)
+
+
+def _detect(img) -> list:
+    return recognition.deepface().extract_faces(
+        img_path=img,
+        detector_backend=DETECTOR_BACKEND,
+        enforce_detection=True,
+        align=True,
+    )
+
+
+def _model_input(face, target_size):
+    face = face[:, :, ::-1]  # rgb to bgr, as represent does
+    face = recognition.preprocessing().resize_image(img=face, target_size=(target_size[1], target_size[0]))
+    return recognition.preprocessing().normalize_input(img=face, normalization="base")
+
+
+# Detect every face in encoded image bytes or a BGR array and return model-ready
+# (1, 160, 160, 3) tensors, preprocessed exactly as DeepFace.represent does.
+# Everything stays in memory. Raises ValueError when no face is detected.
+def extract_faces(img) -> list:
+    if isinstance(img, (bytes, bytearray)):
+        img = decode_image(img)
+    target_size = embedding_backend.get().input_shape
+    return [_model_input(obj["face"], target_size) for obj in _detect(img)]
+
+
+# The same single detection pass for an enrollment photo, keeping what
+# extract_faces throws away: per face the model input, the bounding box
+# [x, y, w, h] and the aligned crop as JPEG. Returns [] when there is no face.
+def analyze_faces(img) -> list:
+    if isinstance(img, (bytes, bytearray)):
+        img = decode_image(img)
+    try:
+        face_objs = _detect(img)
+    except ValueError:
+        return []
+    target_size = embedding_backend.get().input_shape
+    faces = []
+    for obj in face_objs:
+        area = obj["facial_area"]
+        crop = np.clip(obj["face"][:, :, ::-1] * 255, 0, 255).astype(np.uint8)
+        faces.append({
+            "input": _model_input(obj["face"], target_size),
+            "box": [area["x"], area["y"], area["w"], area["h"]],
+            "crop": cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes(),
+        })
+    return faces
+
+
+# One Facenet forward pass over an (n, 160, 160, 3) batch on the configured
+# backend (EMBEDDING_BACKEND); returns (n, 128)
+def forward(batch):
+    return embedding_backend.get().forward(batch)
+
+
+# Embed every face found in encoded image bytes or a BGR array
+def embed_faces(img) -> list:
+    return list(forward(np.concatenate(extract_faces(img))))
+
+
+def cosine_distance(a, b) -> float:
+    return float(1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def to_blob(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_blob(blob: bytes):
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+# (emp_no, model_name, embedding, image_updated)
+UPSERT_EMBEDDING = """
+    INSERT INTO face_embedding
+        (emp_no, model_name, embedding, image_updated, date_computed)
+    VALUES (%s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        model_name = VALUES(model_name),
+        embedding = VALUES(embedding),
+        image_updated = VALUES(image_updated),
+        date_computed = VALUES(date_computed)
+"""
+
+
+async def save_embedding(cursor, emp_no: str, vector, image_updated):
+    await cursor.execute(UPSERT_EMBEDDING, (emp_no, MODEL_NAME, to_blob(vector), image_updated))
+
+
+# Returns the enrolled vector for emp_no, or None when there is no stored face.
+# A missing or stale embedding is recomputed from the stored face image and saved;
+# the caller commits.
+async def get_embedding(cursor, emp_no: str):
+    await cursor.execute(
+        """SELECT f.last_update, e.embedding, e.image_updated, e.model_name
+           FROM face_image f
+           LEFT JOIN face_embedding e ON e.emp_no = f.emp_no
+           WHERE f.emp_no = %s""",
+        (emp_no,)
+    )
+    row = await cursor.fetchone()
+    if not row:
+        return None
+
+    last_update, blob, image_updated, model_name = row
+    if blob and model_name == MODEL_NAME and image_updated == last_update:
+        return from_blob(blob)
+
+    await cursor.execute("SELECT image_hash, image FROM face_image WHERE emp_no = %s", (emp_no,))
+    image = image_store.read(*await cursor.fetchone())
+    if not image:
+        return None
+
+    # Imported here: recognition_server depends on this module
+    import recognition_server
+
+    logging.info(f"Recomputing face embedding for {emp_no}")
+    vector = (await recognition_server.probe(None, image))[0]
+    await save_embedding(cursor, emp_no, vector, last_update)
+    return vector
+
+
+# Compute embeddings for every face_image row that has none yet (or a stale one)
+async def backfill(db, force: bool = False):
+    cursor = await db.cursor()
+    try:
+        await ensure_schema(cursor)
+        if force:
+            await cursor.execute("SELECT emp_no FROM face_image WHERE image_hash IS NOT NULL OR image IS NOT NULL")
+        else:
+            await cursor.execute(
+                """SELECT f.emp_no
+                   FROM face_image f
+                   LEFT JOIN face_embedding e ON e.emp_no = f.emp_no
+                   WHERE (f.image_hash IS NOT NULL OR f.image IS NOT NULL)
+                   AND (e.emp_no IS NULL
+                        OR e.model_name <> %s
+                        OR NOT (e.image_updated <=> f.last_update))""",
+                (MODEL_NAME,)
+            )
+        pending = [row[0] for row in await cursor.fetchall()]
+        logging.info(f"Backfilling {len(pending)} face embeddings")
+
+        done, failed = 0, []
+        for emp_no in pending:
+            await cursor.execute("SELECT image_hash, image, last_update FROM face_image WHERE emp_no = %s", (emp_no,))
+            image_hash, image, last_update = await cursor.fetchone()
+            try:
+                vector = embed_faces(image_store.read(image_hash, image))[0]
+            except Exception as e:
+                logging.warning(f"Skipping {emp_no}: {str(e)}")
+                failed.append(emp_no)
+                continue
+            await save_embedding(cursor, emp_no, vector, last_update)
+            await db.commit()
+            done += 1
+
+        logging.info(f"Backfill finished: {done} computed, {len(failed)} failed")
+        return done, failed
+    finally:
+        await cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage precomputed Facenet embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="embed existing face_image rows")
+    backfill_parser.add_argument("--force", action="store_true", help="recompute every row")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from main import dbconnect
+
+    async def run():
+        db = await dbconnect()
+        try:
+            await backfill(db, force=args.force)
+        finally:
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import csv
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import bcrypt
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables (before the local modules read their settings)
+load_dotenv()
+
+import embeddings
+import image_store
+import preprocess
+
+# Bulk onboarding from a CSV and a folder of photos. Each CSV row needs emp_no,
+# email and password (plain text, or password_hash when already bcrypt-hashed);
+# role_id defaults to --role, photo defaults to <emp_no>.jpg/.jpeg/.png in the
+# folder, and every other column is copied into the users column of that name.
+# Passwords are hashed and faces detected and embedded in a pool of processes,
+# CHUNK_SIZE rows per task so their faces share one forward pass. Rows are
+# written with executemany, --batch at a time, into users, system_access,
+# face_image (photo in the image store) and face_embedding. Every committed
+# emp_no is appended to the checkpoint file, so an interrupted run resumes
+# where it stopped; rows that fail (no face, several faces, unreadable photo,
+# duplicate email, an existing user without a face, ...) are listed with the
+# reason in the failure report and left out of the checkpoint.
+SPECIAL_COLUMNS = ("password", "password_hash", "role_id", "photo")
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CHUNK_SIZE = 8
+
+
+def _photo_path(row: dict, photos: str):
+    if row.get("photo"):
+        candidate = os.path.join(photos, row["photo"])
+        return candidate if os.path.isfile(candidate) else None
+    for extension in PHOTO_EXTENSIONS:
+        candidate = os.path.join(photos, row["emp_no"] + extension)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+# The same limits as an upload to /request_face_update/
+def _read_photo(path: str) -> bytes:
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if len(data) > preprocess.MAX_BYTES:
+        raise ValueError(f"photo is larger than {preprocess.MAX_BYTES // (1024 * 1024)} MB")
+    _, width, height, _ = preprocess.validate(data)
+    if width * height > preprocess.MAX_PIXELS:
+        raise ValueError(f"photo is larger than {preprocess.MAX_PIXELS // 1_000_000} megapixels")
+    return data
+
+
+# Runs in a pool process. Returns per row either {"emp_no", "error"} or the
+# password hash, stored image and embedding to insert.
+def prepare(rows: list, photos: str) -> list:
+    results = []
+    for row in rows:
+        try:
+            path = _photo_path(row, photos)
+            if path is None:
+                raise ValueError("photo not found")
+            data = _read_photo(path)
+            try:
+                faces = embeddings.extract_faces(data)
+            except ValueError:
+                raise ValueError("no face detected")
+            if len(faces) > 1:
+                raise ValueError(f"{len(faces)} faces detected")
+            # Only rows with a usable photo pay for bcrypt
+            if row.get("password_hash"):
+                password = row["password_hash"]
+            elif row.get("password"):
+                password = bcrypt.hashpw(row["password"].encode(), bcrypt.gensalt()).decode()
+            else:
+                raise ValueError("no password")
+            results.append({"emp_no": row["emp_no"], "row": row, "password": password, "data": data, "face": faces[0]})
+        except Exception as e:
+            results.append({"emp_no": row["emp_no"], "error": str(e)})
+
+    ready = [result for result in results if "face" in result]
+    if ready:
+        try:
+            vectors = embeddings.forward(np.concatenate([result.pop("face") for result in ready]))
+        except Exception as e:
+            error = f"embedding failed: {str(e)}"
+            return [{"emp_no": result["emp_no"], "error": error} if "row" in result else result
+                    for result in results]
+        for result, vector in zip(ready, vectors):
+            data = result.pop("data")
+            result["image_hash"] = image_store.put(data)
+            result["image_size"] = len(data)
+            result["embedding"] = embeddings.to_blob(vector)
+    return results
+
+
+def read_rows(path: str) -> tuple:
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        reader = csv.DictReader(fh)
+        fieldnames = [name.strip() for name in reader.fieldnames or []]
+        rows = [{name: (value or "").strip() for name, value in zip(fieldnames, record.values())}
+                for record in reader]
+    return fieldnames, rows
+
+
+def read_checkpoint(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path) as fh:
+        return {line.strip() for line in fh if line.strip()}
+
+
+def append_checkpoint(path: str, emp_nos: list):
+    with open(path, "a") as fh:
+        fh.writelines(f"{emp_no}\n" for emp_no in emp_nos)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+async def users_columns(cursor) -> set:
+    await cursor.execute(
+        """SELECT COLUMN_NAME FROM information_schema.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'"""
+    )
+    return {row[0] for row in await cursor.fetchall()}
+
+
+# First column of query for values, 500 at a time; query has one {} for the
+# IN list
+async def _select_in(cursor, query: str, values: list) -> set:
+    found = set()
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        await cursor.execute(query.format(", ".join(["%s"] * len(chunk))), chunk)
+        found.update(row[0] for row in await cursor.fetchall())
+    return found
+
+
+# The values of users.column already taken among values
+async def existing(cursor, column: str, values: list) -> set:
+    return await _select_in(cursor, f"SELECT {column} FROM users WHERE {column} IN ({{}})", values)
+
+
+# The emp_nos among emp_nos that already have a stored face
+async def with_face(cursor, emp_nos: list) -> set:
+    return await _select_in(cursor, "SELECT emp_no FROM face_image WHERE emp_no IN ({})", emp_nos)
+
+
+class Enrollment:
+    def __init__(self, db, user_columns: list, role: str, checkpoint: str):
+        self.db = db
+        self.user_columns = user_columns
+        self.role = role
+        self.checkpoint = checkpoint
+        self.insert_user = (
+            f"INSERT INTO users ({', '.join(f'`{column}`' for column in user_columns)}, `password`) "
+            f"VALUES ({', '.join(['%s'] * (len(user_columns) + 1))})"
+        )
+        self.enrolled = 0
+        self.failures = []
+
+    async def _insert(self, cursor, items: list, now):
+        await cursor.executemany(self.insert_user, [
+            tuple(item["row"][column] or None for column in self.user_columns) + (item["password"],)
+            for item in items
+        ])
+        await cursor.executemany(
+            "INSERT INTO system_access (emp_no, role_id) VALUES (%s, %s)",
+            [(item["emp_no"], item["row"].get("role_id") or self.role) for item in items]
+        )
+        await cursor.executemany(
+            "INSERT INTO face_image (emp_no, image_hash, image_size, last_update) VALUES (%s, %s, %s, %s)",
+            [(item["emp_no"], item["image_hash"], item["image_size"], now) for item in items]
+        )
+        await cursor.executemany(
+            embeddings.UPSERT_EMBEDDING,
+            [(item["emp_no"], embeddings.MODEL_NAME, item["embedding"], now) for item in items]
+        )
+
+    # Insert one batch in a single transaction. When a row breaks it (duplicate
+    # email, a value the column rejects), the batch is retried row by row so
+    # only that row is reported.
+    async def write(self, items: list):
+        # MySQL DATETIME drops microseconds; the embedding version must match
+        now = datetime.now().replace(microsecond=0)
+        cursor = await self.db.cursor()
+        try:
+            try:
+                await self._insert(cursor, items, now)
+                await self.db.commit()
+                committed = items
+            except Exception as e:
+                await self.db.rollback()
+                logging.warning(f"Batch of {len(items)} failed ({str(e)}), inserting row by row")
+                committed = []
+                for item in items:
+                    try:
+                        await self._insert(cursor, [item], now)
+                        await self.db.commit()
+                        committed.append(item)
+                    except Exception as e:
+                        await self.db.rollback()
+                        self.failures.append((item["emp_no"], f"insert failed: {str(e)}"))
+        finally:
+            await cursor.close()
+        append_checkpoint(self.checkpoint, [item["emp_no"] for item in committed])
+        self.enrolled += len(committed)
+
+
+async def enroll(db, args):
+    fieldnames, rows = read_rows(args.csv)
+    missing = [name for name in ("emp_no", "email") if name not in fieldnames]
+    if "password" not in fieldnames and "password_hash" not in fieldnames:
+        missing.append("password")
+    if missing:
+        raise SystemExit(f"{args.csv} has no {', '.join(missing)} column")
+
+    cursor = await db.cursor()
+    try:
+        await embeddings.ensure_schema(cursor)
+        await image_store.ensure_schema(cursor)
+        await db.commit()
+        user_columns = [name for name in fieldnames if name not in SPECIAL_COLUMNS]
+        unknown = [name for name in user_columns if name not in await users_columns(cursor)]
+        if unknown:
+            raise SystemExit(f"users has no column {', '.join(unknown)}")
+
+        done = read_checkpoint(args.checkpoint)
+        enrollment = Enrollment(db, user_columns, args.role, args.checkpoint)
+        candidates, seen_emp_nos, seen_emails = [], set(), set()
+        for row in rows:
+            if not row["emp_no"] or not row["email"]:
+                enrollment.failures.append((row["emp_no"], "no emp_no or email"))
+            elif row["emp_no"] in seen_emp_nos:
+                enrollment.failures.append((row["emp_no"], "duplicate emp_no in the CSV"))
+            elif row["email"].lower() in seen_emails:
+                enrollment.failures.append((row["emp_no"], "duplicate email in the CSV"))
+            elif row["emp_no"] not in done:
+                candidates.append(row)
+            seen_emp_nos.add(row["emp_no"])
+            seen_emails.add(row["email"].lower())
+        # Committed by a run that stopped before its checkpoint write, or enrolled
+        # earlier. Users created some other way may have no face yet; the photo
+        # of an existing employee goes through /request_face_update/ and its
+        # approval, not around it, so those rows are reported instead.
+        users = await existing(cursor, "emp_no", [row["emp_no"] for row in candidates])
+        enrolled = await with_face(cursor, sorted(users))
+        # Login looks users up by email, so it has to stay unique
+        emails = {email.lower() for email in await existing(
+            cursor, "email", [row["email"] for row in candidates if row["emp_no"] not in users])}
+    finally:
+        await cursor.close()
+    if enrolled:
+        append_checkpoint(args.checkpoint, sorted(enrolled))
+    pending = []
+    for row in candidates:
+        if row["emp_no"] in enrolled:
+            continue
+        if row["emp_no"] in users:
+            enrollment.failures.append((row["emp_no"], "emp_no already in users without a face; "
+                                                       "submit it through /request_face_update/"))
+        elif row["email"].lower() in emails:
+            enrollment.failures.append((row["emp_no"], "email already in use"))
+        else:
+            pending.append(row)
+    logging.info(f"{len(rows)} rows: {len(done) + len(enrolled)} already enrolled, {len(pending)} to enroll "
+                 f"with {args.workers} workers")
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # spawn: TensorFlow and the event loop's threads do not survive fork()
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        async def run_chunk(chunk):
+            try:
+                return await loop.run_in_executor(executor, prepare, chunk, args.photos)
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                return [{"emp_no": row["emp_no"], "error": f"worker failed: {str(e)}"} for row in chunk]
+
+        chunks = [pending[start:start + CHUNK_SIZE] for start in range(0, len(pending), CHUNK_SIZE)]
+        batch = []
+        for finished in asyncio.as_completed([run_chunk(chunk) for chunk in chunks]):
+            for result in await finished:
+                if "error" in result:
+                    enrollment.failures.append((result["emp_no"], result["error"]))
+                else:
+                    batch.append(result)
+            if len(batch) >= args.batch:
+                await enrollment.write(batch)
+                batch = []
+                elapsed = time.perf_counter() - started
+                logging.info(f"Enrolled {enrollment.enrolled}/{len(pending)}, {len(enrollment.failures)} failed, "
+                             f"{enrollment.enrolled / elapsed:.1f}/s")
+        if batch:
+            await enrollment.write(batch)
+
+    with open(args.report, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["emp_no", "reason"])
+        writer.writerows(enrollment.failures)
+    logging.info(f"Enrolled {enrollment.enrolled} employees in {time.perf_counter() - started:.1f}s; "
+                 f"{len(enrollment.failures)} failed, see {args.report}")
+    return enrollment.enrolled, enrollment.failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll employees and their face photos from a CSV")
+    parser.add_argument("csv", help="emp_no, email, password or password_hash, optional role_id, photo and users columns")
+    parser.add_argument("--photos", required=True, help="folder with the photos (<emp_no>.jpg unless the CSV names them)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="processes hashing passwords and embedding faces; each loads the model")
+    parser.add_argument("--batch", type=int, default=200, help="rows per executemany transaction")
+    parser.add_argument("--role", default="0", help="system_access.role_id for rows without one")
+    parser.add_argument("--checkpoint", help="committed emp_nos, for resuming (default: <csv>.checkpoint)")
+    parser.add_argument("--report", help="failed rows and reasons (default: <csv>.failures.csv)")
+    args = parser.parse_args()
+    stem = os.path.splitext(args.csv)[0]
+    args.checkpoint = args.checkpoint or f"{stem}.checkpoint"
+    args.report = args.report or f"{stem}.failures.csv"
+
+    logging.basicConfig(level=logging.INFO)
+    import db_pool
+    from main import dbconnect
+
+    async def run():
+        db = await dbconnect()
+        try:
+            await enroll(db, args)
+        finally:
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
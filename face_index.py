@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+import embeddings
+
+# hnswlib is optional; without it every search is an exact matrix scan
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Switch to the approximate index once this many faces are enrolled (0 disables it)
+ANN_MIN_SIZE = int(os.getenv("FACE_INDEX_ANN_MIN_SIZE", "50000"))
+REFRESH_SECONDS = float(os.getenv("FACE_INDEX_REFRESH_SECONDS", "30"))
+
+
+# In-memory 1:N index over the enrolled Facenet vectors. Rows are stored
+# L2-normalised so cosine distance is one matrix-vector product.
+class FaceIndex:
+    def __init__(self, dim: int = 128, ann_min_size: int = ANN_MIN_SIZE):
+        self.dim = dim
+        self.ann_min_size = ann_min_size
+        self.emp_nos = []
+        self.positions = {}
+        self.matrix = np.empty((1024, dim), dtype=np.float32)
+        self.last_computed = None
+        self._ann = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.emp_nos)
+
+    def upsert(self, emp_no: str, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / np.linalg.norm(vector)
+        with self._lock:
+            position = self.positions.get(emp_no)
+            if position is None:
+                position = len(self.emp_nos)
+                if position == len(self.matrix):
+                    self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+                self.emp_nos.append(emp_no)
+                self.positions[emp_no] = position
+            self.matrix[position] = vector
+
+            if self._ann is not None:
+                if position >= self._ann.get_max_elements():
+                    self._ann.resize_index(2 * self._ann.get_max_elements())
+                self._ann.add_items(vector[None, :], [position])
+            elif hnswlib and self.ann_min_size and len(self.emp_nos) >= self.ann_min_size:
+                self._build_ann()
+
+    def _build_ann(self):
+        size = len(self.emp_nos)
+        ann = hnswlib.Index(space="cosine", dim=self.dim)
+        ann.init_index(max_elements=2 * size, ef_construction=200, M=16)
+        ann.add_items(self.matrix[:size], np.arange(size))
+        ann.set_ef(64)
+        self._ann = ann
+        logging.info(f"Built approximate face index over {size} faces")
+
+    # Returns up to k (emp_no, cosine distance) pairs, closest first
+    def search(self, vector, k: int = 1) -> list:
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / np.linalg.norm(vector)
+        with self._lock:
+            size = len(self.emp_nos)
+            if size == 0:
+                return []
+            k = min(k, size)
+
+            if self._ann is not None:
+                labels, distances = self._ann.knn_query(vector, k=k)
+                return [(self.emp_nos[label], float(distance))
+                        for label, distance in zip(labels[0], distances[0])]
+
+            similarities = self.matrix[:size] @ vector
+            if k == 1:
+                best = [int(np.argmax(similarities))]
+            else:
+                best = np.argpartition(-similarities, k - 1)[:k]
+                best = best[np.argsort(-similarities[best])]
+            return [(self.emp_nos[i], float(1 - similarities[i])) for i in best]
+
+    # Load embeddings computed since the last call (everything on the first call).
+    # Approvals handled by other workers reach this worker through here.
+    async def refresh(self, cursor) -> int:
+        if self.last_computed is None:
+            await cursor.execute(
+                "SELECT emp_no, embedding, date_computed FROM face_embedding WHERE model_name = %s",
+                (embeddings.MODEL_NAME,)
+            )
+        else:
+            # >= because date_computed has one-second resolution; re-adding a row is harmless
+            await cursor.execute(
+                """SELECT emp_no, embedding, date_computed FROM face_embedding
+                   WHERE model_name = %s AND date_computed >= %s""",
+                (embeddings.MODEL_NAME, self.last_computed)
+            )
+        rows = await cursor.fetchall()
+        for emp_no, blob, date_computed in rows:
+            self.upsert(emp_no, embeddings.from_blob(blob))
+            if self.last_computed is None or date_computed > self.last_computed:
+                self.last_computed = date_computed
+        return len(rows)
+
+
+index = FaceIndex()
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from invalidation import channel
+
+# Kiosks on flaky networks retry uploads whose response they never saw. A retry
+# of a clock-in that was already decided gets the same answer back, without
+# running the model again or logging the clock-in twice. Outcomes are keyed on
+# the employee (or, for lobby kiosks, the device), the log mode and a hash of
+# the photo or the client's Idempotency-Key header, kept for
+# IDEMPOTENCY_TTL_SECONDS, and shared with the other workers through the
+# invalidation channel. A retry that arrives
+# while the original is still running waits up to IDEMPOTENCY_WAIT_SECONDS for
+# its outcome.
+TTL = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "120"))
+MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "20"))
+POLL_SECONDS = 0.05
+TOPIC = "recognition_outcome"
+
+
+# scope is whoever the retry comes from: the employee, or the kiosk's address.
+# A client key only has to be unique for that scope, so it never matches
+# another device's request or the same request in the other log mode.
+def key(scope: str, log: str, image_data: bytes, client_key: str = None) -> str:
+    if client_key:
+        material = f"{scope}\0{log}\0key\0{client_key}".encode()
+    else:
+        material = f"{scope}\0{log}\0".encode() + hashlib.sha256(image_data).digest()
+    return hashlib.sha256(material).hexdigest()[:32]
+
+
+class OutcomeCache:
+    def __init__(self, ttl: float = TTL, max_entries: int = MAX_ENTRIES, wait_seconds: float = WAIT_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        # key -> (expires_at, outcome), least recently used first
+        self._outcomes = OrderedDict()
+        # key -> expires_at of a request still running, here or on another worker
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "waited": 0, "stored": 0, "evicted": 0}
+
+    # Channel handler: {"key", "state": "pending" | "done" | "released", "outcome"}
+    def _apply(self, message: dict, expires_at: float):
+        with self._lock:
+            cache_key = message["key"]
+            if message["state"] == "pending":
+                self._pending[cache_key] = expires_at
+                return
+            self._pending.pop(cache_key, None)
+            if message["state"] == "done":
+                self._outcomes[cache_key] = (expires_at, message["outcome"])
+                self._outcomes.move_to_end(cache_key)
+                while len(self._outcomes) > self.max_entries:
+                    self._outcomes.popitem(last=False)
+                    self._stats["evicted"] += 1
+
+    def _lookup(self, cache_key: str, now: float):
+        with self._lock:
+            entry = self._outcomes.get(cache_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._outcomes.move_to_end(cache_key)
+                    return entry[1], False
+                del self._outcomes[cache_key]
+            pending = self._pending.get(cache_key)
+            if pending is not None and pending <= now:
+                del self._pending[cache_key]
+                pending = None
+            return None, pending is not None
+
+    # Applied here at once; the append to the shared channel file waits on its
+    # flock, so it runs in a thread rather than on the event loop
+    async def _publish(self, message: dict, expires_at: float):
+        self._apply(message, expires_at)
+        await asyncio.to_thread(channel.publish, TOPIC, message, expires_at)
+
+    # The stored outcome for cache_key, waiting while a twin request is still
+    # running. Returns None when the caller should do the work itself; it then
+    # owns the key and must call release() when done.
+    async def claim(self, cache_key: str):
+        deadline = time.time() + self.wait_seconds
+        waited = False
+        while True:
+            channel.poll()
+            now = time.time()
+            outcome, running = self._lookup(cache_key, now)
+            if outcome is not None:
+                self._stats["hits"] += 1
+                self._stats["waited"] += waited
+                return outcome
+            if not running or now >= deadline:
+                break
+            waited = True
+            await asyncio.sleep(POLL_SECONDS)
+        self._stats["misses"] += 1
+        await self._publish({"key": cache_key, "state": "pending"}, time.time() + self.wait_seconds)
+        return None
+
+    # Record the outcome of a claimed request, or None when it failed in a way
+    # a retry should not inherit (busy, timeout, database error)
+    async def release(self, cache_key: str, outcome: dict = None):
+        if outcome is None:
+            await self._publish({"key": cache_key, "state": "released"}, time.time() + self.wait_seconds)
+        else:
+            self._stats["stored"] += 1
+            await self._publish({"key": cache_key, "state": "done", "outcome": outcome}, time.time() + self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._outcomes), "pending": len(self._pending), **self._stats}
+
+
+cache = OutcomeCache()
+channel.subscribe(TOPIC, cache._apply)
+
+
+def success(body: dict) -> dict:
+    return {"status": 200, "body": body}
+
+
+def failure(status_code: int, detail: str) -> dict:
+    return {"status": status_code, "detail": detail}
+
+
+# Answer a retry with the original response, marked as a replay
+def replay(outcome: dict):
+    headers = {"Idempotent-Replayed": "true"}
+    if outcome["status"] == 200:
+        return JSONResponse(outcome["body"], headers=headers)
+    raise HTTPException(status_code=outcome["status"], detail=outcome["detail"], headers=headers)
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import FileResponse, Response
+
+import db_pool
+
+# Face photos live on disk keyed by the SHA-256 of their bytes, sharded two
+# levels deep (ab/cd/abcd...). The DB keeps only image_hash and image_size, so
+# identical uploads are stored once and the BLOB columns stay empty.
+ROOT = os.getenv("IMAGE_STORE_DIR", "image_store")
+# When set (e.g. "/protected-images"), responses hand the file to nginx with
+# X-Accel-Redirect instead of streaming it through the worker
+ACCEL_PREFIX = os.getenv("IMAGE_STORE_ACCEL_PREFIX", "").rstrip("/")
+# Per-employee image URLs are not content-addressed, so browsers revalidate on
+# every view and get a body-less 304 until the next approval
+CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "private, no-cache")
+# The store holds the only copy of every face photo, so it must live on
+# persistent storage: a volume or bind mount in a container, never the
+# container's own overlay filesystem or a tmpfs
+EPHEMERAL_FILESYSTEMS = {"overlay", "aufs", "tmpfs", "ramfs"}
+
+# table -> (primary key, [(BLOB column, hash column, size column or None)])
+TABLES = {
+    "face_image": ("emp_no", [("image", "image_hash", "image_size")]),
+    "approval_requests": ("request_id", [("image", "image_hash", "image_size"),
+                                         ("thumbnail", "thumbnail_hash", None)]),
+}
+
+
+async def ensure_schema(cursor):
+    for table, (_, columns) in TABLES.items():
+        await cursor.execute(
+            """SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""",
+            (table,)
+        )
+        existing = {name: (column_type, nullable) for name, column_type, nullable in await cursor.fetchall()}
+        for blob_column, hash_column, size_column in columns:
+            if hash_column not in existing:
+                await db_pool.ddl(cursor, f"ALTER TABLE {table} ADD COLUMN {hash_column} CHAR(64) NULL")
+            if size_column and size_column not in existing:
+                await db_pool.ddl(cursor, f"ALTER TABLE {table} ADD COLUMN {size_column} INT UNSIGNED NULL")
+            # New rows only fill the hash, so the old BLOB column must accept NULL
+            if blob_column in existing and existing[blob_column][1] == "NO":
+                await cursor.execute(f"ALTER TABLE {table} MODIFY {blob_column} {existing[blob_column][0]} NULL")
+
+
+# Filesystem type of the mount holding directory, from /proc/mounts (None
+# where that is not available)
+def filesystem_type(directory: str = ROOT):
+    try:
+        with open("/proc/mounts") as fh:
+            mounts = [line.split()[1:3] for line in fh]
+    except OSError:
+        return None
+    target = os.path.realpath(directory)
+    best = None
+    for mount_point, fstype in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        inside = target == mount_point or target.startswith(mount_point.rstrip("/") + "/")
+        if inside and (best is None or len(mount_point) > len(best[0])):
+            best = (mount_point, fstype)
+    return best[1] if best else None
+
+
+def ephemeral(directory: str = ROOT) -> bool:
+    return filesystem_type(directory) in EPHEMERAL_FILESYSTEMS
+
+
+def path(image_hash: str) -> str:
+    return os.path.join(ROOT, image_hash[:2], image_hash[2:4], image_hash)
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Store the bytes and return their hash; a file that is already there is reused.
+# The file and its directory entries are fsynced before returning, since callers
+# commit rows pointing at it (and migrate() then drops the BLOB). This blocks:
+# call it from a thread when on the event loop.
+def put(data: bytes) -> str:
+    image_hash = hashlib.sha256(data).hexdigest()
+    target = path(image_hash)
+    if os.path.exists(target):
+        return image_hash
+
+    directory = os.path.dirname(target)
+    # Shard directories created here must reach the disk too
+    new_directories = []
+    parent = directory
+    while not os.path.isdir(parent):
+        new_directories.append(parent)
+        parent = os.path.dirname(parent)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_directory(directory)
+    for created in new_directories:
+        _fsync_directory(os.path.dirname(created) or ".")
+    return image_hash
+
+
+# Bytes for a row: from the store when it has a hash, else the legacy BLOB
+# (rows the migration has not reached yet)
+def read(image_hash, blob=None):
+    if image_hash:
+        with open(path(image_hash), "rb") as fh:
+            return fh.read()
+    return blob or None
+
+
+def response(image_hash, blob=None, media_type: str = "image/jpeg", headers: dict = None):
+    headers = dict(headers or {})
+    if not image_hash:
+        return Response(content=blob, media_type=media_type, headers=headers)
+    if ACCEL_PREFIX:
+        headers["X-Accel-Redirect"] = f"{ACCEL_PREFIX}/{image_hash[:2]}/{image_hash[2:4]}/{image_hash}"
+        return Response(media_type=media_type, headers=headers)
+    return FileResponse(path(image_hash), media_type=media_type, headers=headers)
+
+
+# Validators for a stored image: the content hash is the strong ETag; rows the
+# migration has not reached yet fall back to a hash of their version key
+def cache_headers(image_hash, version: str, modified: datetime = None) -> dict:
+    tag = image_hash or hashlib.sha256(version.encode()).hexdigest()
+    headers = {"ETag": f'"{tag}"', "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+    if modified:
+        # DATETIME columns are naive server-local times
+        headers["Last-Modified"] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def _modified_since(value: str, last_modified: str) -> bool:
+    try:
+        return parsedate_to_datetime(last_modified) > parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return True
+
+
+# 304 for a request whose validators still match, else None. If-None-Match wins
+# over If-Modified-Since, as in RFC 9110.
+def not_modified(request, headers: dict):
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        fresh = "*" in tags or headers["ETag"] in tags
+    elif if_modified_since is not None and "Last-Modified" in headers:
+        fresh = not _modified_since(if_modified_since, headers["Last-Modified"])
+    else:
+        fresh = False
+    return Response(status_code=304, headers=headers) if fresh else None
+
+
+# Move existing BLOBs into the store, one row per transaction, and empty the
+# BLOB columns so InnoDB stops caching image pages. Refuses to run when the
+# store is on a filesystem that does not outlive the container.
+async def migrate(db, allow_ephemeral: bool = False) -> int:
+    if ephemeral() and not allow_ephemeral:
+        raise RuntimeError(
+            f"{ROOT} is on a {filesystem_type()} filesystem that is lost with the container; "
+            f"mount a volume there (or set IMAGE_STORE_DIR) before emptying the BLOB columns, "
+            f"or pass --allow-ephemeral"
+        )
+    cursor = await db.cursor()
+    moved = 0
+    try:
+        await ensure_schema(cursor)
+        await db.commit()
+        for table, (key, columns) in TABLES.items():
+            await cursor.execute(
+                """SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""",
+                (table,)
+            )
+            existing = {row[0] for row in await cursor.fetchall()}
+            for blob_column, hash_column, size_column in columns:
+                if blob_column not in existing:
+                    continue
+                await cursor.execute(f"SELECT {key} FROM {table} WHERE {blob_column} IS NOT NULL")
+                pending = [row[0] for row in await cursor.fetchall()]
+                logging.info(f"Moving {len(pending)} {table}.{blob_column} BLOBs to {ROOT}")
+                for row_key in pending:
+                    await cursor.execute(
+                        f"SELECT {blob_column} FROM {table} WHERE {key} = %s AND {blob_column} IS NOT NULL FOR UPDATE",
+                        (row_key,)
+                    )
+                    row = await cursor.fetchone()
+                    if not row:
+                        await db.commit()
+                        continue
+                    data = row[0]
+                    image_hash = await asyncio.to_thread(put, data)
+                    assignments = f"{hash_column} = %s, {blob_column} = NULL"
+                    params = [image_hash]
+                    if size_column:
+                        assignments += f", {size_column} = %s"
+                        params.append(len(data))
+                    await cursor.execute(f"UPDATE {table} SET {assignments} WHERE {key} = %s", params + [row_key])
+                    await db.commit()
+                    moved += 1
+        logging.info(f"Migration finished: {moved} images moved")
+        return moved
+    finally:
+        await cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the on-disk face image store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="move face_image/approval_requests BLOBs to the store")
+    migrate_parser.add_argument("--allow-ephemeral", action="store_true",
+                                help="run even if IMAGE_STORE_DIR is not on persistent storage")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from main import dbconnect
+
+    async def run():
+        db = await dbconnect()
+        try:
+            await migrate(db, args.allow_ephemeral)
+        finally:
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+# DeepFace/OpenCV calls are CPU bound and block whatever thread runs them, so
+# they go through this bounded pool instead of running on the event loop.
+# Admission is capped at INFERENCE_WORKERS running + INFERENCE_QUEUE_SIZE waiting;
+# anything beyond that is turned away immediately with a Retry-After hint.
+MAX_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "15"))
+RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="inference")
+_lock = threading.Lock()
+_stats = {
+    "admitted": 0,
+    "running": 0,
+    "started": 0,
+    "completed": 0,
+    "rejected": 0,
+    "timeouts": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+}
+
+
+def _release(_future):
+    with _lock:
+        _stats["admitted"] -= 1
+        _stats["completed"] += 1
+
+
+# Run fn(*args, **kwargs) on the inference pool and await its result.
+# Raises 503 when the wait queue is full and 504 when the job exceeds TIMEOUT.
+async def run(fn, *args, **kwargs):
+    with _lock:
+        if _stats["admitted"] >= MAX_WORKERS + QUEUE_SIZE:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Face recognition is busy, please retry",
+                headers={"Retry-After": str(RETRY_AFTER)}
+            )
+        _stats["admitted"] += 1
+
+    submitted = time.monotonic()
+
+    def job():
+        waited = time.monotonic() - submitted
+        with _lock:
+            _stats["running"] += 1
+            _stats["started"] += 1
+            _stats["wait_total"] += waited
+            _stats["wait_max"] = max(_stats["wait_max"], waited)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _lock:
+                _stats["running"] -= 1
+
+    # The slot is released when the job really finishes (or is cancelled while
+    # still queued), not when the caller stops waiting for it
+    future = _executor.submit(job)
+    future.add_done_callback(_release)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), TIMEOUT)
+    except asyncio.TimeoutError:
+        with _lock:
+            _stats["timeouts"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Face recognition timed out",
+            headers={"Retry-After": str(RETRY_AFTER)}
+        )
+
+
+def stats() -> dict:
+    with _lock:
+        snapshot = dict(_stats)
+    started = snapshot["started"]
+    return {
+        "workers": MAX_WORKERS,
+        "queue_size": QUEUE_SIZE,
+        "timeout_seconds": TIMEOUT,
+        "running": snapshot["running"],
+        "queued": snapshot["admitted"] - snapshot["running"],
+        "completed": snapshot["completed"],
+        "rejected": snapshot["rejected"],
+        "timeouts": snapshot["timeouts"],
+        "avg_wait_ms": round(snapshot["wait_total"] / started * 1000, 2) if started else 0.0,
+        "max_wait_ms": round(snapshot["wait_max"] * 1000, 2),
+    }
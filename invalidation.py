@@ -0,0 +1,110 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+CHANNEL_PATH = os.getenv("INVALIDATION_CHANNEL", "/tmp/stamp-invalidation.log")
+# How often each worker rewrites the log without expired messages
+COMPACT_SECONDS = float(os.getenv("INVALIDATION_COMPACT_SECONDS", "3600"))
+
+
+# Lightweight invalidation channel between the uvicorn workers of one host.
+# Publishers append one JSON line per message under an exclusive flock;
+# subscribers stat() the file and only read what was appended since their last
+# poll, so checking for news costs a single stat() when nothing changed.
+# Every message carries an expiry, and compact() drops the expired ones.
+class Channel:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._handlers = {}
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def subscribe(self, topic: str, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, payload, expires_at: float):
+        line = json.dumps({"topic": topic, "payload": payload, "expires_at": expires_at}) + "\n"
+        with self._exclusive():
+            with open(self.path, "a") as fh:
+                fh.write(line)
+
+    # Deliver messages appended since the last poll to their handlers
+    def poll(self) -> int:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            if st.st_ino == self._inode and st.st_size <= self._offset:
+                return 0
+            try:
+                fh = open(self.path, "rb")
+            except FileNotFoundError:
+                return 0
+            with fh:
+                inode = os.fstat(fh.fileno()).st_ino
+                if inode != self._inode:
+                    # First poll, or the file was compacted: read it from the start
+                    self._inode, self._offset, self._partial = inode, 0, b""
+                fh.seek(self._offset)
+                data = fh.read()
+            self._offset += len(data)
+            lines = (self._partial + data).split(b"\n")
+            self._partial = lines.pop()
+
+        now = time.time()
+        delivered = 0
+        for line in lines:
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logging.warning("Skipping malformed invalidation message")
+                continue
+            if message["expires_at"] <= now:
+                continue
+            for handler in self._handlers.get(message["topic"], []):
+                handler(message["payload"], message["expires_at"])
+            delivered += 1
+        return delivered
+
+    # Rewrite the log without expired messages
+    def compact(self):
+        now = time.time()
+        with self._exclusive():
+            try:
+                with open(self.path, "rb") as fh:
+                    lines = fh.read().splitlines()
+            except FileNotFoundError:
+                return
+            kept = []
+            for line in lines:
+                try:
+                    if json.loads(line)["expires_at"] > now:
+                        kept.append(line + b"\n")
+                except ValueError:
+                    continue
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.writelines(kept)
+            os.replace(tmp_path, self.path)
+
+
+channel = Channel(CHANNEL_PATH)
@@ -0,0 +1,148 @@
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+
+from invalidation import channel
+
+# The valid_ip table held in memory as prefix tries, so the recognition gate
+# needs no query per clock-in. add/delete invalidate it on every worker
+# through the invalidation channel; REFRESH_SECONDS is the backstop reload.
+REFRESH_SECONDS = float(os.getenv("IP_ALLOWLIST_REFRESH_SECONDS", "60"))
+TOPIC = "valid_ip"
+INVALIDATION_TTL = 3600
+# Dotted quads as the old valid_ip form accepted them, zero padding included
+DOTTED_QUAD = re.compile(r"^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})(/\d{1,2})?$")
+
+
+# Binary trie over address bits. A marked node allows every address below it,
+# so a lookup walks at most prefix-length nodes.
+class PrefixTrie:
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = [None, None, False]
+
+    def insert(self, network):
+        node = self.root
+        value = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (value >> (self.bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+
+    def contains(self, value: int) -> bool:
+        node = self.root
+        for i in range(self.bits):
+            if node[2]:
+                return True
+            node = node[(value >> (self.bits - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+class Allowlist:
+    def __init__(self, entries):
+        self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self.size = 0
+        for entry in entries:
+            try:
+                network = parse(entry)
+            except ValueError:
+                logging.warning(f"Ignoring invalid valid_ip entry: {entry!r}")
+                continue
+            self.tries[network.version].insert(network)
+            self.size += 1
+
+    def allows(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        return self.tries[address.version].contains(int(address))
+
+
+# Accepts a single IPv4/IPv6 address or a CIDR range; host bits of a range are
+# ignored. Zero-padded octets (010.001.002.003), which ipaddress rejects but older
+# valid_ip rows may hold, are read as decimal.
+def parse(entry: str):
+    entry = entry.strip()
+    quad = DOTTED_QUAD.match(entry)
+    if quad:
+        entry = ".".join(str(int(octet)) for octet in quad.groups()[:4]) + (quad.group(5) or "")
+    return ipaddress.ip_network(entry, strict=False)
+
+
+# Canonical form stored in valid_ip: a plain address for /32 and /128, CIDR otherwise
+def normalize(entry: str) -> str:
+    network = parse(entry)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+_allowlist = None
+_loaded_at = 0.0
+_generation = 0
+_lock = threading.Lock()
+
+
+def _invalidate(_payload=None, _expires_at=None):
+    global _allowlist, _generation
+    with _lock:
+        _allowlist = None
+        _generation += 1
+
+
+channel.subscribe(TOPIC, _invalidate)
+
+
+async def is_allowed(cursor, ip: str) -> bool:
+    global _allowlist, _loaded_at
+    channel.poll()
+    with _lock:
+        allowlist, generation = _allowlist, _generation
+    if allowlist is None or time.monotonic() - _loaded_at > REFRESH_SECONDS:
+        # Never hold the lock across the query; an invalidation that lands
+        # meanwhile bumps the generation and keeps this (maybe stale) load out
+        await cursor.execute("SELECT ip FROM valid_ip")
+        allowlist = Allowlist(row[0] for row in await cursor.fetchall())
+        with _lock:
+            if generation == _generation:
+                _allowlist, _loaded_at = allowlist, time.monotonic()
+    return allowlist.allows(ip)
+
+
+# Call after committing a change to valid_ip
+def invalidate():
+    _invalidate()
+    channel.publish(TOPIC, None, time.time() + INVALIDATION_TTL)
+
+
+# CIDR and IPv6 entries need more room than a dotted quad, and legacy rows are
+# rewritten in canonical form so /delete_ip_address/ finds them
+async def ensure_schema(cursor):
+    await cursor.execute(
+        """SELECT CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE
+           FROM information_schema.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'valid_ip' AND COLUMN_NAME = 'ip'"""
+    )
+    column = await cursor.fetchone()
+    if column and column[0] is not None and column[0] < 64:
+        nullable = "NULL" if column[1] == "YES" else "NOT NULL"
+        await cursor.execute(f"ALTER TABLE valid_ip MODIFY ip VARCHAR(64) {nullable}")
+    await cursor.execute("SELECT valid_id, ip FROM valid_ip")
+    for valid_id, ip in await cursor.fetchall():
+        try:
+            canonical = normalize(ip)
+        except ValueError:
+            logging.warning(f"Leaving invalid valid_ip entry as is: {ip!r}")
+            continue
+        if canonical != ip:
+            await cursor.execute("UPDATE valid_ip SET ip = %s WHERE valid_id = %s", (canonical, valid_id))
@@ -0,0 +1,298 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+
+import attendance
+import timelogs
+
+# Optional write-behind for tbl_extracted_logs. A clock-in is appended to this
+# worker's local journal (fsync'd), acknowledged, and inserted later together
+# with its neighbours in one executemany + commit. Journal appends run in a
+# thread and are group-committed: clock-ins arriving while one write + fsync is
+# in progress share the next one. Journals of workers that died before
+# flushing are replayed at startup.
+ENABLED = os.getenv("LOG_WRITE_BEHIND", "0") == "1"
+JOURNAL_DIR = os.getenv("LOG_JOURNAL_DIR", "log_journal")
+FSYNC = os.getenv("LOG_JOURNAL_FSYNC", "1") == "1"
+FLUSH_MAX_BATCH = int(os.getenv("LOG_FLUSH_MAX_BATCH", "200"))
+FLUSH_INTERVAL_MS = float(os.getenv("LOG_FLUSH_INTERVAL_MS", "200"))
+RETRY_SECONDS = float(os.getenv("LOG_FLUSH_RETRY_SECONDS", "2"))
+
+# A journal record is one row of tbl_extracted_logs:
+# [EMP_NO, LOG_DATE, LOG_TIME, LOG_MODE, LOG_IMG_PATH]
+
+
+def _lock_nonblocking(fh) -> bool:
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+# Complete lines only: a torn last line (an append in progress, or a crash
+# mid-append) was never acknowledged
+def _read_records(fh) -> list:
+    fh.seek(0)
+    records = []
+    for line in fh.read().split(b"\n")[:-1]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logging.warning("Skipping malformed log journal line")
+    return records
+
+
+# Each worker appends to journal-<pid>-<token>-<n>.log and keeps an exclusive
+# flock on every segment until its rows are committed, so a segment nobody has
+# locked belongs to a dead worker.
+class LogWriter:
+    def __init__(self, directory: str = JOURNAL_DIR, max_batch: int = FLUSH_MAX_BATCH,
+                 interval_ms: float = FLUSH_INTERVAL_MS):
+        self.directory = directory
+        self.max_batch = max_batch
+        self.interval = interval_ms / 1000
+        self._pending = []
+        # (row, future) of submit() calls waiting for the next journal write
+        self._unsynced = []
+        self._syncing = None
+        # Held while a batch is written to the current segment, so flush() never
+        # seals a segment under rows that are not queued yet
+        self._journal_lock = asyncio.Lock()
+        # Other workers' segments: path -> (mtime_ns, size, records), and the
+        # directory listing as of the directory's mtime
+        self._foreign = {}
+        self._listing = (None, [])
+        # Rows of the flush in progress; still reported by pending_for()
+        self._inflight = []
+        self._segments = []
+        self._segment = None
+        self._sequence = 0
+        self._token = uuid.uuid4().hex[:8]
+        self._wakeup = None
+        self._stats = {"submitted": 0, "flushed": 0, "batches": 0, "failures": 0, "replayed": 0}
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"journal-{os.getpid()}-{self._token}-{self._sequence}.log"
+        path = os.path.join(self.directory, name)
+        # Lock under a name replay() does not look at, then publish it
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        fh = open(tmp_path, "ab")
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+        self._segment = (path, fh)
+
+    # Runs in a thread: append rows to the current segment in one write
+    def _append(self, rows):
+        if self._segment is None:
+            self._open_segment()
+        _, fh = self._segment
+        fh.write(b"".join(json.dumps(row).encode() + b"\n" for row in rows))
+        fh.flush()
+        if FSYNC:
+            os.fsync(fh.fileno())
+
+    # Journal whatever submit() calls are waiting, one batch per write, until
+    # none are left
+    async def _sync(self):
+        try:
+            while self._unsynced:
+                batch, self._unsynced = self._unsynced, []
+                async with self._journal_lock:
+                    try:
+                        await asyncio.to_thread(self._append, [row for row, _ in batch])
+                    except Exception as e:
+                        for _, future in batch:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                    self._pending.extend(row for row, _ in batch)
+                self._stats["submitted"] += len(batch)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+                if self._wakeup and (len(self._pending) == len(batch) or len(self._pending) >= self.max_batch):
+                    self._wakeup.set()
+        finally:
+            self._syncing = None
+
+    # Journal one row and queue it for the next flush; returns once it is durable
+    async def submit(self, row):
+        future = asyncio.get_running_loop().create_future()
+        self._unsynced.append((row, future))
+        if self._syncing is None:
+            self._syncing = asyncio.create_task(self._sync())
+        await future
+
+    # Journal segments in the directory, listed again only when a segment was
+    # created, renamed or removed since the last call
+    def _segment_paths(self) -> list:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if self._listing[0] != mtime:
+            self._listing = (mtime, glob.glob(os.path.join(self.directory, "journal-*.log")))
+        return self._listing[1]
+
+    # Records of another worker's segment, read again only when it has changed
+    def _foreign_records(self, path: str) -> list:
+        try:
+            stat = os.stat(path)
+            cached = self._foreign.get(path)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                return cached[2]
+            with open(path, "rb") as fh:
+                records = _read_records(fh)
+        except FileNotFoundError:
+            return []
+        self._foreign[path] = (stat.st_mtime_ns, stat.st_size, records)
+        return records
+
+    # Rows of emp_no that are journaled on this host but may not be in MySQL
+    # yet: this worker's queue plus the segments of the other workers
+    def pending_for(self, emp_no: str) -> list:
+        rows = [row for row in self._inflight + self._pending if row[0] == emp_no]
+        own = {path for path, _ in self._segments}
+        if self._segment:
+            own.add(self._segment[0])
+        paths = [path for path in self._segment_paths() if path not in own]
+        for path in set(self._foreign) - set(paths):
+            del self._foreign[path]
+        for path in paths:
+            rows.extend(row for row in self._foreign_records(path) if row[0] == emp_no)
+        return rows
+
+    async def _insert(self, db, rows):
+        cursor = await db.cursor()
+        try:
+            await cursor.executemany(timelogs.INSERT, rows)
+            await attendance.record_many(
+                cursor, [(emp_no, date, time_str[:8], mode) for emp_no, date, time_str, mode, _ in rows]
+            )
+            await db.commit()
+        finally:
+            await cursor.close()
+
+    # Insert everything queued so far. The current segment is sealed first, so
+    # every row in a sealed segment is in the batch that deletes it.
+    async def flush(self, dbconnect) -> int:
+        async with self._journal_lock:
+            if not self._pending:
+                return 0
+            rows, self._pending = self._pending, []
+            self._inflight = rows
+            if self._segment:
+                self._segments.append(self._segment)
+                self._segment = None
+            segments = list(self._segments)
+
+        done = 0
+        try:
+            db = await dbconnect()
+            try:
+                while done < len(rows):
+                    chunk = rows[done:done + self.max_batch]
+                    await self._insert(db, chunk)
+                    done += len(chunk)
+            finally:
+                await db.close()
+        except BaseException:
+            # Requeue what was not committed; the segments stay until it is
+            self._pending = rows[done:] + self._pending
+            self._stats["failures"] += 1
+            raise
+        finally:
+            self._inflight = []
+
+        for path, fh in segments:
+            os.remove(path)
+            fh.close()
+        self._segments = [segment for segment in self._segments if segment not in segments]
+        self._stats["flushed"] += len(rows)
+        self._stats["batches"] += 1
+        return len(rows)
+
+    # Background task: flush at most FLUSH_INTERVAL_MS after the first queued
+    # row, or as soon as FLUSH_MAX_BATCH rows are waiting
+    async def run(self, dbconnect):
+        self._wakeup = asyncio.Event()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            started = time.monotonic()
+            while len(self._pending) < self.max_batch:
+                remaining = self.interval - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+            try:
+                await self.flush(dbconnect)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error flushing attendance logs, retrying: {str(e)}")
+                await asyncio.sleep(RETRY_SECONDS)
+                self._wakeup.set()
+
+    # Insert the rows of segments left behind by workers that died, skipping
+    # rows that did reach MySQL before the crash
+    async def replay(self, dbconnect) -> int:
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, "journal-*.log"))):
+            try:
+                fh = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with fh:
+                if not _lock_nonblocking(fh):
+                    continue
+                rows = _read_records(fh)
+                if rows:
+                    db = await dbconnect()
+                    try:
+                        rows = await self._missing(db, rows)
+                        for start in range(0, len(rows), self.max_batch):
+                            await self._insert(db, rows[start:start + self.max_batch])
+                    finally:
+                        await db.close()
+                logging.info(f"Replayed {len(rows)} attendance logs from {path}")
+                replayed += len(rows)
+                os.remove(path)
+        self._stats["replayed"] += replayed
+        return replayed
+
+    @staticmethod
+    async def _missing(db, rows) -> list:
+        cursor = await db.cursor()
+        try:
+            missing = []
+            for row in rows:
+                await cursor.execute(
+                    """SELECT 1 FROM tbl_extracted_logs
+                       WHERE EMP_NO = %s AND LOG_DATE = %s AND LOG_TIME = %s
+                       AND LOG_MODE = %s AND LOG_IMG_PATH = %s LIMIT 1""",
+                    row
+                )
+                if not await cursor.fetchone():
+                    missing.append(row)
+            return missing
+        finally:
+            await cursor.close()
+
+    def stats(self) -> dict:
+        return dict(self._stats, pending=len(self._pending), segments=len(self._segments) + bool(self._segment))
+
+
+writer = LogWriter()
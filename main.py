@@ -1,30 +1,144 @@
-import re
 from time import sleep
-import cv2
+import time
 from fastapi import FastAPI, HTTPException, File, Request, UploadFile, Depends, status, Header, Form
-import pymysql
 from datetime import datetime, timedelta
 import jwt
 from jwt import ExpiredSignatureError
 import bcrypt
 import os
-from deepface import DeepFace
 from typing import Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-import numpy as np
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import logging
 import base64
-from pymysql.cursors import DictCursor
-import boto3
-from io import BytesIO
-from botocore.config import Config
-from botocore.exceptions import BotoCoreError, ClientError
+import json
+from aiomysql import DictCursor
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+
+# Load environment variables (before the local modules read their settings)
+load_dotenv()
+
+import embeddings
+import inference
+import face_index
+import db_pool
+import revocation
+import ip_allowlist
+import timelogs
+import thumbnails
+import image_store
+import idempotency
+import invalidation
+import attendance
+import log_writer
+import capture_archive
+import metrics
+import profiling
+import preprocess
+import recognition
+import recognition_server
+import uuid
+import asyncio
 
 logging.basicConfig(level=logging.INFO)
-app = FastAPI(root_path="/stamp-backend")
+
+# Run job(cursor) every `seconds` on a pooled connection until cancelled
+async def run_periodically(seconds: float, job, description: str):
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            db = await dbconnect()
+            cursor = await db.cursor()
+            try:
+                await job(cursor)
+                await db.commit()
+            finally:
+                await cursor.close()
+                await db.close()
+        except Exception as e:
+            logging.error(f"Error {description}: {str(e)}")
+
+# Recognition outcomes make the invalidation log grow with every clock-in
+async def compact_invalidation_channel():
+    while True:
+        await asyncio.sleep(invalidation.COMPACT_SECONDS)
+        try:
+            await asyncio.to_thread(invalidation.channel.compact)
+        except Exception as e:
+            logging.error(f"Error compacting the invalidation channel: {str(e)}")
+
+async def warm_up_recognition():
+    try:
+        await asyncio.to_thread(recognition.warm_up)
+    except Exception as e:
+        logging.error(f"Error warming up face recognition: {str(e)}")
+
+# Load the kiosk index and token revocations before serving requests. Schema
+# changes are not made here; run `python schema.py migrate` before deploying.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # With a shared recognition server the model lives there, not in the worker
+    local_model = recognition_server.client is None
+    if local_model and recognition.WARM_UP == "startup":
+        await asyncio.to_thread(recognition.warm_up)
+    if image_store.ephemeral():
+        logging.warning(f"IMAGE_STORE_DIR ({image_store.ROOT}) is on a {image_store.filesystem_type()} filesystem; "
+                        f"face images stored there are lost when the container is recreated")
+    await db_pool.pool.prefill()
+    db = await dbconnect()
+    cursor = await db.cursor()
+    try:
+        await face_index.index.refresh(cursor)
+        logging.info(f"Loaded {len(face_index.index)} faces into the kiosk index")
+        await revocation.load(cursor)
+    finally:
+        await cursor.close()
+        await db.close()
+
+    if log_writer.ENABLED:
+        # Clock-ins journaled by workers that died before flushing them
+        try:
+            await log_writer.writer.replay(dbconnect)
+        except Exception as e:
+            logging.error(f"Error replaying attendance log journals: {str(e)}")
+
+    tasks = [
+        # Pick up faces approved by other workers
+        asyncio.create_task(run_periodically(
+            face_index.REFRESH_SECONDS, face_index.index.refresh, "refreshing face index")),
+        # Purge revoked tokens that have expired anyway
+        asyncio.create_task(run_periodically(
+            revocation.SWEEP_SECONDS, revocation.sweep, "sweeping blacklisted tokens")),
+        # Write verified captures to disk off the response path
+        asyncio.create_task(capture_archive.archiver.run()),
+        # Capture retention and compaction
+        asyncio.create_task(capture_archive.archiver.sweep_periodically()),
+        # Drop expired cross-worker messages (revocations, idempotent outcomes)
+        asyncio.create_task(compact_invalidation_channel()),
+    ]
+    if log_writer.ENABLED:
+        # Write-behind inserts of tbl_extracted_logs
+        tasks.append(asyncio.create_task(log_writer.writer.run(dbconnect)))
+    if local_model and recognition.WARM_UP == "background":
+        # Load the model while the worker already serves logins and dashboards
+        tasks.append(asyncio.create_task(warm_up_recognition()))
+    yield
+    await capture_archive.archiver.drain(5)
+    for task in tasks:
+        task.cancel()
+    if log_writer.ENABLED:
+        try:
+            await log_writer.writer.flush(dbconnect)
+        except Exception as e:
+            # The journal keeps the rows; the next start replays them
+            logging.error(f"Error flushing attendance logs on shutdown: {str(e)}")
+    if recognition_server.client is not None:
+        recognition_server.client.close()
+    db_pool.pool.close()
+
+app = FastAPI(root_path="/stamp-backend", lifespan=lifespan)
 
 # Frontend to Backend connection
 app.add_middleware(
@@ -35,6 +149,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in pyinstrument report for a single request sent with X-Profile: 1. The
+# middleware is only installed when profiling is on; otherwise every request,
+# streaming exports included, would pay for a BaseHTTPMiddleware hop.
+async def profile_request(request: Request, call_next):
+    if profiling.requested(request):
+        return await profiling.profile(request, call_next)
+    return await call_next(request)
+
+if profiling.ENABLED and profiling.Profiler is not None:
+    app.middleware("http")(profile_request)
+
+# Pool and executor gauges, sampled on every /metrics scrape
+metrics.register_gauges("db_pool", "Database connection pool", db_pool.pool.stats)
+metrics.register_gauges("inference", "Inference executor", inference.stats)
+metrics.register_gauges("log_writer", "Write-behind log journal", log_writer.writer.stats)
+metrics.register_gauges("capture_archive", "Capture archive queue", capture_archive.archiver.stats)
+metrics.register_gauges("recognition", "Recognition model loading", recognition.stats)
+metrics.register_gauges("idempotency", "Replayed recognition outcomes", idempotency.cache.stats)
+if recognition_server.client is not None:
+    metrics.register_gauges("recognition_client", "Calls to the shared recognition server",
+                            recognition_server.client.stats)
+
 # Secret key for signing tokens (for testing purposes)
 SECRET_KEY = "b1c0f7a9e92d4c41b54a0d674c6f5d8f76a497d1e2d3f0"
 ALGORITHM = "HS256"
@@ -44,28 +180,48 @@ class LoginRequest(BaseModel):
     email: str
     password: str
     
-# Load environment variables
-load_dotenv()
-
-# Database connection function
-def dbconnect():
-    return pymysql.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-    )
+# 1:N matching compares against every enrolled face, so kiosks may use a
+# stricter cosine threshold than the 1:1 check
+KIOSK_THRESHOLD = float(os.getenv("KIOSK_THRESHOLD", str(embeddings.THRESHOLD)))
+
+# Database connection function; connections come from the shared pool and
+# go back to it on close()
+async def dbconnect():
+    return await db_pool.pool.acquire()
+
+# One pooled connection per request, shared by every dependency of the handler
+async def get_db():
+    db = await dbconnect()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+# A pooled connection and cursor for one short stretch of queries. The handlers
+# that wait on the model take one around their SQL only, so a clock-in queued
+# for inference does not keep a connection from logins and dashboards.
+@asynccontextmanager
+async def db_cursor():
+    db = await dbconnect()
+    cursor = await db.cursor()
+    try:
+        yield db, cursor
+    finally:
+        await cursor.close()
+        await db.close()
 
 # create JWT token
 def create_token(emp_no: str):
     payload = {
         "emp_no": emp_no,
+        "jti": uuid.uuid4().hex,
         "iat": datetime.utcnow(),
         "exp": datetime.utcnow() + timedelta(hours=12)
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-# Extract and verify JWT token from headers
+# Extract and verify JWT token from headers. Revoked tokens are checked against
+# the in-process revocation cache, so authentication never touches the DB.
 def get_current_user(authorization: str = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(
@@ -73,24 +229,9 @@ def get_current_user(authorization: str = Header(None)):
             detail="Missing or invalid token format"
         )
     token = authorization.split("Bearer ")[1]
-    db = dbconnect()
-    cursor = db.cursor()
-    try:
-        cursor.execute("SELECT COUNT(*) FROM blacklisted_tokens WHERE token = %s", (token,))
-        if cursor.fetchone()[0] > 0:
-            raise HTTPException(status_code=401, detail="Token has been blacklisted")
-    finally:
-        cursor.close()
-        db.close()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        emp_no: str = payload.get("emp_no")
-        if not emp_no:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token payload"
-            )
-        return emp_no
+        with metrics.stage("get_current_user", "jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError:
         raise HTTPException(
             status_code = status.HTTP_401_UNAUTHORIZED,
@@ -101,24 +242,32 @@ def get_current_user(authorization: str = Header(None)):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token"
         )
-async def detect_faces(image_data: bytes) -> int:
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    face_objs = DeepFace.extract_faces(img, detector_backend="opencv")
-    return len(face_objs)
+    with metrics.stage("get_current_user", "revocation_check"):
+        revoked = revocation.is_revoked(revocation.token_id(token, payload))
+    if revoked:
+        raise HTTPException(status_code=401, detail="Token has been blacklisted")
+    emp_no: str = payload.get("emp_no")
+    if not emp_no:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token payload"
+        )
+    return emp_no
+
 @app.post("/logout/")
-async def logout(emp_no: str = Depends(get_current_user), authorization: str = Header(None)):
+async def logout(emp_no: str = Depends(get_current_user), authorization: str = Header(None), db = Depends(get_db)):
     if authorization and authorization.startswith("Bearer "):
         token = authorization.split("Bearer ")[1]
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         expires_at = datetime.fromtimestamp(payload.get("exp"))
-        db = dbconnect()
-        cursor = db.cursor()
-        cursor.execute("""
-                INSERT INTO blacklisted_tokens (token, emp_no, expires_at) 
-                VALUES (%s, %s, %s)   m
-            """, (token, emp_no, expires_at))
-        db.commit()
+        jti = revocation.token_id(token, payload)
+        cursor = await db.cursor()
+        try:
+            await revocation.store(cursor, jti, emp_no, expires_at)
+            await db.commit()
+        finally:
+            await cursor.close()
+        revocation.publish(jti, expires_at)
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={"message": "Logout successful"}
@@ -181,14 +330,20 @@ async def register_face(
     # Placeholder implementation - complete as needed
     return {"message": f"Face registration initiated for {emp_no}"}
 
+# Image URLs for one approval_requests row; the list endpoints never read the BLOBs
+def approval_image_urls(request: Request, request_id: int) -> dict:
+    return {
+        "image_url": str(request.url_for("get_approval_image", request_id=request_id)),
+        "thumbnail_url": str(request.url_for("get_approval_thumbnail", request_id=request_id)),
+    }
+
 @app.get("/get_validation_data/")
-async def get_validation_data():
+async def get_validation_data(request: Request, db = Depends(get_db)):
     try:
-        db = dbconnect()
-        cursor = db.cursor(cursor=DictCursor)
+        cursor = await db.cursor(DictCursor)
         
         # Use CTE to get only the latest pending request per employee
-        cursor.execute("""
+        await cursor.execute("""
             WITH LatestRequests AS (
                 SELECT 
                     emp_no,
@@ -200,7 +355,6 @@ async def get_validation_data():
             SELECT 
                 ar.request_id,
                 ar.emp_no,
-                ar.image,
                 ar.date_requested,
                 ar.approval_status,
                 u.first_name,
@@ -215,12 +369,11 @@ async def get_validation_data():
             ORDER BY ar.date_requested DESC
         """)
         
-        results = cursor.fetchall()
+        results = await cursor.fetchall()
         formatted_results = []
         
         for row in results:
-            if row['image']:
-                row['image'] = base64.b64encode(row['image']).decode('utf-8')
+            row.update(approval_image_urls(request, row['request_id']))
             formatted_results.append(row)
             
         return formatted_results
@@ -229,8 +382,7 @@ async def get_validation_data():
         print(f"Error in get_validation_data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.post("/request_face_update/")
 async def request_face_update(
@@ -238,55 +390,68 @@ async def request_face_update(
     emp_no: str = Form(None),
     current_user: str = Depends(get_current_user)
 ):
+    result = "error"
+    started = time.perf_counter()
     try:
         emp_no = emp_no or current_user
         print(f"Processing request for emp_no: {emp_no}")
         
-        binary_data = await file.read()
-        num_faces = await detect_faces(binary_data)
-
-        if num_faces == 0:
+        with metrics.stage("request_face_update", "read"):
+            binary_data = await preprocess.read_upload(file)
+        # Detect once and keep the result: the face count, and for a single face
+        # its box, aligned crop and embedding, so approving it needs no model work
+        faces, thumbnail, vector = await recognition_server.analyze("request_face_update", binary_data)
+
+        if len(faces) == 0:
+            result = "no_face"
             return {"error": "No face detected in the image."}
-        elif num_faces > 1:
+        elif len(faces) > 1:
+            result = "multiple_faces"
             return {"error": "Multiple faces detected."}
 
-        db = dbconnect()
-        cursor = db.cursor()
+        face = faces[0]
+        with metrics.stage("request_face_update", "store"):
+            image_hash = await asyncio.to_thread(image_store.put, binary_data)
+            thumbnail_hash = await asyncio.to_thread(image_store.put, thumbnail)
+            crop_hash = await asyncio.to_thread(image_store.put, face["crop"])
+
+        with metrics.stage("request_face_update", "insert"):
+            async with db_cursor() as (db, cursor):
+                await cursor.execute(
+                    """INSERT INTO approval_requests
+                       (emp_no, image_hash, image_size, thumbnail_hash, crop_hash, face_box,
+                        embedding, embedding_model, date_requested, approval_status)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending')""",
+                    (emp_no, image_hash, len(binary_data), thumbnail_hash, crop_hash, json.dumps(face["box"]),
+                     embeddings.to_blob(vector), embeddings.MODEL_NAME, datetime.now())
+                )
+                print(f"Inserted request {cursor.lastrowid} for emp_no: {emp_no}")
 
-        cursor.execute(
-            """INSERT INTO approval_requests 
-               (emp_no, image, date_requested, approval_status) 
-               VALUES (%s, %s, %s, 'pending')""",
-            (emp_no, binary_data, datetime.now())
-        )
-        
-        print(f"Inserted request for emp_no: {emp_no}")
-        cursor.execute("SELECT * FROM approval_requests WHERE emp_no = %s ORDER BY date_requested DESC LIMIT 1", (emp_no,))
-        inserted = cursor.fetchone()
-        print(f"Inserted record: {inserted}")
-        
-        db.commit()
+                await db.commit()
+        result = "submitted"
         return {"message": f"Face update request submitted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in request_face_update: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        metrics.observe("request_face_update", "total", time.perf_counter() - started)
+        metrics.count("request_face_update", result)
 
 @app.post("/update_approval_status/")
 async def update_approval_status(
     emp_no: str = Form(...),
     currstatus: str = Form(...),
-    approval_date: str = Form(...)
+    approval_date: str = Form(...),
+    db = Depends(get_db)
 ):
     try:
-        db = dbconnect()
-        cursor = db.cursor()
+        cursor = await db.cursor()
 
         # Update approval status and date
-        cursor.execute(
+        await cursor.execute(
             """UPDATE approval_requests 
                SET approval_status = %s, 
                    approval_date = %s 
@@ -303,50 +468,72 @@ async def update_approval_status(
                )""",
             (currstatus, datetime.now(), emp_no, emp_no)
         )
-        db.commit()
+        await db.commit()
 
         if currstatus == "Approved":
-            # Get the pending image from approval_requests
-            cursor.execute(
-                """SELECT image 
+            # Get the newly approved image from approval_requests
+            await cursor.execute(
+                """SELECT image_hash, image, image_size, embedding, embedding_model
                    FROM approval_requests 
                    WHERE emp_no = %s 
-                   AND approval_status = 'Approved'""",
+                   AND approval_status = 'Approved'
+                   ORDER BY approval_date DESC
+                   LIMIT 1""",
                 (emp_no,)
             )
-            image_data = cursor.fetchone()
-            
-            if image_data:
-                # Save image locally
-                image_path = f"stored_image_{emp_no}.jpg"
-                with open(image_path, "wb") as fh:
-                    fh.write(image_data[0])
-                
-                # Update face_image table
-                cursor.execute(
+            row = await cursor.fetchone()
+            image_hash, blob, image_size, embedding, embedding_model = row or (None,) * 5
+            # Stored files need not be read at all; only legacy BLOB rows are
+            image_data = blob if row and not image_hash else None
+
+            if image_hash or image_data:
+                # face_image points at the same stored file; nothing is copied
+                image_hash = image_hash or await asyncio.to_thread(image_store.put, image_data)
+                image_size = image_size or len(image_data or image_store.read(image_hash))
+
+                # Update face_image table; MySQL DATETIME drops microseconds, so the
+                # embedding version below must use the same truncated value
+                last_update = datetime.now().replace(microsecond=0)
+                await cursor.execute(
                     """UPDATE face_image 
-                       SET image = %s, last_update = %s 
+                       SET image_hash = %s, image_size = %s, image = NULL, last_update = %s 
                        WHERE emp_no = %s""",
-                    (image_data[0], datetime.now(), emp_no)
+                    (image_hash, image_size, last_update, emp_no)
                 )
-                db.commit()
+
+                # Promote the embedding computed at submission; requests from
+                # before it was stored (or from another model) are embedded now
+                vector = None
+                if embedding and embedding_model == embeddings.MODEL_NAME:
+                    vector = embeddings.from_blob(embedding)
+                else:
+                    try:
+                        image = image_data or image_store.read(image_hash)
+                        vector = (await recognition_server.probe(None, image))[0]
+                    except ValueError as e:
+                        logging.warning(f"Could not embed approved image for {emp_no}: {str(e)}")
+                if vector is not None:
+                    await embeddings.save_embedding(cursor, emp_no, vector, last_update)
+                await db.commit()
+                if vector is not None:
+                    face_index.index.upsert(emp_no, vector)
                 print(f"Stored new face image for employee {emp_no}")
 
         return {"message": f"Request for employee {emp_no} has been marked as {currstatus}."}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in update_approval_status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.get("/get_ip_address_data/")
-async def get_ip_address_data(emp_no: str = Depends(get_current_user)):
+async def get_ip_address_data(emp_no: str = Depends(get_current_user), db = Depends(get_db)):
     try:
-        db = dbconnect()
-        cursor = db.cursor(cursor=DictCursor)
+        cursor = await db.cursor(DictCursor)
         # Join with users table to get names
-        cursor.execute("""
+        await cursor.execute("""
             SELECT 
                 v.ip,
                 v.date_added,
@@ -358,7 +545,7 @@ async def get_ip_address_data(emp_no: str = Depends(get_current_user)):
             WHERE v.emp_no = %s
             ORDER BY v.date_added DESC
         """, (emp_no,))
-        results = cursor.fetchall()
+        results = await cursor.fetchall()
         return [
             {
                 "employee_name": row["employee_name"],
@@ -372,38 +559,40 @@ async def get_ip_address_data(emp_no: str = Depends(get_current_user)):
         logging.error(f"Error fetching IP address data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.post("/add_ip_address/")
 async def add_ip_address(
     ip: str = Form(...),
-    emp_no: str = Depends(get_current_user)
+    emp_no: str = Depends(get_current_user),
+    db = Depends(get_db)
 ):
+    cursor = await db.cursor()
     try:
-        if not re.match(r'^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$', ip):
+        # A single IPv4/IPv6 address or a CIDR range such as an office DHCP subnet
+        try:
+            ip = ip_allowlist.normalize(ip)
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid IP address format")
 
-        db = dbconnect()
-        cursor = db.cursor()
-
         # Insert into valid_ip table with the correct column names
-        cursor.execute(
+        await cursor.execute(
             """INSERT INTO valid_ip (ip, emp_no, added_by, date_added)
                VALUES (%s, %s, %s, %s)""",
             (ip, emp_no, emp_no, datetime.now())  # using emp_no as added_by
         )
-        db.commit()
+        await db.commit()
+        ip_allowlist.invalidate()
 
         # Fetch the inserted record
-        cursor.execute(
+        await cursor.execute(
             """SELECT valid_id, emp_no, ip, added_by, date_added
                FROM valid_ip
                WHERE emp_no = %s AND ip = %s
                ORDER BY date_added DESC LIMIT 1""",
             (emp_no, ip)
         )
-        result = cursor.fetchone()
+        result = await cursor.fetchone()
 
         return {
             "message": "IP address added successfully",
@@ -415,39 +604,69 @@ async def add_ip_address(
                 "date_added": result[4].isoformat()
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error adding IP address: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error adding IP address: {str(e)}")
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.delete("/delete_ip_address/")
 async def delete_ip_address(
     ip: str,  # This expects a query parameter
-    emp_no: str = Depends(get_current_user)
+    emp_no: str = Depends(get_current_user),
+    db = Depends(get_db)
 ):
+    cursor = await db.cursor()
     try:
-        db = dbconnect()
-        cursor = db.cursor()
+        try:
+            canonical = ip_allowlist.normalize(ip)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid IP address format")
 
-        cursor.execute(
+        # Rows not yet rewritten by `schema.py migrate` still hold the form they were added in
+        await cursor.execute(
             """DELETE FROM valid_ip 
-               WHERE ip = %s AND emp_no = %s""",
-            (ip, emp_no)
+               WHERE ip IN (%s, %s) AND emp_no = %s""",
+            (canonical, ip.strip(), emp_no)
         )
-        db.commit()
+        await db.commit()
 
         if cursor.rowcount > 0:
+            ip_allowlist.invalidate()
             return {"message": "IP address deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="IP address not found")
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error deleting IP address: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting IP address: {str(e)}")
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
+
+@app.get("/inference_stats/")
+async def inference_stats():
+    return inference.stats()
+
+@app.get("/db_pool_stats/")
+async def db_pool_stats():
+    return db_pool.pool.stats()
+
+@app.get("/log_writer_stats/")
+async def log_writer_stats():
+    return dict(log_writer.writer.stats(), enabled=log_writer.ENABLED)
+
+# Prometheus text format: per-stage latency histograms, result counters and
+# pool/executor gauges of this worker
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/capture_archive_stats/")
+async def capture_archive_stats():
+    return capture_archive.archiver.stats()
 
 @app.get("/")
 def index():
@@ -456,29 +675,55 @@ def index():
 #ALLOWED_IP = "127.0.0.1"
 
 @app.post("/login/")
-async def login(data: LoginRequest, request: Request):
+async def login(data: LoginRequest, request: Request, db = Depends(get_db)):
     email = data.email
     password = data.password
 
-    db = dbconnect()
-    cursor = db.cursor()
+    cursor = await db.cursor()
     
     try:
-        cursor.execute("SELECT password, emp_no FROM users WHERE email = %s", (email,))
-        result = cursor.fetchone()
+        await cursor.execute("SELECT password, emp_no FROM users WHERE email = %s", (email,))
+        result = await cursor.fetchone()
 
-        if result and bcrypt.checkpw(password.encode(), result[0].encode()):
+        # bcrypt is deliberately slow; keep it off the event loop
+        if result and await asyncio.to_thread(bcrypt.checkpw, password.encode(), result[0].encode()):
             token = create_token(result[1])
-            cursor.execute("SELECT role_id FROM system_access WHERE emp_no = %s", (result[1],))
-            role = cursor.fetchone()
+            await cursor.execute("SELECT role_id FROM system_access WHERE emp_no = %s", (result[1],))
+            role = await cursor.fetchone()
             return {"message": "Login successful", "token": token, "emp": result[1], "role": role[0]}
         else:
             raise HTTPException(status_code=401, detail="Invalid credentials")
     finally:
-        cursor.close()
-        db.close()
-
-
+        await cursor.close()
+
+
+
+# Record a verified clock-in/out and fold it into daily_attendance; the caller
+# commits. With LOG_WRITE_BEHIND=1 the row is journaled and inserted by the
+# background flush instead. Returns the LOG_IMG_PATH of the capture.
+async def insert_time_log(cursor, emp_no: str, log: str) -> str:
+    now = datetime.now().replace(microsecond=0)
+    formatted_date = now.strftime('%Y-%m-%d_%Hh%Mm%Ss')
+    date, time_str = now.strftime('%Y-%m-%d'), now.strftime('%H:%M:%S %p')
+    filename = os.path.join(emp_no, f"{formatted_date}.jpg")
+    row = (emp_no, date, time_str, log, filename)
+    if log_writer.ENABLED:
+        await log_writer.writer.submit(row)
+        return filename
+    await cursor.execute(timelogs.INSERT, row)
+    await attendance.record(cursor, emp_no, now.date(), now.time(), log)
+    return filename
+
+# Logs of emp_no still waiting in a write-behind journal, newest first, shaped
+# like get_log_data rows
+def journaled_logs(emp_no: str) -> list:
+    if not log_writer.ENABLED:
+        return []
+    rows = [
+        {"LOG_DATE": log_date, "LOG_TIME": log_time, "LOG_MODE": log_mode}
+        for _, log_date, log_time, log_mode, _ in log_writer.writer.pending_for(emp_no)
+    ]
+    return sorted(rows, key=lambda row: (row["LOG_DATE"], row["LOG_TIME"]), reverse=True)
 
 @app.post("/recognize_face/")
 async def recognize_face(
@@ -487,90 +732,157 @@ async def recognize_face(
     log: str = Form(...),
     request: Request = None
 ):
-    db = dbconnect()
-    cursor = db.cursor()
+    result = "error"
+    started = time.perf_counter()
+    claimed, outcome = None, None
 
     try:
-        # ✅ Validate IP address
+        # ✅ Validate IP address against the cached allowlist (exact IPs and CIDR ranges)
         client_ip = request.client.host
-        cursor.execute("SELECT COUNT(*) FROM valid_ip WHERE ip = %s", (client_ip,))
-        if cursor.fetchone()[0] == 0:
+        with metrics.stage("recognize_face", "ip_check"):
+            async with db_cursor() as (db, cursor):
+                allowed = await ip_allowlist.is_allowed(cursor, client_ip)
+        if not allowed:
+            result = "denied"
             raise HTTPException(status_code=403, detail="Access denied from this IP address")
 
-        # ✅ Save uploaded image to temp file
-        file_location = f"temp_{emp_no}.jpg"
-        with open(file_location, "wb") as buffer:
-            buffer.write(await file.read())
-
-        # ✅ Get stored face image from DB
-        cursor.execute("SELECT image FROM face_image WHERE emp_no = %s", (emp_no,))
-        stored_image = cursor.fetchone()
-
-        if not stored_image or not stored_image[0]:
-            os.remove(file_location)
+        # ✅ Read the upload once, rejecting oversized or corrupt images before any
+        # decoding; it is decoded in memory, never written to disk
+        with metrics.stage("recognize_face", "read"):
+            image_data = await preprocess.read_upload(file)
+
+        # ✅ A retry of a clock-in that was already decided gets the same answer,
+        # without running the model or logging it twice
+        cache_key = idempotency.key(emp_no, log, image_data, request.headers.get("idempotency-key"))
+        cached = await idempotency.cache.claim(cache_key)
+        if cached is not None:
+            result = "replayed"
+            return idempotency.replay(cached)
+        claimed = cache_key
+
+        # ✅ Get the precomputed embedding of the stored face
+        with metrics.stage("recognize_face", "embedding_lookup"):
+            async with db_cursor() as (db, cursor):
+                stored_embedding = await embeddings.get_embedding(cursor, emp_no)
+                await db.commit()
+
+        if stored_embedding is None:
             logging.error(f"No stored image for emp_no {emp_no}")
+            result = "not_enrolled"
             raise HTTPException(status_code=404, detail="No stored image found for this employee")
 
-        #  Save stored image to temp file
-        stored_image_path = f"stored_{emp_no}.jpg"
-        with open(stored_image_path, "wb") as f:
-            f.write(stored_image[0])
-
-        #  Run DeepFace face verification
-        result = DeepFace.verify(
-            img1_path=file_location,
-            img2_path=stored_image_path,
-            model_name="Facenet",    #"VGG-Face", "ArcFace"
-            enforce_detection=True,
-            detector_backend="opencv",  
-            distance_metric="cosine",
-            threshold=0.6  
-        )
+        #  Embed only the probe (micro-batched with concurrent clock-ins, here or
+        #  on the shared recognition server) and compare it to the stored vector
+        try:
+            probe_embeddings = await recognition_server.probe("recognize_face", image_data)
+        except ValueError:
+            result = "no_face"
+            raise
+
+        distance = min(embeddings.cosine_distance(probe, stored_embedding) for probe in probe_embeddings)
+
+        if distance <= embeddings.THRESHOLD:
+            logging.info(f"✅ DeepFace matched for {emp_no}, distance: {distance:.4f}")
+
+            #  Log successful match; the capture is archived in the background
+            with metrics.stage("recognize_face", "insert_log"):
+                async with db_cursor() as (db, cursor):
+                    filename = await insert_time_log(cursor, emp_no, log)
+                    await db.commit()
+            capture_archive.archiver.submit(filename, image_data)
+
+            result = "verified"
+            response = {"message": "Face recognized successfully", "data": emp_no}
+            outcome = idempotency.success(response)
+            return response
+        else:
+            logging.warning(f"⚠️ Face not recognized for {emp_no}")
+            result = "rejected"
+            outcome = idempotency.failure(401, "Face not recognized")
+            raise HTTPException(status_code=401, detail="Face not recognized")
 
-        #  Clean up temp files
-        os.remove(file_location)
-        os.remove(stored_image_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Recognition error: {str(e)}")
+    finally:
+        if claimed:
+            await idempotency.cache.release(claimed, outcome)
+        metrics.observe("recognize_face", "total", time.perf_counter() - started)
+        metrics.count("recognize_face", result)
+
+# Tokenless 1:N identification for shared lobby kiosks: the probe is embedded
+# once and searched against every enrolled face held in memory
+@app.post("/identify_face/")
+async def identify_face(
+    file: UploadFile = File(...),
+    log: str = Form(...),
+    request: Request = None
+):
+    claimed, outcome = None, None
 
-        if result["verified"]:
-            similarity = result["distance"]
-            logging.info(f"✅ DeepFace matched for {emp_no}, distance: {similarity:.4f}")
+    try:
+        # ✅ Kiosks must still be on an allowed IP address
+        client_ip = request.client.host
+        async with db_cursor() as (db, cursor):
+            allowed = await ip_allowlist.is_allowed(cursor, client_ip)
+        if not allowed:
+            raise HTTPException(status_code=403, detail="Access denied from this IP address")
 
-            now = datetime.now()
-            formatted_date = now.strftime('%Y-%m-%d_%Hh%Mm%Ss')
-            date, time_str = now.strftime('%Y-%m-%d'), now.strftime('%H:%M:%S %p')
-            filename = os.path.join(emp_no, f"{formatted_date}.jpg")
+        image_data = await preprocess.read_upload(file)
+        cache_key = idempotency.key(f"kiosk:{client_ip}", log, image_data, request.headers.get("idempotency-key"))
+        cached = await idempotency.cache.claim(cache_key)
+        if cached is not None:
+            return idempotency.replay(cached)
+        claimed = cache_key
+
+        probe_embeddings = await recognition_server.probe(None, image_data)
+        if len(probe_embeddings) > 1:
+            raise HTTPException(status_code=400, detail="Multiple faces detected")
+        probe = probe_embeddings[0]
+
+        matches = face_index.index.search(probe, k=1)
+        if not matches or matches[0][1] > KIOSK_THRESHOLD:
+            logging.warning("⚠️ Kiosk face not recognized")
+            outcome = idempotency.failure(401, "Face not recognized")
+            raise HTTPException(status_code=401, detail="Face not recognized")
 
-            #  Log successful match
-            cursor.execute(
-                "INSERT INTO tbl_extracted_logs (EMP_NO, LOG_DATE, LOG_TIME, LOG_MODE, LOG_IMG_PATH) VALUES (%s, %s, %s, %s, %s)",
-                (emp_no, date, time_str, log, filename)
-            )
-            db.commit()
+        emp_no, distance = matches[0]
+        logging.info(f"✅ Kiosk identified {emp_no}, distance: {distance:.4f}")
+        async with db_cursor() as (db, cursor):
+            filename = await insert_time_log(cursor, emp_no, log)
+            await db.commit()
+        capture_archive.archiver.submit(filename, image_data)
 
-            return {"message": "Face recognized successfully", "data": emp_no}
-        else:
-            logging.warning(f"⚠️ Face not recognized for {emp_no}")
-            raise HTTPException(status_code=401, detail="Face not recognized")
+        response = {"message": "Face identified successfully", "data": emp_no, "distance": round(distance, 4)}
+        outcome = idempotency.success(response)
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Recognition error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Identification error: {str(e)}")
     finally:
-        cursor.close()
-        db.close()
+        if claimed:
+            await idempotency.cache.release(claimed, outcome)
 
 @app.get("/fetch_last_log/")
-async def fetch_last_log(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor()
+async def fetch_last_log(emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
     try:
-        cursor.execute('''
+        await cursor.execute('''
             SELECT LOG_MODE FROM tbl_extracted_logs 
             WHERE emp_no = %s 
             ORDER BY log_date DESC, log_time DESC 
             LIMIT 1
         ''', (emp_no,))
-        log_type = cursor.fetchone()
+        log_type = await cursor.fetchone()
+        # A clock-in not flushed to MySQL yet is still the latest one
+        journaled = journaled_logs(emp_no)
+        if journaled:
+            log_type = (journaled[0]["LOG_MODE"],)
         now = datetime.now()
         time = now.strftime('%H:%M:%S %p')
         if log_type:
@@ -579,25 +891,33 @@ async def fetch_last_log(emp_no: str = Depends(get_current_user)):
         else:
             return {"log_type": None, "time": time}
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.get("/get_log_data/")
-async def get_log_data(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor(cursor=DictCursor)
+async def get_log_data(emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor(DictCursor)
     try:
         #debug log
         print(f"Fetching logs for employee: {emp_no}")
         
-        cursor.execute(
+        await cursor.execute(
             """SELECT LOG_DATE, LOG_TIME, LOG_MODE 
                FROM tbl_extracted_logs 
                WHERE emp_no = %s
                ORDER BY LOG_DATE DESC, LOG_TIME DESC""", 
             (emp_no,)
         )
-        res = cursor.fetchall()
+        res = list(await cursor.fetchall())
+
+        # Own clock-ins still in the write-behind journal; a row flushed while
+        # this query ran is already in res
+        journaled = journaled_logs(emp_no)
+        if journaled:
+            stored = {(str(row["LOG_DATE"]), str(row["LOG_TIME"]), row["LOG_MODE"]) for row in res}
+            res = [
+                row for row in journaled
+                if (row["LOG_DATE"], row["LOG_TIME"], row["LOG_MODE"]) not in stored
+            ] + res
         
         #debug log
         print(f"Found {len(res) if res else 0} logs")
@@ -608,16 +928,14 @@ async def get_log_data(emp_no: str = Depends(get_current_user)):
         else:
             return {"res": []}
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.get("/fetch_user_details/")
-async def fetch_user_details(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor(cursor=DictCursor)
+async def fetch_user_details(emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor(DictCursor)
     try:
-        cursor.execute("SELECT emp_no, division_desc, first_name, middle_name, last_name, ext_name, position_desc FROM users WHERE emp_no = %s", (emp_no,))
-        user_data = cursor.fetchone()
+        await cursor.execute("SELECT emp_no, division_desc, first_name, middle_name, last_name, ext_name, position_desc FROM users WHERE emp_no = %s", (emp_no,))
+        user_data = await cursor.fetchone()
 
         if user_data:
             name_parts = [
@@ -639,36 +957,43 @@ async def fetch_user_details(emp_no: str = Depends(get_current_user)):
         else:
             raise HTTPException(status_code=404, detail="User not found")
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
+# The stored face only changes on approval, so repeat views are answered with
+# 304 from image_hash/last_update alone
 @app.get("/get_stored_image/")
-async def get_stored_image(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor()
+async def get_stored_image(request: Request, emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
     try:
-        cursor.execute("SELECT image FROM face_image WHERE emp_no = %s", (emp_no,))
-        image_data = cursor.fetchone()
-
-        if image_data and image_data[0]:
-            image_path = f"stored_image_{emp_no}.jpg"
-            with open(image_path, "wb") as fh:
-                fh.write(image_data[0])
-            return FileResponse(image_path, media_type="image/jpeg", filename=image_path)
-        else:
+        await cursor.execute(
+            "SELECT image_hash, last_update, image IS NOT NULL FROM face_image WHERE emp_no = %s",
+            (emp_no,)
+        )
+        row = await cursor.fetchone()
+        if not row or not (row[0] or row[2]):
             raise HTTPException(status_code=404, detail=f"No existing image for employee {emp_no}")
+
+        image_hash, last_update, _ = row
+        headers = image_store.cache_headers(image_hash, f"face_image:{emp_no}:{last_update}", last_update)
+        cached = image_store.not_modified(request, headers)
+        if cached:
+            return cached
+
+        blob = None
+        if not image_hash:
+            await cursor.execute("SELECT image FROM face_image WHERE emp_no = %s", (emp_no,))
+            blob = (await cursor.fetchone())[0]
+        return image_store.response(image_hash, blob, headers=headers)
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.get("/get_validation_history/")
-async def get_validation_history():
+async def get_validation_history(request: Request, db = Depends(get_db)):
     try:
-        db = dbconnect()
-        cursor = db.cursor()
+        cursor = await db.cursor()
         
         #only the latest request per employee
-        cursor.execute("""
+        await cursor.execute("""
             WITH LatestRequests AS (
                 SELECT 
                     emp_no,
@@ -680,7 +1005,6 @@ async def get_validation_history():
             SELECT 
                 ar.request_id,
                 ar.emp_no,
-                ar.image,
                 ar.date_requested,
                 ar.approval_status,
                 ar.approval_date,
@@ -696,21 +1020,21 @@ async def get_validation_history():
             ORDER BY ar.approval_date DESC
         """)
         
-        results = cursor.fetchall()
+        results = await cursor.fetchall()
         formatted_results = []
         
         for row in results:
             result_dict = {
                 'request_id': row[0],
                 'emp_no': row[1],
-                'image': base64.b64encode(row[2]).decode('utf-8') if row[2] else None,
-                'date_requested': row[3].isoformat() if row[3] else None,
-                'approval_status': row[4],
-                'approval_date': row[5].isoformat() if row[5] else None,
-                'first_name': row[6],
-                'middle_name': row[7],
-                'last_name': row[8]
+                'date_requested': row[2].isoformat() if row[2] else None,
+                'approval_status': row[3],
+                'approval_date': row[4].isoformat() if row[4] else None,
+                'first_name': row[5],
+                'middle_name': row[6],
+                'last_name': row[7]
             }
+            result_dict.update(approval_image_urls(request, row[0]))
             formatted_results.append(result_dict)
             
         return formatted_results
@@ -719,98 +1043,195 @@ async def get_validation_history():
         print(f"Error fetching history data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
+
+# Full image of one approval request, loaded only when an admin opens it
+@app.get("/approval_requests/{request_id}/image")
+async def get_approval_image(request_id: int, current_user: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
+    try:
+        await cursor.execute("SELECT image_hash, image FROM approval_requests WHERE request_id = %s", (request_id,))
+        row = await cursor.fetchone()
+        if not row or not (row[0] or row[1]):
+            raise HTTPException(status_code=404, detail="Approval request image not found")
+        return image_store.response(*row, headers={"Cache-Control": "private, max-age=86400"})
+    finally:
+        await cursor.close()
+
+# Thumbnail for the approval queue; rows submitted before thumbnails existed
+# get theirs generated on first view and added to the image store
+@app.get("/approval_requests/{request_id}/thumbnail")
+async def get_approval_thumbnail(request_id: int, current_user: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
+    try:
+        await cursor.execute("SELECT thumbnail_hash FROM approval_requests WHERE request_id = %s", (request_id,))
+        row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Approval request not found")
+        thumbnail_hash = row[0]
+
+        if not thumbnail_hash:
+            await cursor.execute("SELECT image_hash, image FROM approval_requests WHERE request_id = %s", (request_id,))
+            image = image_store.read(*await cursor.fetchone())
+            if not image:
+                raise HTTPException(status_code=404, detail="Approval request image not found")
+            # A backfill, not a clock-in: keep it off the inference admission slots
+            thumbnail = await asyncio.to_thread(thumbnails.make_thumbnail, image)
+            thumbnail_hash = await asyncio.to_thread(image_store.put, thumbnail)
+            await cursor.execute(
+                "UPDATE approval_requests SET thumbnail_hash = %s WHERE request_id = %s",
+                (thumbnail_hash, request_id)
+            )
+            await db.commit()
+
+        return image_store.response(thumbnail_hash, headers={"Cache-Control": "private, max-age=86400"})
+    finally:
+        await cursor.close()
+
+# Validators for the latest approved request of emp_no, read without the image
+async def latest_approved(cursor, emp_no: str):
+    await cursor.execute("""
+        SELECT request_id, image_hash, approval_date, image IS NOT NULL 
+        FROM approval_requests 
+        WHERE emp_no = %s 
+        AND approval_status = 'Approved'
+        ORDER BY approval_date DESC 
+        LIMIT 1
+    """, (emp_no,))
+    row = await cursor.fetchone()
+    if not row or not (row[1] or row[3]):
+        return None, None
+    request_id, image_hash, approval_date, _ = row
+    return row, image_store.cache_headers(image_hash, f"approval_requests:{request_id}", approval_date)
+
+async def approved_image_blob(cursor, row):
+    if row[1]:
+        return None
+    await cursor.execute("SELECT image FROM approval_requests WHERE request_id = %s", (row[0],))
+    return (await cursor.fetchone())[0]
 
 @app.get("/get_approved_image/")
-async def get_approved_image(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor()
+async def get_approved_image(request: Request, emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
     try:
         # Get the latest approved image from approval_requests
-        cursor.execute("""
-            SELECT image 
-            FROM approval_requests 
-            WHERE emp_no = %s 
-            AND approval_status = 'Approved'
-            ORDER BY approval_date DESC 
-            LIMIT 1
-        """, (emp_no,))
-        image_data = cursor.fetchone()
-
-        if image_data and image_data[0]:
-            image_path = f"stored_image_{emp_no}.jpg"
-            with open(image_path, "wb") as fh:
-                fh.write(image_data[0])
-            return FileResponse(
-                image_path, 
-                media_type="image/jpeg", 
-                filename=image_path
-            )
-        else:
+        row, headers = await latest_approved(cursor, emp_no)
+        if not row:
             raise HTTPException(
                 status_code=404, 
                 detail=f"No approved image found for employee {emp_no}"
             )
+
+        cached = image_store.not_modified(request, headers)
+        if cached:
+            return cached
+        return image_store.response(row[1], await approved_image_blob(cursor, row), headers=headers)
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 @app.get("/get_latest_approved_request/")
-async def get_latest_approved_request(emp_no: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor(cursor=DictCursor)
+async def get_latest_approved_request(request: Request, emp_no: str = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.cursor()
     try:
         # Get the latest approved image
-        cursor.execute("""
-            SELECT image 
-            FROM approval_requests 
-            WHERE emp_no = %s 
-            AND approval_status = 'Approved'
-            ORDER BY approval_date DESC 
-            LIMIT 1
-        """, (emp_no,))
-        
-        result = cursor.fetchone()
-        if result and result['image']:
-            return {
-                "image": base64.b64encode(result['image']).decode('utf-8')
-            }
-        else:
+        row, headers = await latest_approved(cursor, emp_no)
+        if not row:
             raise HTTPException(
                 status_code=404,
                 detail="No approved image found"
             )
+
+        cached = image_store.not_modified(request, headers)
+        if cached:
+            return cached
+        image = image_store.read(row[1], await approved_image_blob(cursor, row))
+        return JSONResponse(
+            content={"image": base64.b64encode(image).decode('utf-8')},
+            headers=headers
+        )
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
+# Newest-first timelogs, one keyset page at a time (pass next_cursor back as
+# `cursor`), or the whole filtered set streamed as NDJSON/CSV with format=
 @app.get("/get_all_timelogs/")
-async def get_all_timelogs(current_user: str = Depends(get_current_user)):
-    db = dbconnect()
-    cursor = db.cursor(cursor=DictCursor)
+async def get_all_timelogs(
+    current_user: str = Depends(get_current_user),
+    cursor: Optional[str] = None,
+    limit: int = timelogs.PAGE_SIZE,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    division: Optional[str] = None,
+    emp_no: Optional[str] = None,
+    employee: Optional[str] = None,
+    format: str = "json"
+):
+    filters = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "division": division,
+        "emp_no": emp_no,
+        "employee": employee,
+        "after": cursor,
+    }
+    if format not in ("json", "ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be json, ndjson or csv")
+    if cursor:
+        try:
+            timelogs.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if format != "json":
+        # The query runs here, so its errors still get a proper status code; the
+        # stream then holds its connection until the last chunk is sent
+        try:
+            chunks = await timelogs.start_stream(dbconnect, format, **filters)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logging.error(f"Error exporting timelogs: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            chunks,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=timelogs.{format}"}
+        )
+
+    db = await dbconnect()
+    db_cursor = await db.cursor(DictCursor)
     try:
-        # Join with users table to get employee names
-        cursor.execute("""
-            SELECT 
-                t.LOG_DATE,
-                t.LOG_TIME,
-                t.LOG_MODE,
-                t.emp_no,
-                CONCAT(u.first_name, ' ', u.middle_name, ' ', u.last_name) as employee_name
-            FROM tbl_extracted_logs t
-            JOIN users u ON t.emp_no = u.emp_no
-            ORDER BY t.LOG_DATE DESC, t.LOG_TIME DESC
-        """)
-        
-        results = cursor.fetchall()
-        return results
+        return await timelogs.fetch_page(db_cursor, limit, **filters)
     except Exception as e:
         logging.error(f"Error fetching all timelogs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cursor.close()
-        db.close()
+        await db_cursor.close()
+        await db.close()
+
+# Daily time records of a whole division for one month (month=YYYY-MM), read
+# from the daily_attendance summary instead of the raw logs
+@app.get("/attendance_report/")
+async def attendance_report(
+    division: str,
+    month: str,
+    current_user: str = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    try:
+        start = attendance.parse_month(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+
+    cursor = await db.cursor(DictCursor)
+    try:
+        return await attendance.month_report(cursor, division, start)
+    except Exception as e:
+        logging.error(f"Error building attendance report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await cursor.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,87 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics for the recognition hot path, rendered in the Prometheus
+# text format by /metrics. Each uvicorn worker keeps its own numbers, so
+# scrape the workers individually (or sum across scrapes).
+NAMESPACE = "stamp"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# (endpoint, stage) -> [count per bucket..., +Inf count, sum]
+_stages = {}
+# (endpoint, result) -> count
+_results = {}
+# name -> (help, fn returning {key: number}); sampled at scrape time
+_gauges = {}
+
+
+def observe(endpoint: str, stage: str, seconds: float):
+    with _lock:
+        histogram = _stages.get((endpoint, stage))
+        if histogram is None:
+            histogram = _stages[(endpoint, stage)] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[len(BUCKETS)] += 1
+        histogram[-1] += seconds
+
+
+# Time a block as one stage of an endpoint; safe from event-loop code and from
+# inference threads alike
+@contextmanager
+def stage(endpoint: str, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(endpoint, name, time.perf_counter() - started)
+
+
+def count(endpoint: str, result: str):
+    with _lock:
+        _results[(endpoint, result)] = _results.get((endpoint, result), 0) + 1
+
+
+# Export every numeric value of fn() as the gauge <namespace>_<name>_<key>
+def register_gauges(name: str, help_text: str, fn):
+    _gauges[name] = (help_text, fn)
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render() -> str:
+    with _lock:
+        stages = {key: list(value) for key, value in _stages.items()}
+        results = dict(_results)
+
+    lines = [
+        f"# HELP {NAMESPACE}_stage_seconds Time spent per endpoint stage",
+        f"# TYPE {NAMESPACE}_stage_seconds histogram",
+    ]
+    for (endpoint, name), histogram in sorted(stages.items()):
+        labels = _labels(endpoint=endpoint, stage=name)
+        for bound, value in zip(BUCKETS, histogram):
+            lines.append(f'{NAMESPACE}_stage_seconds_bucket{{{labels},le="{bound}"}} {value}')
+        lines.append(f'{NAMESPACE}_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram[len(BUCKETS)]}')
+        lines.append(f"{NAMESPACE}_stage_seconds_sum{{{labels}}} {histogram[-1]}")
+        lines.append(f"{NAMESPACE}_stage_seconds_count{{{labels}}} {histogram[len(BUCKETS)]}")
+
+    lines.append(f"# HELP {NAMESPACE}_results_total Outcomes per endpoint")
+    lines.append(f"# TYPE {NAMESPACE}_results_total counter")
+    for (endpoint, result), value in sorted(results.items()):
+        lines.append(f"{NAMESPACE}_results_total{{{_labels(endpoint=endpoint, result=result)}}} {value}")
+
+    for name, (help_text, fn) in _gauges.items():
+        for key, value in fn().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = f"{NAMESPACE}_{name}_{key}"
+            lines.append(f"# HELP {metric} {help_text}: {key}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
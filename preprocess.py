@@ -0,0 +1,160 @@
+import os
+import struct
+
+import cv2
+import numpy as np
+from fastapi import HTTPException, status
+
+# Uploads are checked from their headers before any decoding, then decoded no
+# larger than DECODE_MAX_DIMENSION on the longer side. Large JPEGs use libjpeg's
+# DCT scaling (IMREAD_REDUCED_COLOR_2/4/8), so a 12 MP phone photo is never
+# materialised at full size. The EXIF orientation is applied here, consistently,
+# instead of depending on the OpenCV build.
+MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(64_000_000)))
+MAX_DIMENSION = int(os.getenv("DECODE_MAX_DIMENSION", "1280"))
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Start-of-frame markers carry the dimensions; C4, C8 and CC are not frames
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+# (format, width, height, EXIF orientation) from the header alone. Raises
+# ValueError for anything that is not a complete JPEG, PNG, WebP or BMP.
+def probe(data: bytes) -> tuple:
+    if data[:3] == b"\xff\xd8\xff":
+        return _probe_jpeg(data)
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height, 1
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp", *_probe_webp(data), 1
+    if data[:2] == b"BM" and len(data) >= 26:
+        width, height = struct.unpack("<ii", data[18:26])
+        return "bmp", abs(width), abs(height), 1
+    raise ValueError("Unsupported image format")
+
+
+def _probe_jpeg(data: bytes) -> tuple:
+    # Anything after the last EOI (some cameras append data) is ignored, but a
+    # file without one was cut off in transit
+    if data.rfind(b"\xff\xd9") < 0:
+        raise ValueError("Truncated JPEG")
+    orientation = 1
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError("Corrupt JPEG header")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        segment = data[offset + 4:offset + 2 + length]
+        if marker == 0xE1 and segment[:6] == b"Exif\x00\x00":
+            orientation = _exif_orientation(segment[6:])
+        elif marker in SOF_MARKERS:
+            if len(segment) < 5:
+                raise ValueError("Corrupt JPEG header")
+            height, width = struct.unpack(">HH", segment[1:5])
+            return "jpeg", width, height, orientation
+        elif marker == 0xDA:
+            break
+        offset += 2 + length
+    raise ValueError("Corrupt JPEG header")
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    try:
+        endian = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+        count = struct.unpack(endian + "H", tiff[ifd:ifd + 2])[0]
+        for i in range(count):
+            entry = ifd + 2 + i * 12
+            tag = struct.unpack(endian + "H", tiff[entry:entry + 2])[0]
+            if tag == 0x0112:
+                value = struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _probe_webp(data: bytes) -> tuple:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    raise ValueError("Corrupt WebP header")
+
+
+# Check an upload's size, format and dimensions without decoding it
+def validate(data: bytes) -> tuple:
+    if not data:
+        raise ValueError("Empty image")
+    info = probe(data)
+    _, width, height, _ = info
+    if width <= 0 or height <= 0:
+        raise ValueError("Corrupt image header")
+    return info
+
+
+def _orient(img, orientation: int):
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+# Upright BGR array whose longer side is at most max_dimension (0 = full size)
+def decode(data: bytes, max_dimension: int = MAX_DIMENSION):
+    fmt, width, height, orientation = validate(data)
+    flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+    if fmt == "jpeg" and max_dimension:
+        # The largest DCT reduction that still leaves at least max_dimension
+        for factor, reduced in REDUCED_FLAGS:
+            if max(width, height) // factor >= max_dimension:
+                flags = reduced | cv2.IMREAD_IGNORE_ORIENTATION
+                break
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        raise ValueError("Could not decode image data")
+    height, width = img.shape[:2]
+    if max_dimension and max(height, width) > max_dimension:
+        scale = max_dimension / max(height, width)
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA)
+    return _orient(img, orientation)
+
+
+# Read an UploadFile, turning away oversized, unsupported or corrupt images
+# before they reach the inference pool
+async def read_upload(file) -> bytes:
+    data = await file.read(MAX_BYTES + 1)
+    if len(data) > MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Image is larger than {MAX_BYTES // (1024 * 1024)} MB")
+    try:
+        _, width, height, _ = validate(data)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid image: {str(e)}")
+    if width * height > MAX_PIXELS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Image is larger than {MAX_PIXELS // 1_000_000} megapixels")
+    return data
@@ -0,0 +1,38 @@
+import logging
+import os
+import time
+
+# Opt-in sampling profiler for single slow requests. With PROFILER_ENABLED=1 a
+# request carrying "X-Profile: 1" runs under pyinstrument and its HTML report is
+# written to PROFILER_DIR; the file name comes back in X-Profile-Report.
+# pyinstrument is optional and only needed when profiling is enabled.
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+DIRECTORY = os.getenv("PROFILER_DIR", "profiles")
+INTERVAL = float(os.getenv("PROFILER_INTERVAL_MS", "1")) / 1000
+
+if ENABLED and Profiler is None:
+    logging.warning("PROFILER_ENABLED is set but pyinstrument is not installed; profiling is off")
+
+
+def requested(request) -> bool:
+    return ENABLED and Profiler is not None and request.headers.get("x-profile") == "1"
+
+
+async def profile(request, call_next):
+    profiler = Profiler(interval=INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    os.makedirs(DIRECTORY, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.url.path.strip('/').replace('/', '_') or 'root'}.html"
+    with open(os.path.join(DIRECTORY, name), "w") as fh:
+        fh.write(profiler.output_html())
+    response.headers["X-Profile-Report"] = name
+    return response
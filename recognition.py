@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+# DeepFace pulls in TensorFlow, which costs each worker seconds of start-up and
+# hundreds of MB. It is imported on first use instead of at module import, so
+# a worker boots in well under a second and serves logins and dashboards
+# without it.
+#   RECOGNITION_WARM_UP=background  load the model right after start-up, off
+#                                   the event loop (default)
+#   RECOGNITION_WARM_UP=startup     load it before the worker accepts requests
+#   RECOGNITION_WARM_UP=off         load it on the first recognition request
+WARM_UP = os.getenv("RECOGNITION_WARM_UP", "background")
+
+_lock = threading.Lock()
+_modules = None
+_stats = {"loaded": 0, "import_seconds": 0.0, "warm": 0, "warm_up_seconds": 0.0}
+
+
+def _load():
+    global _modules
+    with _lock:
+        if _modules is None:
+            started = time.perf_counter()
+            from deepface import DeepFace
+            from deepface.modules import preprocessing
+            _modules = (DeepFace, preprocessing)
+            _stats["import_seconds"] = round(time.perf_counter() - started, 3)
+            _stats["loaded"] = 1
+            logging.info(f"Loaded DeepFace in {_stats['import_seconds']}s")
+    return _modules
+
+
+def deepface():
+    return (_modules or _load())[0]
+
+
+def preprocessing():
+    return (_modules or _load())[1]
+
+
+# Build Facenet and run one detection and one forward pass, so the first
+# clock-in pays no import, weight loading or graph tracing cost
+def warm_up():
+    import embeddings
+
+    started = time.perf_counter()
+    _load()
+    embeddings.forward(np.zeros((1, 160, 160, 3), dtype=np.float32))
+    try:
+        embeddings.extract_faces(np.zeros((160, 160, 3), dtype=np.uint8))
+    except ValueError:
+        pass  # no face in a blank frame; the detector is loaded all the same
+    _stats["warm_up_seconds"] = round(time.perf_counter() - started, 3)
+    _stats["warm"] = 1
+    logging.info(f"Recognition warm-up finished in {_stats['warm_up_seconds']}s")
+
+
+def stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from fastapi import HTTPException, status
+
+import batching
+import embeddings
+import inference
+import metrics
+import recognition
+import thumbnails
+
+# With --workers N every API worker would load its own Facenet and detector,
+# and no worker could batch with the others. In server mode one recognition
+# process per host owns the model: workers call it over a Unix socket, the image
+# bytes (and the crops, thumbnail and vectors coming back) pass through a shared
+# memory segment per connection, and the server embeds through a single
+# MicroBatcher, so clock-ins from every worker share forward passes.
+#   RECOGNITION_MODE=local    detect and embed in the worker (default)
+#   RECOGNITION_MODE=server   call the server at RECOGNITION_SOCKET; with
+#                             RECOGNITION_FALLBACK=1 a worker that cannot reach
+#                             it recognizes in-process instead of failing
+MODE = os.getenv("RECOGNITION_MODE", "local")
+SOCKET = os.getenv("RECOGNITION_SOCKET", "/tmp/stamp-recognition.sock")
+FALLBACK = os.getenv("RECOGNITION_FALLBACK", "1") == "1"
+# Requests a worker has in flight to the server; each holds one connection
+CONCURRENCY = int(os.getenv("RECOGNITION_CONCURRENCY", "8"))
+# Initial segment size; a connection is reopened with a bigger one when an
+# upload does not fit
+SHM_BYTES = int(os.getenv("RECOGNITION_SHM_BYTES", str(4 * 1024 * 1024)))
+# The server applies INFERENCE_TIMEOUT itself; this only catches a hung server
+TIMEOUT = float(os.getenv("RECOGNITION_TIMEOUT", str(inference.TIMEOUT + 5)))
+
+HEADER = struct.Struct(">I")
+
+
+class ServerUnavailable(Exception):
+    pass
+
+
+async def _send(writer, message: dict):
+    body = json.dumps(message).encode()
+    writer.write(HEADER.pack(len(body)) + body)
+    await writer.drain()
+
+
+async def _receive(reader) -> dict:
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+def _write_parts(shm, parts: list) -> list:
+    if sum(len(part) for part in parts) > shm.size:
+        raise RuntimeError("Recognition result does not fit the shared memory segment")
+    offset = 0
+    for part in parts:
+        shm.buf[offset:offset + len(part)] = part
+        offset += len(part)
+    return [len(part) for part in parts]
+
+
+def _read_parts(shm, sizes: list) -> list:
+    parts, offset = [], 0
+    for size in sizes:
+        parts.append(bytes(shm.buf[offset:offset + size]))
+        offset += size
+    return parts
+
+
+# ---- Recognition itself, shared by the server and the in-process mode ----
+
+# Decode and detect in one inference job, timing each half.
+# extract_faces raises ValueError when there is no face.
+def _extract(image_data: bytes, timings: dict) -> list:
+    started = time.perf_counter()
+    img = embeddings.decode_image(image_data)
+    timings["decode"] = time.perf_counter() - started
+    started = time.perf_counter()
+    faces = embeddings.extract_faces(img)
+    timings["detect"] = time.perf_counter() - started
+    return faces
+
+
+async def _probe(image_data: bytes, timings: dict) -> list:
+    started = time.perf_counter()
+    faces = await inference.run(_extract, image_data, timings)
+    timings["extract"] = time.perf_counter() - started
+    started = time.perf_counter()
+    vectors = await batching.embed(faces)
+    timings["embed"] = time.perf_counter() - started
+    return vectors
+
+
+# One decode and one detection pass for a face update photo: the faces (model
+# input, box and aligned crop) plus the approval-queue thumbnail
+def _analyze_image(image_data: bytes):
+    img = embeddings.decode_image(image_data)
+    faces = embeddings.analyze_faces(img)
+    thumbnail = thumbnails.make_thumbnail(img) if len(faces) == 1 else None
+    return faces, thumbnail
+
+
+async def _analyze(image_data: bytes, timings: dict):
+    started = time.perf_counter()
+    faces, thumbnail = await inference.run(_analyze_image, image_data)
+    timings["detect"] = time.perf_counter() - started
+    vector = None
+    if len(faces) == 1:
+        started = time.perf_counter()
+        vector = (await batching.embed([faces[0]["input"]]))[0]
+        timings["embed"] = time.perf_counter() - started
+    return [{"box": face["box"], "crop": face["crop"]} for face in faces], thumbnail, vector
+
+
+# ---- Server ----
+
+def _attach(name: str):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older versions also register attached segments with this process's
+        # resource tracker, which would unlink the worker's segment on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+async def _dispatch(op: str, image_data: bytes):
+    timings = {}
+    try:
+        if op == "probe":
+            vectors = await _probe(image_data, timings)
+            return {"timings": timings}, [embeddings.to_blob(vector) for vector in vectors]
+        if op == "analyze":
+            faces, thumbnail, vector = await _analyze(image_data, timings)
+            parts = [face["crop"] for face in faces]
+            if thumbnail is not None:
+                parts.append(thumbnail)
+            if vector is not None:
+                parts.append(embeddings.to_blob(vector))
+            return {"timings": timings, "boxes": [face["box"] for face in faces],
+                    "thumbnail": thumbnail is not None, "vector": vector is not None}, parts
+        if op == "stats":
+            return {"stats": server_stats()}, []
+        return {"error": "internal", "detail": f"Unknown operation {op}"}, []
+    except ValueError as e:
+        # No face, or an image that cannot be decoded; raised again in the worker
+        return {"error": "value", "detail": str(e)}, []
+    except HTTPException as e:
+        return {"error": "http", "status": e.status_code, "detail": e.detail, "headers": e.headers}, []
+    except Exception as e:
+        logging.exception(f"Recognition server {op} failed")
+        return {"error": "internal", "detail": str(e)}, []
+
+
+_server_stats = {"connections": 0, "requests": 0, "errors": 0}
+
+
+def server_stats() -> dict:
+    return {**_server_stats, "inference": inference.stats(), "recognition": recognition.stats()}
+
+
+# One worker connection: a hello naming its segment, then one request at a time
+async def _handle(reader, writer):
+    shm = None
+    _server_stats["connections"] += 1
+    try:
+        hello = await _receive(reader)
+        shm = _attach(hello["shm"])
+        await _send(writer, {"ok": True})
+        while True:
+            request = await _receive(reader)
+            reply, parts = await _dispatch(request["op"], bytes(shm.buf[:request.get("size", 0)]))
+            _server_stats["requests"] += 1
+            if "error" in reply:
+                _server_stats["errors"] += 1
+            try:
+                reply["parts"] = _write_parts(shm, parts)
+            except RuntimeError as e:
+                reply = {"error": "internal", "detail": str(e)}
+            await _send(writer, reply)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass  # the worker closed the connection or exited
+    except Exception as e:
+        logging.error(f"Recognition server connection failed: {str(e)}")
+    finally:
+        _server_stats["connections"] -= 1
+        writer.close()
+        if shm is not None:
+            shm.close()
+
+
+async def serve(path: str = SOCKET):
+    if os.path.exists(path):
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+            writer.close()
+            raise SystemExit(f"A recognition server is already listening on {path}")
+        except ConnectionRefusedError:
+            os.unlink(path)  # left behind by a server that did not shut down cleanly
+
+    # Load the model before accepting connections, so no worker waits on it
+    if recognition.WARM_UP != "off":
+        try:
+            await asyncio.to_thread(recognition.warm_up)
+        except Exception as e:
+            logging.error(f"Recognition warm-up failed: {str(e)}")
+
+    server = await asyncio.start_unix_server(_handle, path=path)
+    os.chmod(path, 0o660)
+    logging.info(f"Recognition server listening on {path}")
+    # SIGTERM (docker stop, systemd) shuts down like Ctrl-C / pm2's SIGINT
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        logging.info("Recognition server stopped")
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# ---- Client, used by the API workers ----
+
+class Client:
+    def __init__(self, path: str = SOCKET, concurrency: int = CONCURRENCY):
+        self.path = path
+        self.concurrency = concurrency
+        self._slots = None
+        self._idle = []
+        self._stats = {"calls": 0, "in_flight": 0, "failures": 0, "fallbacks": 0, "connections": 0}
+
+    async def _connect(self, size: int):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            await _send(writer, {"shm": shm.name})
+            await _receive(reader)
+        except BaseException:
+            self._close((reader, writer, shm))
+            raise
+        self._stats["connections"] += 1
+        return reader, writer, shm
+
+    def _close(self, connection):
+        _, writer, shm = connection
+        writer.close()
+        shm.close()
+        shm.unlink()
+
+    def _discard(self, connection):
+        self._stats["connections"] -= 1
+        self._close(connection)
+
+    # One request/reply on an idle or new connection. A connection is only
+    # reused after a complete exchange; one left mid-request (error, timeout,
+    # cancelled caller) is closed.
+    async def _exchange(self, op: str, payload: bytes) -> tuple:
+        connection = self._idle.pop() if self._idle else None
+        if connection is not None and connection[2].size < len(payload):
+            self._discard(connection)
+            connection = None
+        reused = connection is not None
+        reusable = False
+        try:
+            if connection is None:
+                connection = await self._connect(max(SHM_BYTES, len(payload)))
+            reader, writer, shm = connection
+            shm.buf[:len(payload)] = payload
+            await _send(writer, {"op": op, "size": len(payload)})
+            reply = await asyncio.wait_for(_receive(reader), TIMEOUT)
+            parts = _read_parts(shm, reply.get("parts", []))
+            reusable = True
+            return reply, parts
+        except asyncio.TimeoutError:
+            self._stats["failures"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Face recognition timed out",
+                headers={"Retry-After": str(inference.RETRY_AFTER)}
+            )
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self._stats["failures"] += 1
+            if not reused:
+                raise ServerUnavailable(str(e) or type(e).__name__)
+        finally:
+            if reusable:
+                self._idle.append(connection)
+            elif connection is not None:
+                self._discard(connection)
+
+        # The server restarted since this connection was opened, so every idle
+        # one is stale too; retry once on a fresh connection
+        self.close()
+        return await self._exchange(op, payload)
+
+    # Send one request; returns (reply, binary parts). Raises ServerUnavailable
+    # when the server cannot be reached, HTTPException 504 when it hangs.
+    async def call(self, op: str, payload: bytes = b"") -> tuple:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            self._stats["calls"] += 1
+            self._stats["in_flight"] += 1
+            try:
+                reply, parts = await self._exchange(op, payload)
+            finally:
+                self._stats["in_flight"] -= 1
+
+        if reply.get("error") == "value":
+            raise ValueError(reply["detail"])
+        if reply.get("error") == "http":
+            raise HTTPException(status_code=reply["status"], detail=reply["detail"], headers=reply["headers"])
+        if reply.get("error"):
+            raise RuntimeError(reply["detail"])
+        return reply, parts
+
+    def close(self):
+        while self._idle:
+            self._discard(self._idle.pop())
+
+    def stats(self) -> dict:
+        return {"concurrency": self.concurrency, "idle_connections": len(self._idle), **self._stats}
+
+
+client = Client() if MODE == "server" else None
+
+
+# Send op to the server. Returns None when the request should run in-process:
+# in local mode, or when the server cannot be reached and fallback is on.
+async def _call(op: str, image_data: bytes):
+    if client is None:
+        return None
+    try:
+        return await client.call(op, image_data)
+    except ServerUnavailable as e:
+        if not FALLBACK:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Face recognition is unavailable, please retry",
+                headers={"Retry-After": str(inference.RETRY_AFTER)}
+            )
+        client._stats["fallbacks"] += 1
+        logging.warning(f"Recognition server unavailable ({str(e)}), recognizing in-process")
+        return None
+
+
+def _observe(endpoint: str, timings: dict):
+    if endpoint:
+        for stage, seconds in timings.items():
+            metrics.observe(endpoint, stage, seconds)
+
+
+# Embed every face in an upload (micro-batched with concurrent requests).
+# Raises ValueError when there is no face. Stage timings are recorded under
+# endpoint, if given.
+async def probe(endpoint: str, image_data: bytes) -> list:
+    started = time.perf_counter()
+    remote = await _call("probe", image_data)
+    if remote is None:
+        timings = {}
+        vectors = await _probe(image_data, timings)
+    else:
+        reply, parts = remote
+        timings = {**reply["timings"], "recognition_call": time.perf_counter() - started}
+        vectors = [embeddings.from_blob(part) for part in parts]
+    _observe(endpoint, timings)
+    return vectors
+
+
+# Detect the faces of a face update photo and, when there is exactly one,
+# embed it. Returns (faces as {"box", "crop"}, thumbnail or None, vector or None).
+async def analyze(endpoint: str, image_data: bytes):
+    started = time.perf_counter()
+    remote = await _call("analyze", image_data)
+    if remote is None:
+        timings = {}
+        faces, thumbnail, vector = await _analyze(image_data, timings)
+        _observe(endpoint, timings)
+        return faces, thumbnail, vector
+
+    reply, parts = remote
+    _observe(endpoint, {**reply["timings"], "recognition_call": time.perf_counter() - started})
+    faces = [{"box": box, "crop": crop} for box, crop in zip(reply["boxes"], parts)]
+    rest = parts[len(faces):]
+    thumbnail = rest.pop(0) if reply["thumbnail"] else None
+    vector = embeddings.from_blob(rest.pop(0)) if reply["vector"] else None
+    return faces, thumbnail, vector
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared face recognition server for the API workers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="load the model and listen on the socket")
+    serve_parser.add_argument("--socket", default=SOCKET)
+    stats_parser = subparsers.add_parser("stats", help="print a running server's counters")
+    stats_parser.add_argument("--socket", default=SOCKET)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        asyncio.run(serve(args.socket))
+    else:
+        async def run():
+            stats_client = Client(args.socket, concurrency=1)
+            try:
+                reply, _ = await stats_client.call("stats")
+                print(json.dumps(reply["stats"], indent=2))
+            finally:
+                stats_client.close()
+
+        asyncio.run(run())
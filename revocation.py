@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+import time
+
+import jwt
+
+from invalidation import channel
+
+SWEEP_SECONDS = float(os.getenv("REVOCATION_SWEEP_SECONDS", "600"))
+TOPIC = "revoked_token"
+
+# jti -> expiry (epoch seconds) of every revoked token that has not expired yet.
+# Loaded from blacklisted_tokens at startup; /logout/ on any worker reaches the
+# others through the invalidation channel.
+_revoked = {}
+_lock = threading.Lock()
+
+
+def _add(jti: str, expires_at: float):
+    with _lock:
+        _revoked[jti] = expires_at
+
+
+channel.subscribe(TOPIC, _add)
+
+
+# Short id for a token: its jti claim, or a hash of the whole token for
+# tokens issued before create_token added jti
+def token_id(token: str, payload: dict = None) -> str:
+    if payload is None:
+        payload = jwt.decode(token, options={"verify_signature": False})
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def is_revoked(jti: str) -> bool:
+    channel.poll()
+    with _lock:
+        return jti in _revoked
+
+
+# blacklisted_tokens.token holds the jti; rows written before that hold the full JWT
+async def load(cursor) -> int:
+    await cursor.execute("SELECT token, expires_at FROM blacklisted_tokens WHERE expires_at > NOW()")
+    rows = await cursor.fetchall()
+    for token, expires_at in rows:
+        jti = token_id(token) if "." in token else token
+        _add(jti, expires_at.timestamp())
+    channel.poll()
+    return len(rows)
+
+
+# Record the revocation; the caller commits and then calls publish()
+async def store(cursor, jti: str, emp_no: str, expires_at):
+    await cursor.execute(
+        "INSERT INTO blacklisted_tokens (token, emp_no, expires_at) VALUES (%s, %s, %s)",
+        (jti, emp_no, expires_at)
+    )
+
+
+def publish(jti: str, expires_at):
+    _add(jti, expires_at.timestamp())
+    channel.publish(TOPIC, jti, expires_at.timestamp())
+
+
+# Drop revocations whose tokens have expired anyway; the caller commits
+async def sweep(cursor) -> int:
+    await cursor.execute("DELETE FROM blacklisted_tokens WHERE expires_at < NOW()")
+    now = time.time()
+    with _lock:
+        for jti in [jti for jti, expires_at in _revoked.items() if expires_at <= now]:
+            del _revoked[jti]
+    return cursor.rowcount
@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import attendance
+import embeddings
+import image_store
+import ip_allowlist
+import timelogs
+
+# Tables, columns and indexes the backend relies on. They are applied once per
+# deploy, before the workers start, not in every worker's lifespan: the index
+# builds on tbl_extracted_logs can take minutes on a large table, and workers
+# starting together would race on the same DDL.
+#     python schema.py migrate
+# Concurrent runs (one per container, say) queue on a MySQL named lock, and each
+# step checks information_schema first, so running it again is a no-op.
+LOCK_NAME = "stamp_schema_migrate"
+LOCK_TIMEOUT = int(os.getenv("SCHEMA_LOCK_TIMEOUT", "600"))
+
+STEPS = [
+    ("face_embedding and approval_requests", embeddings.ensure_schema),
+    ("valid_ip", ip_allowlist.ensure_schema),
+    ("tbl_extracted_logs indexes", timelogs.ensure_schema),
+    ("image store columns", image_store.ensure_schema),
+    ("daily_attendance", attendance.ensure_schema),
+]
+
+
+async def migrate(cursor):
+    await cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    if (await cursor.fetchone())[0] != 1:
+        raise RuntimeError(f"Another schema migration held {LOCK_NAME} for more than {LOCK_TIMEOUT}s")
+    try:
+        for description, step in STEPS:
+            started = time.perf_counter()
+            await step(cursor)
+            logging.info(f"Schema up to date: {description} ({time.perf_counter() - started:.1f}s)")
+    finally:
+        await cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        await cursor.fetchone()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the database schema")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create the tables, columns and indexes the backend needs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import db_pool
+    from main import dbconnect
+
+    async def run():
+        db = await dbconnect()
+        cursor = await db.cursor()
+        try:
+            await migrate(cursor)
+            await db.commit()
+        finally:
+            await cursor.close()
+            await db.close()
+            db_pool.pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import { useEffect, useRef, useState } from "react";
+import axios from 'axios';
+
+interface AuthImageProps {
+  src: string | null;
+  alt: string;
+  className?: string;
+  // Only fetch once the image scrolls into view, for thumbnails in long lists
+  lazy?: boolean;
+}
+
+// An image served behind the API's bearer-token check: fetched with the stored
+// token and shown from an object URL, which is revoked again on unmount
+const AuthImage = ({ src, alt, className = "", lazy = false }: AuthImageProps) => {
+  const placeholder = useRef<HTMLDivElement>(null);
+  const [visible, setVisible] = useState(!lazy);
+  const [objectUrl, setObjectUrl] = useState<string | null>(null);
+  const [failed, setFailed] = useState(false);
+
+  useEffect(() => {
+    if (visible || !placeholder.current) {
+      return;
+    }
+    const observer = new IntersectionObserver((entries) => {
+      if (entries.some(entry => entry.isIntersecting)) {
+        setVisible(true);
+        observer.disconnect();
+      }
+    });
+    observer.observe(placeholder.current);
+    return () => observer.disconnect();
+  }, [visible]);
+
+  useEffect(() => {
+    if (!visible || !src) {
+      return;
+    }
+    let cancelled = false;
+    let url: string | null = null;
+    setObjectUrl(null);
+    setFailed(false);
+
+    const token = localStorage.getItem('token');
+    axios.get(src, {
+      headers: { Authorization: `Bearer ${token}` },
+      responseType: 'blob'
+    })
+      .then((response) => {
+        if (!cancelled) {
+          url = URL.createObjectURL(response.data);
+          setObjectUrl(url);
+        }
+      })
+      .catch((error) => {
+        if (!cancelled) {
+          console.error('Error fetching image:', error);
+          setFailed(true);
+        }
+      });
+
+    return () => {
+      cancelled = true;
+      if (url) {
+        URL.revokeObjectURL(url);
+      }
+    };
+  }, [visible, src]);
+
+  if (!src || failed) {
+    return <span className="text-gray-500">No Image</span>;
+  }
+  if (!objectUrl) {
+    return <div ref={placeholder} className={`${className} bg-gray-200 animate-pulse`} />;
+  }
+  return <img src={objectUrl} alt={alt} className={className} />;
+};
+
+export default AuthImage;
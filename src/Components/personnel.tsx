@@ -3,6 +3,7 @@ import Navbar from "./Navbar";
 import React from "react";
 import axios from 'axios';
 import Loading from "./loading";
+import AuthImage from "./AuthImage";
 
 interface EmployeeData {
   request_id: number;
@@ -10,7 +11,8 @@ interface EmployeeData {
   first_name: string;
   middle_name: string;
   last_name: string;
-  image: Blob | null;
+  image_url: string | null;
+  thumbnail_url: string | null;
   date_requested: string;
   approval_status: 'pending' | 'approved' | 'rejected';
   approval_date: string | null;
@@ -43,11 +45,17 @@ const Personnel = () => {
   const [modalType, setModalType] = useState<'success' | 'error'>('error');
   const [isAddIPModalOpen, setIsAddIPModalOpen] = useState(false);
   const [newIPData, setNewIPData] = useState({ ip: "" }); // Changed from ip_address to ip
+  // Full-size approval photo being viewed, fetched only when opened
+  const [viewedImage, setViewedImage] = useState<{ url: string; name: string } | null>(null);
 
   // Add these state variables after other useState declarations
   const [currentPage, setCurrentPage] = useState(1);
   const [searchTerm, setSearchTerm] = useState("");
   const logsPerPage = 8;
+  // /get_all_timelogs/ is keyset-paginated. pageCursors[i] is the cursor that
+  // starts page i + 1 (null for the first page); nextCursor is null on the last page.
+  const [pageCursors, setPageCursors] = useState<(string | null)[]>([null]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
   const fetchValidationData = async () => {
     try {
@@ -75,20 +83,14 @@ const Personnel = () => {
       }, {});
 
       const formattedData = Object.values(latestRequests).map((item: any) => {
-        const imageBlob = item.image
-          ? new Blob(
-              [Uint8Array.from(atob(item.image), c => c.charCodeAt(0))],
-              { type: 'image/jpeg' }
-            )
-          : null;
-
         return {
           request_id: item.request_id,
           emp_no: item.emp_no,
           first_name: item.first_name,
           middle_name: item.middle_name,
           last_name: item.last_name,
-          image: imageBlob,
+          image_url: item.image_url,
+          thumbnail_url: item.thumbnail_url,
           date_requested: new Date(item.date_requested).toISOString(),
           approval_status: (item.approval_status?.toLowerCase() || 'pending') as 'pending' | 'approved' | 'rejected',
           approval_date: item.approval_date ? new Date(item.approval_date).toISOString() : null
@@ -135,10 +137,8 @@ const Personnel = () => {
         first_name: item.first_name,
         middle_name: item.middle_name,
         last_name: item.last_name,
-        image: item.image ? new Blob(
-          [Uint8Array.from(atob(item.image), c => c.charCodeAt(0))],
-          { type: 'image/jpeg' }
-        ) : null,
+        image_url: item.image_url,
+        thumbnail_url: item.thumbnail_url,
         date_requested: new Date(item.date_requested).toISOString(),
         approval_status: item.approval_status.toLowerCase(),
         approval_date: item.approval_date ? new Date(item.approval_date).toISOString() : null
@@ -301,30 +301,44 @@ const Personnel = () => {
     }
   };
 
-  const fetchAllTimelogs = async () => {
+  // Fetch one page of timelogs; the search box filters on the server, by date
+  // when it holds a YYYY-MM-DD date and by employee name otherwise
+  const fetchAllTimelogs = async (page: number = 1, cursors: (string | null)[] = [null], search: string = searchTerm) => {
     try {
       const token = localStorage.getItem('token');
       if (!token) {
         throw new Error('No authentication token found');
       }
 
+      const term = search.trim();
+      const params: Record<string, string | number> = { limit: logsPerPage };
+      const cursor = cursors[page - 1];
+      if (cursor) {
+        params.cursor = cursor;
+      }
+      if (/^\d{4}-\d{2}-\d{2}$/.test(term)) {
+        params.date_from = term;
+        params.date_to = term;
+      } else if (term) {
+        params.employee = term;
+      }
+
       const response = await axios.get('http://127.0.0.1:8000/get_all_timelogs/', {
         headers: { Authorization: `Bearer ${token}` },
+        params,
         responseType: 'json'
       });
 
-      if (!response.data || !Array.isArray(response.data)) {
+      if (!response.data || !Array.isArray(response.data.items)) {
         console.error('Invalid timelog data format:', response.data);
         return;
       }
 
-      const sortedLogs = response.data.sort((a: TimelogData, b: TimelogData) => {
-        const dateA = new Date(`${a.LOG_DATE} ${a.LOG_TIME}`);
-        const dateB = new Date(`${b.LOG_DATE} ${b.LOG_TIME}`);
-        return dateB.getTime() - dateA.getTime();
-      });
-
-      setTimelogList(sortedLogs);
+      const next = response.data.next_cursor;
+      setTimelogList(response.data.items);
+      setNextCursor(next);
+      setPageCursors(next ? [...cursors.slice(0, page), next] : cursors.slice(0, page));
+      setCurrentPage(page);
     } catch (error) {
       console.error('Error fetching timelog data:', error);
     }
@@ -429,6 +443,15 @@ const Personnel = () => {
     setCurrentPage(1); // Reset to first page when changing tabs
   }, [activeTab]);
 
+  // Search the timelogs from the first page once typing pauses
+  useEffect(() => {
+    if (activeTab !== 'timelog') {
+      return;
+    }
+    const timer = setTimeout(() => fetchAllTimelogs(1, [null], searchTerm), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   const MessageModal = () => {
     if (!isModalOpen) return null;
 
@@ -450,6 +473,34 @@ const Personnel = () => {
     );
   };
 
+  // Rendered inline rather than as <ImageModal />: a component defined in here
+  // would remount on every render and fetch the full image again
+  const renderImageModal = () => {
+    if (!viewedImage) return null;
+
+    return (
+      <div
+        className="fixed inset-0 backdrop-blur-sm bg-white/30 flex items-center justify-center z-50"
+        onClick={() => setViewedImage(null)}
+      >
+        <div className="bg-white p-6 rounded-lg shadow-xl" onClick={(e) => e.stopPropagation()}>
+          <h2 className="text-xl font-bold mb-4">{viewedImage.name}</h2>
+          <AuthImage
+            src={viewedImage.url}
+            alt={viewedImage.name}
+            className="max-w-[80vw] max-h-[70vh] min-w-64 min-h-64 object-contain mx-auto"
+          />
+          <button
+            onClick={() => setViewedImage(null)}
+            className="mt-6 bg-green-600 text-white px-4 py-2 rounded hover:bg-green-700"
+          >
+            Close
+          </button>
+        </div>
+      </div>
+    );
+  };
+
   const AddIPModal = () => {
     if (!isAddIPModalOpen) return null;
 
@@ -560,19 +611,8 @@ const Personnel = () => {
     }
   };
 
-  // Add this function before the return statement
-  const filteredLogs = timelogList.filter(log =>
-    log.employee_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    log.LOG_DATE.includes(searchTerm) ||
-    log.LOG_TIME.includes(searchTerm) ||
-    log.LOG_MODE.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
-  // Modify the pagination calculations to use filteredLogs instead of timelogList
-  const indexOfLastLog = currentPage * logsPerPage;
-  const indexOfFirstLog = indexOfLastLog - logsPerPage;
-  const currentLogs = filteredLogs.slice(indexOfFirstLog, indexOfLastLog);
-  const totalPages = Math.ceil(filteredLogs.length / logsPerPage);
+  // The timelog tab holds a single page, already filtered by the server
+  const currentLogs = timelogList;
 
   return (
     <div className="w-full h-screen flex flex-col overflow-hidden">
@@ -634,12 +674,9 @@ const Personnel = () => {
               <div className="w-full mt-5">
                 <input
                   type="text"
-                  placeholder="Search by Employee Name"
+                  placeholder="Search by Employee Name or Date (YYYY-MM-DD)"
                   value={searchTerm}
-                  onChange={(e) => {
-                    setSearchTerm(e.target.value);
-                    setCurrentPage(1);
-                  }}
+                  onChange={(e) => setSearchTerm(e.target.value)}
                   className="w-full p-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
                 />
               </div>
@@ -680,15 +717,22 @@ const Personnel = () => {
                       employeeList.map((emp, index) => (
                         <tr key={index} className="hover:bg-gray-50">
                           <td className="p-2 border">
-                            {emp.image ? (
-                              <img
-                                src={URL.createObjectURL(emp.image)}
+                            <button
+                              type="button"
+                              title="View full image"
+                              onClick={() => emp.image_url && setViewedImage({
+                                url: emp.image_url,
+                                name: `${emp.first_name} ${emp.middle_name || ''} ${emp.last_name}`
+                              })}
+                              className="block mx-auto"
+                            >
+                              <AuthImage
+                                src={emp.thumbnail_url}
                                 alt="Employee"
                                 className="w-32 h-32 object-cover mx-auto"
+                                lazy
                               />
-                            ) : (
-                              <span className="text-gray-500">No Image</span>
-                            )}
+                            </button>
                           </td>
                           <td className="p-2 border">{`${emp.first_name} ${emp.middle_name || ''} ${emp.last_name}`}</td>
                           <td className="p-2 border">{new Date(emp.date_requested).toLocaleString()}</td>
@@ -717,15 +761,22 @@ const Personnel = () => {
                       historyList.map((emp, index) => (
                         <tr key={index} className="hover:bg-gray-50">
                           <td className="p-2 border">
-                            {emp.image ? (
-                              <img
-                                src={URL.createObjectURL(emp.image)}
+                            <button
+                              type="button"
+                              title="View full image"
+                              onClick={() => emp.image_url && setViewedImage({
+                                url: emp.image_url,
+                                name: `${emp.first_name} ${emp.middle_name || ''} ${emp.last_name}`
+                              })}
+                              className="block mx-auto"
+                            >
+                              <AuthImage
+                                src={emp.thumbnail_url}
                                 alt="Employee"
                                 className="w-32 h-32 object-cover mx-auto"
+                                lazy
                               />
-                            ) : (
-                              <span className="text-gray-500">No Image</span>
-                            )}
+                            </button>
                           </td>
                           <td className="p-2 border">{`${emp.first_name} ${emp.middle_name || ''} ${emp.last_name}`}</td>
                           <td className="p-2 border">{new Date(emp.date_requested).toLocaleString()}</td>
@@ -779,7 +830,7 @@ const Personnel = () => {
                                     <td className="p-2 border">{log.LOG_MODE}</td>
                                   </tr>
                                 ))}
-                                {filteredLogs.length === 0 && (
+                                {currentLogs.length === 0 && (
                                   <tr>
                                     <td colSpan={4} className="p-2 border text-center text-gray-500">
                                       No matching records found
@@ -789,11 +840,11 @@ const Personnel = () => {
                               </tbody>
                             </table>
 
-                            {/* Pagination controls using filteredLogs.length */}
-                            {filteredLogs.length > 0 && (
+                            {/* Keyset pagination: one request per page */}
+                            {(currentPage > 1 || nextCursor) && (
                               <div className="flex justify-center items-center mt-4 space-x-2">
                                 <button
-                                  onClick={() => setCurrentPage(prev => Math.max(prev - 1, 1))}
+                                  onClick={() => fetchAllTimelogs(currentPage - 1, pageCursors)}
                                   disabled={currentPage === 1}
                                   className={`px-3 py-1 rounded ${
                                     currentPage === 1 
@@ -804,13 +855,13 @@ const Personnel = () => {
                                   Previous
                                 </button>
                                 <span className="text-gray-600">
-                                  Page {currentPage} of {totalPages}
+                                  Page {currentPage}
                                 </span>
                                 <button
-                                  onClick={() => setCurrentPage(prev => Math.min(prev + 1, totalPages))}
-                                  disabled={currentPage === totalPages}
+                                  onClick={() => fetchAllTimelogs(currentPage + 1, pageCursors)}
+                                  disabled={!nextCursor}
                                   className={`px-3 py-1 rounded ${
-                                    currentPage === totalPages 
+                                    !nextCursor 
                                       ? 'bg-gray-300 cursor-not-allowed' 
                                       : 'bg-blue-500 text-white hover:bg-blue-600'
                                   }`}
@@ -858,6 +909,7 @@ const Personnel = () => {
           </div>
           <MessageModal />
           <AddIPModal />
+          {renderImageModal()}
         </>
       )}
     </div>
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep the modules under test off the shared invalidation channel in /tmp
+os.environ.setdefault("INVALIDATION_CHANNEL", os.path.join(tempfile.mkdtemp(prefix="stamp-tests-"), "invalidation.log"))
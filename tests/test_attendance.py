@@ -0,0 +1,39 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import attendance
+
+
+@pytest.mark.parametrize("month, expected", [
+    ("2024-01", date(2024, 1, 1)),
+    ("2024-12", date(2024, 12, 1)),
+])
+def test_parse_month(month, expected):
+    assert attendance.parse_month(month) == expected
+
+
+@pytest.mark.parametrize("month", ["2024-1", "2024-13", "2024-00", "24-01", "2024-01-01", "2024/01", " 2024-01", ""])
+def test_parse_month_rejects_malformed(month):
+    with pytest.raises(ValueError):
+        attendance.parse_month(month)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.params = None
+
+    async def execute(self, sql, params=None):
+        self.params = params
+
+    async def fetchall(self):
+        return []
+
+
+def test_month_report_spans_the_calendar_month():
+    cursor = RecordingCursor()
+    report = asyncio.run(attendance.month_report(cursor, "IT", date(2024, 12, 1)))
+
+    assert cursor.params == (date(2024, 12, 1), date(2025, 1, 1), "IT")
+    assert report == {"division": "IT", "month": "2024-12", "employees": []}
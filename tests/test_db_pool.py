@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from db_pool import ConnectionPool
+
+
+class FakeConnection:
+    closed = False
+    server_status = 0
+
+    async def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(max_size=2, timeout=0.2):
+    async def connect():
+        return FakeConnection()
+    return ConnectionPool(connect, min_size=0, max_size=max_size, timeout=timeout)
+
+
+def test_exhausted_pool_times_out_with_503():
+    async def scenario():
+        pool = make_pool(max_size=1, timeout=0.05)
+        held = await pool.acquire()
+        with pytest.raises(HTTPException) as raised:
+            await pool.acquire()
+        assert raised.value.status_code == 503
+        assert "Retry-After" in raised.value.headers
+        await held.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timeouts"] == 1
+    assert stats["in_use"] == 0
+
+
+def test_waiter_gets_the_released_connection():
+    async def scenario():
+        pool = make_pool(max_size=1, timeout=1)
+        held = await pool.acquire()
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        await held.close()
+        second = await asyncio.wait_for(waiting, 0.5)
+        assert second._conn is held._conn
+        await second.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["opened"] == 1
+    assert stats["waits"] == 1
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        pool = make_pool(max_size=1, timeout=1)
+        held = await pool.acquire()
+        cancelled = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        await held.close()
+        conn = await asyncio.wait_for(waiting, 0.5)
+        await conn.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["size"] == 1
+    assert stats["in_use"] == 0
+
+
+def test_discarded_connection_frees_its_slot():
+    async def scenario():
+        pool = make_pool(max_size=1, timeout=0.05)
+        held = await pool.acquire()
+        held.discard()
+        assert held._conn.closed
+        conn = await pool.acquire()
+        await conn.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["opened"] == 2
+    assert stats["size"] == 1
+
+
+def test_close_is_idempotent():
+    async def scenario():
+        pool = make_pool(max_size=1)
+        conn = await pool.acquire()
+        await conn.close()
+        await conn.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["idle"] == 1
+    assert stats["size"] == 1
@@ -0,0 +1,49 @@
+import glob
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+import embedding_backend
+
+# Aligned 160x160 crops, as embeddings.analyze_faces stores them, so the check
+# needs no face detector. They are small drawn faces: enough to compare two
+# runtimes on the same forward pass, not a recognition benchmark. Point
+# EMBEDDING_PARITY_FACES at a folder of real photos for that (one face each,
+# detected and aligned like a clock-in).
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "faces")
+MODEL = os.getenv("EMBEDDING_PARITY_MODEL", embedding_backend.ONNX_PATH)
+FACES = os.getenv("EMBEDDING_PARITY_FACES")
+TOLERANCE = float(os.getenv("EMBEDDING_PARITY_TOLERANCE", "0.02"))
+
+
+def fixture_faces() -> list:
+    faces = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.png"))):
+        crop = cv2.imread(path)
+        # BGR in [0, 1], the model input _model_input builds from a crop
+        faces.append((os.path.basename(path), crop[np.newaxis].astype(np.float32) / 255))
+    return faces
+
+
+@pytest.mark.skipif(not os.path.exists(MODEL), reason=f"no ONNX model at {MODEL}")
+def test_onnx_model_matches_deepface():
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("deepface")
+    import embeddings
+
+    faces = embedding_backend.load_faces(FACES, 200) if FACES else fixture_faces()
+    assert len(faces) >= 2
+
+    report, passed = embedding_backend.parity(MODEL, faces, embeddings.THRESHOLD, TOLERANCE)
+
+    assert passed, report
+
+
+def test_import_does_not_load_onnxruntime():
+    check = "import sys, embedding_backend; sys.exit('onnxruntime' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, "-c", check], cwd=root).returncode == 0
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import csv
+
+import pytest
+
+import embeddings
+import enroll
+import image_store
+
+
+# users holds E1 (enrolled by an earlier run, with a face) and E2 (created some
+# other way, without one)
+class FakeCursor:
+    USERS = {"E1": "e1@example.com", "E2": "e2@example.com"}
+    FACES = {"E1"}
+
+    def __init__(self):
+        self.rows = []
+
+    async def execute(self, query, params=None):
+        if "information_schema.COLUMNS" in query:
+            self.rows = [("emp_no",), ("email",), ("first_name",)]
+        elif query.startswith("SELECT emp_no FROM users"):
+            self.rows = [(emp_no,) for emp_no in params if emp_no in self.USERS]
+        elif query.startswith("SELECT email FROM users"):
+            self.rows = [(email,) for email in params if email in self.USERS.values()]
+        elif query.startswith("SELECT emp_no FROM face_image"):
+            self.rows = [(emp_no,) for emp_no in params if emp_no in self.FACES]
+        else:
+            raise AssertionError(f"unexpected query {query}")
+
+    async def fetchall(self):
+        return self.rows
+
+    async def close(self):
+        pass
+
+
+class FakeDB:
+    async def cursor(self):
+        return FakeCursor()
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_schema_changes(monkeypatch):
+    async def ensure_schema(cursor):
+        pass
+    monkeypatch.setattr(embeddings, "ensure_schema", ensure_schema)
+    monkeypatch.setattr(image_store, "ensure_schema", ensure_schema)
+
+
+def test_existing_users_without_a_face_are_reported_not_checkpointed(tmp_path):
+    source = tmp_path / "staff.csv"
+    with open(source, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["emp_no", "email", "password", "first_name"])
+        writer.writerow(["E1", "e1@example.com", "secret", "Ana"])
+        writer.writerow(["E2", "e2@example.com", "secret", "Ben"])
+    args = argparse.Namespace(csv=str(source), photos=str(tmp_path), workers=1, batch=200, role="0",
+                              checkpoint=str(tmp_path / "staff.checkpoint"),
+                              report=str(tmp_path / "staff.failures.csv"))
+
+    enrolled, failures = asyncio.run(enroll.enroll(FakeDB(), args))
+
+    assert enrolled == 0
+    assert enroll.read_checkpoint(args.checkpoint) == {"E1"}
+    assert [emp_no for emp_no, _ in failures] == ["E2"]
+    assert "without a face" in failures[0][1]
+    with open(args.report, newline="") as fh:
+        assert [row["emp_no"] for row in csv.DictReader(fh)] == ["E2"]
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import idempotency
+
+IMAGE = b"\xff\xd8 photo"
+
+
+def test_client_key_is_scoped_to_the_device_and_log_mode():
+    base = idempotency.key("kiosk:10.0.0.5", "IN", IMAGE, "retry-1")
+
+    assert idempotency.key("kiosk:10.0.0.5", "IN", b"other photo", "retry-1") == base
+    assert idempotency.key("kiosk:10.0.0.6", "IN", IMAGE, "retry-1") != base
+    assert idempotency.key("kiosk:10.0.0.5", "OUT", IMAGE, "retry-1") != base
+    assert idempotency.key("kiosk:10.0.0.5", "IN", IMAGE) != base
+
+
+def test_photo_key_covers_scope_log_and_image():
+    base = idempotency.key("E1", "IN", IMAGE)
+
+    assert idempotency.key("E1", "IN", IMAGE) == base
+    assert idempotency.key("E2", "IN", IMAGE) != base
+    assert idempotency.key("E1", "OUT", IMAGE) != base
+    assert idempotency.key("E1", "IN", IMAGE + b"!") != base
+
+
+def test_outcomes_are_published_off_the_event_loop(monkeypatch):
+    published = []
+
+    def publish(topic, message, expires_at):
+        published.append((message["state"], threading.current_thread() is threading.main_thread()))
+    monkeypatch.setattr(idempotency.channel, "publish", publish)
+    cache = idempotency.OutcomeCache(wait_seconds=0)
+    outcome = idempotency.success({"data": "E1"})
+
+    async def run():
+        assert await cache.claim("k") is None
+        await cache.release("k", outcome)
+        return await cache.claim("k")
+
+    assert asyncio.run(run()) == outcome
+    assert published == [("pending", False), ("done", False)]
+
+
+def test_released_failure_is_not_replayed(monkeypatch):
+    monkeypatch.setattr(idempotency.channel, "publish", lambda topic, message, expires_at: None)
+    cache = idempotency.OutcomeCache(wait_seconds=0)
+
+    async def run():
+        await cache.claim("k")
+        await cache.release("k")
+        return await cache.claim("k")
+
+    assert asyncio.run(run()) is None
+    assert cache.stats()["stored"] == 0
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+import image_store
+
+
+def test_filesystem_type_uses_longest_mount_point(tmp_path, monkeypatch):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "overlay / overlay rw 0 0\n"
+        "/dev/sdb1 /app/image_store ext4 rw 0 0\n"
+        "tmpfs /app/image_store\\040tmp tmpfs rw 0 0\n"
+    )
+    real_open = open
+    monkeypatch.setattr("builtins.open", lambda file, *args, **kwargs: real_open(
+        mounts if file == "/proc/mounts" else file, *args, **kwargs))
+
+    assert image_store.filesystem_type("/app") == "overlay"
+    assert image_store.filesystem_type("/app/image_store") == "ext4"
+    assert image_store.filesystem_type("/app/image_store/ab/cd") == "ext4"
+    assert image_store.filesystem_type("/app/image_store tmp") == "tmpfs"
+    assert image_store.filesystem_type("/app/image_storefoo") == "overlay"
+
+
+class UntouchedDB:
+    async def cursor(self):
+        raise AssertionError("migrate must not touch the database")
+
+
+def test_migrate_refuses_ephemeral_store(monkeypatch):
+    monkeypatch.setattr(image_store, "filesystem_type", lambda directory=image_store.ROOT: "overlay")
+
+    with pytest.raises(RuntimeError, match="--allow-ephemeral"):
+        asyncio.run(image_store.migrate(UntouchedDB()))
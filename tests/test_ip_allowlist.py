@@ -0,0 +1,91 @@
+import asyncio
+import ipaddress
+
+import pytest
+
+import ip_allowlist
+from ip_allowlist import Allowlist, PrefixTrie
+
+
+def test_exact_address_is_a_slash_32():
+    allowlist = Allowlist(["10.1.2.3", "10.9.9.9/32"])
+    assert allowlist.allows("10.1.2.3")
+    assert allowlist.allows("10.9.9.9")
+    assert not allowlist.allows("10.1.2.4")
+    assert not allowlist.allows("10.9.9.8")
+
+
+def test_cidr_range():
+    allowlist = Allowlist(["192.168.10.0/24"])
+    assert allowlist.allows("192.168.10.0")
+    assert allowlist.allows("192.168.10.255")
+    assert not allowlist.allows("192.168.11.0")
+    assert not allowlist.allows("192.168.9.255")
+
+
+def test_slash_0_allows_every_address_of_its_family():
+    allowlist = Allowlist(["0.0.0.0/0"])
+    assert allowlist.allows("1.2.3.4")
+    assert allowlist.allows("255.255.255.255")
+    assert not allowlist.allows("2001:db8::1")
+
+
+def test_empty_trie_allows_nothing():
+    trie = PrefixTrie(32)
+    assert not trie.contains(0)
+    assert not trie.contains(int(ipaddress.ip_address("10.0.0.1")))
+
+
+def test_ipv6_and_ipv4_mapped_addresses():
+    allowlist = Allowlist(["2001:db8::/32", "10.0.0.0/8"])
+    assert allowlist.allows("2001:db8:1::5")
+    assert not allowlist.allows("2001:db9::1")
+    assert allowlist.allows("::ffff:10.1.2.3")
+
+
+def test_host_bits_of_a_range_are_ignored():
+    assert Allowlist(["10.1.2.3/24"]).allows("10.1.2.200")
+    assert ip_allowlist.normalize("10.1.2.3/24") == "10.1.2.0/24"
+
+
+def test_invalid_entries_and_addresses_are_skipped():
+    allowlist = Allowlist(["not-an-ip", "300.1.1.1", "10.0.0.1"])
+    assert allowlist.size == 1
+    assert not allowlist.allows("garbage")
+
+
+@pytest.mark.parametrize("entry, canonical", [
+    ("010.001.002.003", "10.1.2.3"),
+    ("192.168.001.000/24", "192.168.1.0/24"),
+    ("10.0.0.1/32", "10.0.0.1"),
+    (" 172.16.0.1 ", "172.16.0.1"),
+    ("2001:DB8::1", "2001:db8::1"),
+])
+def test_normalize(entry, canonical):
+    assert ip_allowlist.normalize(entry) == canonical
+
+
+def test_zero_padded_legacy_rows_are_matched():
+    assert Allowlist(["010.001.002.003"]).allows("10.1.2.3")
+
+
+class RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = []
+
+    async def execute(self, query, params=None):
+        if query.startswith("UPDATE"):
+            self.updates.append(params)
+
+    async def fetchone(self):
+        return (64, "NO")
+
+    async def fetchall(self):
+        return self.rows
+
+
+def test_ensure_schema_rewrites_legacy_rows():
+    cursor = RecordingCursor([(1, "010.001.002.003"), (2, "10.0.0.0/8"), (3, "bogus")])
+    asyncio.run(ip_allowlist.ensure_schema(cursor))
+    assert cursor.updates == [("10.1.2.3", 1)]
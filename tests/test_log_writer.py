@@ -0,0 +1,159 @@
+import asyncio
+import fcntl
+import json
+import os
+
+import pytest
+
+import attendance
+import log_writer
+
+ROW_A = ["E1", "2026-10-01", "08:00:00.000000", "I", "a.jpg"]
+ROW_B = ["E2", "2026-10-01", "08:01:00.000000", "I", "b.jpg"]
+ROW_C = ["E3", "2026-10-01", "08:02:00.000000", "I", "c.jpg"]
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.found = None
+
+    async def executemany(self, query, rows):
+        if self.db.error:
+            raise self.db.error
+        self.db.staged.extend(tuple(row) for row in rows)
+
+    async def execute(self, query, params=None):
+        self.found = tuple(params) in self.db.committed
+
+    async def fetchone(self):
+        return (1,) if self.found else None
+
+    async def close(self):
+        pass
+
+
+# Rows passed to executemany become visible in committed on commit()
+class FakeDB:
+    def __init__(self, committed=(), error=None):
+        self.committed = [tuple(row) for row in committed]
+        self.staged = []
+        self.error = error
+        self.closed = 0
+
+    async def cursor(self):
+        return FakeCursor(self)
+
+    async def commit(self):
+        self.committed.extend(self.staged)
+        self.staged = []
+
+    async def close(self):
+        self.closed += 1
+
+
+def connector(db):
+    async def connect():
+        return db
+    return connect
+
+
+@pytest.fixture(autouse=True)
+def no_daily_attendance(monkeypatch):
+    async def record_many(cursor, rows):
+        pass
+    monkeypatch.setattr(attendance, "record_many", record_many)
+
+
+def journal_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("journal-"))
+
+
+def write_segment(directory, name, rows):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as fh:
+        fh.write(b"".join(json.dumps(row).encode() + b"\n" for row in rows))
+    return path
+
+
+def test_flush_inserts_queued_rows_and_removes_segments(tmp_path):
+    writer = log_writer.LogWriter(str(tmp_path), max_batch=1)
+    db = FakeDB()
+
+    async def run():
+        await writer.submit(ROW_A)
+        await writer.submit(ROW_B)
+        return await writer.flush(connector(db))
+
+    assert asyncio.run(run()) == 2
+    assert db.committed == [tuple(ROW_A), tuple(ROW_B)]
+    assert db.closed == 1
+    assert journal_files(tmp_path) == []
+    stats = writer.stats()
+    assert (stats["flushed"], stats["batches"], stats["failures"]) == (2, 1, 0)
+    assert (stats["pending"], stats["segments"]) == (0, 0)
+
+
+def test_flush_requeues_rows_when_insert_fails(tmp_path):
+    writer = log_writer.LogWriter(str(tmp_path))
+    db = FakeDB(error=RuntimeError("MySQL went away"))
+
+    async def run():
+        await writer.submit(ROW_A)
+        await writer.submit(ROW_B)
+        with pytest.raises(RuntimeError):
+            await writer.flush(connector(db))
+        # Rows journaled meanwhile queue behind the requeued ones
+        await writer.submit(ROW_C)
+        assert writer.pending_for("E1") == [ROW_A]
+        db.error = None
+        return await writer.flush(connector(db))
+
+    assert asyncio.run(run()) == 3
+    assert db.committed == [tuple(ROW_A), tuple(ROW_B), tuple(ROW_C)]
+    assert writer.stats()["failures"] == 1
+    assert writer.stats()["pending"] == 0
+    assert journal_files(tmp_path) == []
+
+
+def test_failed_flush_keeps_the_journal(tmp_path):
+    writer = log_writer.LogWriter(str(tmp_path))
+
+    async def run():
+        await writer.submit(ROW_A)
+        with pytest.raises(RuntimeError):
+            await writer.flush(connector(FakeDB(error=RuntimeError("down"))))
+
+    asyncio.run(run())
+    [name] = journal_files(tmp_path)
+    with open(tmp_path / name, "rb") as fh:
+        assert log_writer._read_records(fh) == [ROW_A]
+
+
+def test_replay_skips_segments_locked_by_a_live_worker(tmp_path):
+    live = write_segment(str(tmp_path), "journal-1-aaaa-1.log", [ROW_A])
+    write_segment(str(tmp_path), "journal-2-bbbb-1.log", [ROW_B])
+    db = FakeDB()
+
+    with open(live, "rb") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        replayed = asyncio.run(log_writer.LogWriter(str(tmp_path)).replay(connector(db)))
+
+    assert replayed == 1
+    assert db.committed == [tuple(ROW_B)]
+    assert journal_files(tmp_path) == ["journal-1-aaaa-1.log"]
+
+
+def test_replay_skips_rows_already_in_mysql(tmp_path):
+    # The crash came after the commit but before the segment was removed; the
+    # torn last line was never acknowledged
+    path = write_segment(str(tmp_path), "journal-1-aaaa-1.log", [ROW_A, ROW_B])
+    with open(path, "ab") as fh:
+        fh.write(b'["E9", "2026-10')
+    db = FakeDB(committed=[ROW_A])
+
+    replayed = asyncio.run(log_writer.LogWriter(str(tmp_path)).replay(connector(db)))
+
+    assert replayed == 1
+    assert db.committed == [tuple(ROW_A), tuple(ROW_B)]
+    assert journal_files(tmp_path) == []
@@ -0,0 +1,105 @@
+import asyncio
+import gc
+
+import pytest
+from fastapi import HTTPException
+
+import timelogs
+
+ROW = {"id": 1, "LOG_DATE": "2026-10-01", "LOG_TIME": "08:00:00 AM", "LOG_MODE": "I",
+       "emp_no": "E1", "employee_name": "A B C"}
+
+
+class FakeCursor:
+    def __init__(self, rows, error=None):
+        self.rows = list(rows)
+        self.error = error
+
+    async def execute(self, query, params=None):
+        if self.error:
+            raise self.error
+
+    async def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    async def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows=(), error=None):
+        self.cursor_ = FakeCursor(rows, error)
+        self.released = None
+
+    async def cursor(self, cursor_class=None):
+        return self.cursor_
+
+    async def close(self):
+        self.released = "closed"
+
+    def discard(self):
+        self.released = "discarded"
+
+
+def connector(conn):
+    async def connect():
+        return conn
+    return connect
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def collect_started(connect, fmt):
+    return await collect(await timelogs.start_stream(connect, fmt))
+
+
+def test_csv_export():
+    conn = FakeConnection([ROW, dict(ROW, id=2)])
+    chunks = asyncio.run(collect_started(connector(conn), "csv"))
+    assert chunks[0].startswith("id,LOG_DATE")
+    assert "".join(chunks).count("E1") == 2
+    assert conn.released == "closed"
+
+
+def test_empty_ndjson_export_releases_the_connection():
+    conn = FakeConnection([])
+    assert asyncio.run(collect_started(connector(conn), "ndjson")) == []
+    assert conn.released == "closed"
+
+
+def test_busy_pool_raises_before_the_response_starts():
+    async def connect():
+        raise HTTPException(status_code=503, detail="Database is busy, please retry")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(timelogs.start_stream(connect, "csv"))
+    assert raised.value.status_code == 503
+
+
+def test_query_error_raises_and_drops_the_connection():
+    conn = FakeConnection(error=RuntimeError("bad query"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(timelogs.start_stream(connector(conn), "csv"))
+    assert conn.released == "discarded"
+
+
+def test_abandoned_stream_drops_its_connection():
+    conn = FakeConnection([ROW] * 3)
+
+    async def scenario():
+        chunks = await timelogs.start_stream(connector(conn), "ndjson")
+        del chunks
+        gc.collect()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert conn.released == "discarded"
+
+
+def test_employee_filter_escapes_like_wildcards():
+    query, params = timelogs.build_query(employee="50%_x")
+    assert "LIKE %s" in query
+    assert params == ["%50\\%\\_x%"]
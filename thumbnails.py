@@ -0,0 +1,33 @@
+import os
+
+import cv2
+
+import embeddings
+
+# Small JPEG previews for the approval queue, generated once per request and
+# kept in the image store (approval_requests.thumbnail_hash)
+MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "160"))
+QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+
+# Downscale a BGR array so the longer side is at most max_size and encode it as JPEG
+def encode_resized(img, max_size: int, quality: int) -> bytes:
+    height, width = img.shape[:2]
+    scale = max_size / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode JPEG")
+    return encoded.tobytes()
+
+
+def resize_jpeg(image_data: bytes, max_size: int, quality: int) -> bytes:
+    return encode_resized(embeddings.decode_image(image_data), max_size, quality)
+
+
+def make_thumbnail(image_data) -> bytes:
+    if isinstance(image_data, (bytes, bytearray)):
+        image_data = embeddings.decode_image(image_data)
+    return encode_resized(image_data, MAX_SIZE, QUALITY)
@@ -0,0 +1,176 @@
+import base64
+import csv
+import io
+import json
+import os
+
+from aiomysql import SSDictCursor
+
+import db_pool
+
+PAGE_SIZE = int(os.getenv("TIMELOGS_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("TIMELOGS_MAX_PAGE_SIZE", "1000"))
+STREAM_CHUNK = int(os.getenv("TIMELOGS_STREAM_CHUNK", "1000"))
+
+COLUMNS = ["id", "LOG_DATE", "LOG_TIME", "LOG_MODE", "emp_no", "employee_name"]
+
+# Keyset pagination walks this order; both indexes keep it off a filesort
+INDEXES = {
+    "idx_logs_date_time_id": "(LOG_DATE, LOG_TIME, id)",
+    "idx_logs_emp_date_time": "(EMP_NO, LOG_DATE, LOG_TIME)",
+}
+
+
+async def ensure_schema(cursor):
+    await cursor.execute(
+        """SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'tbl_extracted_logs'"""
+    )
+    existing = {row[0] for row in await cursor.fetchall()}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            await db_pool.ddl(cursor, f"CREATE INDEX {name} ON tbl_extracted_logs {columns}")
+
+
+INSERT = """INSERT INTO tbl_extracted_logs (EMP_NO, LOG_DATE, LOG_TIME, LOG_MODE, LOG_IMG_PATH)
+            VALUES (%s, %s, %s, %s, %s)"""
+
+
+# Opaque cursor: the (LOG_DATE, LOG_TIME, id) of the last row of the previous page
+def encode_cursor(row: dict) -> str:
+    key = [str(row["LOG_DATE"]), str(row["LOG_TIME"]), row["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        log_date, log_time, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [log_date, log_time, int(log_id)]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+# Build the newest-first timelog query for the given filters
+def build_query(date_from=None, date_to=None, division=None, emp_no=None, employee=None, after=None, limit=None):
+    conditions, params = [], []
+    if date_from:
+        conditions.append("t.LOG_DATE >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("t.LOG_DATE <= %s")
+        params.append(date_to)
+    if division:
+        conditions.append("u.division_desc = %s")
+        params.append(division)
+    if emp_no:
+        conditions.append("t.emp_no = %s")
+        params.append(emp_no)
+    if employee:
+        # Substring of the employee's name, for the admin search box
+        pattern = employee.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("CONCAT_WS(' ', u.first_name, u.middle_name, u.last_name) LIKE %s")
+        params.append(f"%{pattern}%")
+    if after:
+        log_date, log_time, log_id = decode_cursor(after)
+        conditions.append(
+            """(t.LOG_DATE < %s
+                OR (t.LOG_DATE = %s AND (t.LOG_TIME < %s
+                    OR (t.LOG_TIME = %s AND t.id < %s))))"""
+        )
+        params.extend([log_date, log_date, log_time, log_time, log_id])
+
+    query = """
+        SELECT
+            t.id,
+            t.LOG_DATE,
+            t.LOG_TIME,
+            t.LOG_MODE,
+            t.emp_no,
+            CONCAT(u.first_name, ' ', u.middle_name, ' ', u.last_name) as employee_name
+        FROM tbl_extracted_logs t
+        JOIN users u ON t.emp_no = u.emp_no
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY t.LOG_DATE DESC, t.LOG_TIME DESC, t.id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+# One page plus the cursor for the next one (None on the last page)
+async def fetch_page(cursor, limit: int, **filters) -> dict:
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    query, params = build_query(limit=limit + 1, **filters)
+    await cursor.execute(query, params)
+    rows = await cursor.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+
+def _csv_chunk(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([row[column] for column in COLUMNS])
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+# Stream every matching row as NDJSON or CSV through a server-side (unbuffered)
+# cursor, STREAM_CHUNK rows at a time, so memory stays flat however large the
+# export. Use it through start_stream().
+async def stream(connect, fmt: str, **filters):
+    query, params = build_query(**filters)
+    db = await connect()
+    finished = False
+    try:
+        cursor = await db.cursor(SSDictCursor)
+        await cursor.execute(query, params)
+        if fmt == "csv":
+            yield _csv_chunk([], header=True)
+        while True:
+            rows = await cursor.fetchmany(STREAM_CHUNK)
+            if not rows:
+                break
+            yield _csv_chunk(rows) if fmt == "csv" else _ndjson_chunk(rows)
+        finished = True
+    finally:
+        if finished:
+            await cursor.close()
+            await db.close()
+        else:
+            # Closing an unfinished unbuffered cursor would read the rest of the
+            # result set; drop the connection instead
+            db.discard()
+
+
+async def _prepend(first: str, rest):
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+async def _empty():
+    return
+    yield
+
+
+# Take the connection, run the query and produce the first chunk before the
+# caller sends a status line, so a busy pool (503) or a failing query becomes
+# an error response rather than a truncated 200. Once started, the stream
+# releases its connection when finished, closed or garbage-collected, even if
+# the response is never sent.
+async def start_stream(connect, fmt: str, **filters):
+    chunks = stream(connect, fmt, **filters)
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        return _empty()
+    return _prepend(first, chunks)